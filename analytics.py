@@ -0,0 +1,285 @@
+"""Аналитика портфеля по полной истории транзакций (NumPy).
+
+История пользователя загружается в колоночные массивы, и все показатели
+считаются векторно, без цикла по сделкам:
+
+    FIFO        — себестоимость первых x купленных штук F(x) кусочно-линейна
+                  по накопленным покупкам, поэтому себестоимость продажи —
+                  это F(S1) - F(S0) через np.interp;
+    средняя     — средняя цена меняется только на покупках по рекуррентности
+                  A_k = a_k * A_(k-1) + b_k, она решается блочным сканом в
+                  логарифмах (см. _affine_scan);
+    TWR         — портфель переоценивается по ценам сделок: между сделками
+                  меняется только цена торгуемой акции, так что стоимость
+                  до и после каждой сделки — накопленная сумма приращений.
+
+Колонки истории держатся в history_cache по пользователю; повторный запрос
+дочитывает из базы только свежий хвост сделок (load_history(cached=...)).
+
+Позиции, заведённые через /api/portfolio_positions без транзакций, в
+истории не видны и в аналитику не попадают.
+"""
+import os
+from uuid import UUID
+
+from sqlalchemy import String, select, type_coerce
+
+from cache import TTLCache
+from models import Stock, Transaction
+
+METHODS = ("fifo", "average")
+MAX_SERIES_POINTS = 500
+# Блок скана средней цены и предел роста весов внутри блока: дальше
+# вычитание накопленных сумм теряет точность, и блок считается циклом
+SCAN_BLOCK = 4096
+MAX_SCAN_WEIGHT = 1e6
+# Секунды; NumPy загружается функциями аналитики при первом вызове, а не при импорте модуля
+HISTORY_OVERLAP = int(os.getenv("ANALYTICS_HISTORY_OVERLAP", "60"))
+
+# Загруженные истории по user_id: повторный запрос дочитывает только новые сделки
+history_cache = TTLCache(
+    maxsize=int(os.getenv("ANALYTICS_CACHE_USERS", "32")),
+    ttl=float(os.getenv("ANALYTICS_CACHE_TTL", "600")),
+)
+
+
+def history_query(user_id, since=None):
+    # type_coerce(String) отключает разбор UUID и дат на стороне Python:
+    # для миллиона строк это основная часть времени загрузки
+    query = select(
+        type_coerce(Transaction.stock_id, String),
+        Transaction.amount,
+        Transaction.price,
+        Transaction.type,
+        type_coerce(Transaction.created_at, String),
+    ).where(Transaction.user_id == user_id)
+    if since is not None:
+        query = query.where(Transaction.created_at >= since)
+    return query.order_by(Transaction.created_at, Transaction.id)
+
+
+def load_history(connection, user_id, cached=None):
+    """Колонки истории пользователя: коды акций, их id, количества, цены, признак продажи, время.
+
+    Если передана ранее загруженная история, дочитываются только сделки не
+    старше её конца минус HISTORY_OVERLAP: этот хвост перечитывается целиком,
+    чтобы не потерять сделки, закоммиченные позже более новых.
+    """
+    import numpy as np
+
+    since, keep = None, 0
+    if cached is not None:
+        start = cached["created"][-1] - np.timedelta64(HISTORY_OVERLAP, "s")
+        keep = int(np.searchsorted(cached["created"], start))
+        since = start.item()
+    # Строки берём прямо с DBAPI-курсора: обёртки Row для миллиона строк
+    # стоят дороже самой выборки, а обработка типов здесь не нужна
+    rows = connection.execute(history_query(user_id, since)).cursor.fetchall()
+    if not rows and not keep:
+        return None
+    index = dict(cached["index"]) if cached is not None else {}
+    stock_ids, amounts, prices, types, created = zip(*rows) if rows else ((),) * 5
+    history = {
+        "codes": np.fromiter((index.setdefault(s, len(index)) for s in stock_ids), dtype=np.int64, count=len(rows)),
+        "amount": np.array(amounts, dtype=np.int64),
+        "price": np.array(prices, dtype=np.float64),
+        "sell": np.array(types, dtype=object) == "SELL",
+        # SQLite отдаёт строки, Postgres — datetime; NumPy разбирает и то и другое
+        "created": np.array(created, dtype="datetime64[us]"),
+    }
+    if cached is not None:
+        history = {key: np.concatenate((cached[key][:keep], column)) for key, column in history.items()}
+    history["index"] = index
+    # Ключи — hex-строки SQLite или UUID драйвера Postgres; приводим к UUID
+    known = cached["stock_ids"] if cached is not None else []
+    history["stock_ids"] = known + [UUID(str(s)) for s in list(index)[len(known):]]
+    return history
+
+
+def _scan_block(a, b, carry):
+    import numpy as np
+
+    out = np.empty(len(b))
+    x = carry
+    for i, (ai, bi) in enumerate(zip(a.tolist(), b.tolist())):
+        x = ai * x + bi
+        out[i] = x
+    return out
+
+
+def _affine_scan(a, b):
+    """Решает x_k = a_k * x_(k-1) + b_k (x_(-1) = 0) для a в [0, 1].
+
+    a_k = 0 начинает новый сегмент. Внутри сегмента x_k = e^(L_k) * sum b_j e^(-L_j),
+    где L — накопленный log a; в блоке с весами e^(-L) больше MAX_SCAN_WEIGHT
+    (длинное усреднение с большими докупками) решение считается циклом.
+    """
+    import numpy as np
+
+    out = np.empty(len(b))
+    carry = 0.0
+    for start in range(0, len(b), SCAN_BLOCK):
+        aa, bb = a[start:start + SCAN_BLOCK], b[start:start + SCAN_BLOCK]
+        reset = aa == 0
+        level = np.cumsum(np.log(np.where(reset, 1.0, aa)))
+        segment = np.cumsum(reset)
+        starts = np.flatnonzero(reset)
+        relative = level - np.concatenate(([0.0], level[starts]))[segment]
+        with np.errstate(over="ignore"):
+            weights = np.exp(-relative)
+        if weights.max() > MAX_SCAN_WEIGHT:
+            block = _scan_block(aa, bb, carry)
+        else:
+            sums = np.cumsum(bb * weights)
+            before = np.concatenate(([0.0], sums[:-1]))
+            partial = sums - np.concatenate(([0.0], before[starts]))[segment]
+            block = np.exp(relative) * (np.where(segment == 0, carry, 0.0) + partial)
+        out[start:start + len(block)] = block
+        carry = block[-1]
+    return out
+
+
+def _grouped_cumsum(values, group_start):
+    import numpy as np
+
+    total = np.cumsum(values)
+    return total - np.repeat(total[group_start] - values[group_start], np.diff(np.append(group_start, len(values))))
+
+
+def compute(history, last_prices, symbols, method="fifo"):
+    """Считает P&L, веса и ряд доходности; last_prices и symbols — по кодам акций."""
+    import numpy as np
+
+    codes, amount, price, sell = (history[k] for k in ("codes", "amount", "price", "sell"))
+    day = history["created"].astype("datetime64[D]")
+    n, stocks = len(codes), len(history["stock_ids"])
+    signed = np.where(sell, -amount, amount)
+
+    # Упорядочиваем по (акция, время); история уже отсортирована по времени
+    order = np.argsort(codes, kind="stable")
+    s_code, s_amount, s_price, s_sell = codes[order], amount[order], price[order], sell[order]
+    s_signed = signed[order]
+    group_start = np.flatnonzero(np.diff(s_code, prepend=-1))
+    group_end = np.append(group_start[1:], n) - 1
+    first = np.zeros(n, dtype=bool)
+    first[group_start] = True
+
+    position_after = _grouped_cumsum(s_signed, group_start)
+    position_before = position_after - s_signed
+
+    # FIFO: F(x) — себестоимость первых x купленных штук по всем акциям подряд
+    bought = np.where(s_sell, 0, s_amount)
+    cum_bought = np.cumsum(bought)
+    cum_cost = np.cumsum(bought * s_price)
+    buys = ~s_sell
+    xp = np.concatenate(([0], cum_bought[buys])).astype(np.float64)
+    fp = np.concatenate(([0.0], cum_cost[buys]))
+    base = np.repeat(cum_bought[group_start] - bought[group_start], np.diff(np.append(group_start, n)))
+    limit = np.repeat(cum_bought[group_end], np.diff(np.append(group_start, n)))
+    sold_after = _grouped_cumsum(np.where(s_sell, s_amount, 0), group_start)
+    sold_before = sold_after - np.where(s_sell, s_amount, 0)
+    fifo_cost = (np.interp(np.minimum(base + sold_after, limit), xp, fp)
+                 - np.interp(np.minimum(base + sold_before, limit), xp, fp))
+    fifo_realized = np.where(s_sell, s_amount * s_price - fifo_cost, 0.0)
+
+    # Средняя цена: a = было/стало на покупках, 1 на продажах, 0 в начале сегмента
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = np.where(buys, position_before / position_after, 1.0)
+        b = np.where(buys & (position_after > 0), s_amount * s_price / position_after, 0.0)
+    reset = first | (buys & (position_before <= 0))
+    a = np.where(reset, 0.0, a)
+    b = np.where(first & s_sell, 0.0, b)
+    average = _affine_scan(a, b)
+    average_before = np.where(first, 0.0, np.concatenate(([0.0], average[:-1])))
+    average_realized = np.where(s_sell, s_amount * (s_price - average_before), 0.0)
+
+    realized_sorted = fifo_realized if method == "fifo" else average_realized
+    held = np.maximum(position_after[group_end], 0)
+    if method == "fifo":
+        remaining_from = np.minimum(base[group_end] + sold_after[group_end], limit[group_end])
+        cost_basis = np.interp(limit[group_end], xp, fp) - np.interp(remaining_from, xp, fp)
+    else:
+        cost_basis = held * average[group_end]
+    stock_codes = s_code[group_start]
+    market_value = held * last_prices[stock_codes]
+    realized = np.bincount(s_code, weights=realized_sorted, minlength=stocks)
+
+    # TWR по ценам сделок: стоимость до сделки = стоимость после предыдущей
+    # плюс переоценка позиции торгуемой акции к цене этой сделки
+    previous_price = np.where(first, s_price, np.concatenate(([0.0], s_price[:-1])))
+    revaluation = np.empty(n)
+    flow = np.empty(n)
+    revaluation[order] = position_before * (s_price - previous_price)
+    flow[order] = s_signed * s_price
+    # Когда портфель пуст (по точному целому числу штук), стоимость обнуляется:
+    # иначе остаток ошибки округления суммы превращается в огромную доходность
+    flat = np.cumsum(signed) <= 0
+    total = np.cumsum(revaluation + flow)
+    last_flat = np.maximum.accumulate(np.where(flat, np.arange(n), -1))
+    value_after = np.where(flat, 0.0, total - np.where(last_flat >= 0, total[last_flat], 0.0))
+    value_before = value_after - flow
+    previous_value = np.concatenate(([0.0], value_after[:-1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        period = np.where(previous_value > 0, value_before / previous_value, 1.0)
+    growth = np.exp(np.cumsum(np.log(np.maximum(period, 1e-12))))
+    final_period = market_value.sum() / value_after[-1] if value_after[-1] > 0 else 1.0
+    realized_by_time = np.empty(n)
+    realized_by_time[order] = realized_sorted
+    cumulative_realized = np.cumsum(realized_by_time)
+
+    # Ряд: последняя точка каждого дня, не больше MAX_SERIES_POINTS точек
+    last_of_day = np.flatnonzero(np.append(day[1:] != day[:-1], True))
+    if len(last_of_day) > MAX_SERIES_POINTS:
+        last_of_day = last_of_day[np.linspace(0, len(last_of_day) - 1, MAX_SERIES_POINTS).astype(np.int64)]
+    series = [
+        {"date": str(day[i]), "market_value": float(value_after[i]),
+         "realized_pnl": float(cumulative_realized[i]), "time_weighted_return": float(growth[i] - 1)}
+        for i in last_of_day
+    ]
+
+    total_value = float(market_value.sum())
+    positions = []
+    for i, code in enumerate(stock_codes.tolist()):
+        positions.append({
+            "stock_id": history["stock_ids"][code],
+            "symbol": symbols[code],
+            "amount": int(held[i]),
+            "cost_basis": float(cost_basis[i]),
+            "market_value": float(market_value[i]),
+            "weight": float(market_value[i] / total_value) if total_value > 0 else 0.0,
+            "realized_pnl": float(realized[code]),
+            "unrealized_pnl": float(market_value[i] - cost_basis[i]),
+        })
+    return {
+        "method": method,
+        "transactions": n,
+        "market_value": total_value,
+        "cost_basis": float(cost_basis.sum()),
+        "realized_pnl": float(realized.sum()),
+        "unrealized_pnl": float(total_value - cost_basis.sum()),
+        "time_weighted_return": float(growth[-1] * final_period - 1),
+        "positions": positions,
+        "series": series,
+    }
+
+
+def load_prices(connection, stock_ids):
+    """Текущие цены и тикеры для акций истории, в порядке кодов."""
+    import numpy as np
+
+    rows = connection.execute(
+        select(Stock.id, Stock.symbol, Stock.last_price).where(Stock.id.in_(stock_ids))
+    ).all()
+    found = {row[0]: (row[1], row[2] or 0.0) for row in rows}
+    symbols = [found.get(s, (None, 0.0))[0] for s in stock_ids]
+    prices = np.array([found.get(s, (None, 0.0))[1] for s in stock_ids], dtype=np.float64)
+    return symbols, prices
+
+
+def analyze(connection, user_id, method="fifo"):
+    history = load_history(connection, user_id, history_cache.get(user_id))
+    if history is None:
+        return None
+    history_cache.set(user_id, history)
+    symbols, prices = load_prices(connection, history["stock_ids"])
+    return compute(history, prices, symbols, method)
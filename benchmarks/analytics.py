@@ -0,0 +1,60 @@
+"""Время аналитики портфеля на длинной истории одного пользователя.
+
+Отдельно меряет первую загрузку колонок из базы, дочитывание хвоста к
+закэшированной истории и векторный расчёт FIFO и средней цены:
+
+    python benchmarks/analytics.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from load import ROOT, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--stocks", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    import analytics
+    from database import engine
+    from history_pagination import fill
+
+    user_id = fill(args.rows, args.stocks)
+    report = {"rows": args.rows, "stocks": args.stocks}
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        history = analytics.load_history(connection, user_id)
+        report["user_transactions"] = len(history["codes"])
+        report["cold_load_s"] = round(time.perf_counter() - started, 3)
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            history = analytics.load_history(connection, user_id, history)
+            timings.append(time.perf_counter() - started)
+        report["incremental_load_p50_s"] = round(percentile(timings, 50), 3)
+        symbols, prices = analytics.load_prices(connection, history["stock_ids"])
+
+    for method in analytics.METHODS:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            result = analytics.compute(history, prices, symbols, method)
+            timings.append(time.perf_counter() - started)
+        report[f"{method}_compute_p50_s"] = round(percentile(timings, 50), 3)
+        report[f"{method}_realized_pnl"] = round(result["realized_pnl"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
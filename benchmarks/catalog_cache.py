@@ -0,0 +1,57 @@
+"""GET /api/stocks: запросы в секунду без кэша, с кэшем и с If-None-Match.
+
+    python benchmarks/catalog_cache.py --stocks 5000 --requests 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from load import ROOT
+
+
+async def run(args):
+    import httpx
+    from catalog_cache import catalog_cache
+    from load import seed
+    from main import app
+
+    seed(args.stocks)
+    transport = httpx.ASGITransport(app=app)
+    report = {"stocks": args.stocks, "requests": args.requests}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        etag = (await client.get("/api/stocks")).headers["etag"]
+        modes = {
+            "uncached": (False, {}),
+            "cached": (True, {}),
+            "not_modified": (True, {"If-None-Match": etag}),
+        }
+        for name, (enabled, headers) in modes.items():
+            catalog_cache.enabled = enabled
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                response = await client.get("/api/stocks", headers=headers)
+                assert response.status_code in (200, 304)
+            elapsed = time.perf_counter() - started
+            report[f"{name}_rps"] = round(args.requests / elapsed, 1)
+    report["speedup"] = round(report["cached_rps"] / report["uncached_rps"], 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stocks", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
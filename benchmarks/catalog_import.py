@@ -0,0 +1,86 @@
+"""Импорт каталога: POST /api/stocks по одной акции против stock_import.py.
+
+    single_per_s — create_stock через ASGI, --single акций подряд;
+    bulk_*       — POST /api/stocks/import с листингом из --stocks акций
+                   в NDJSON: первый проход вставляет, второй обновляет цены;
+    cli_s        — import_lines (путь командной строки) на том же листинге
+                   в чистую базу.
+
+    python benchmarks/catalog_import.py --stocks 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from load import ROOT
+
+
+async def drive(args, listing):
+    import httpx
+    from main import app
+
+    report = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        for i in range(args.single):
+            response = await client.post("/api/stocks", json={
+                "symbol": f"ONE{i}", "name": f"One {i}", "currency": "USD", "last_price": 1.0,
+            })
+            response.raise_for_status()
+        report["single_per_s"] = round(args.single / (time.perf_counter() - started), 1)
+
+        # Импорт требует токен: регистрируем пользователя бенчмарка
+        response = await client.post("/api/auth/register", json={"email": "bench@example.com", "password": "bench"})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['token']}"}
+        body = ("\n".join(listing) + "\n").encode()
+        for run in ("insert", "update"):
+            if run == "update":
+                # Второй проход: те же символы с новыми ценами — все строки уходят в DO UPDATE
+                body = body.replace(b'"last_price": ', b'"last_price": 1')
+            started = time.perf_counter()
+            response = await client.post(f"/api/stocks/import?chunk={args.chunk}", headers=headers, content=body)
+            response.raise_for_status()
+            result = response.json()
+            elapsed = time.perf_counter() - started
+            report[f"bulk_{run}_s"] = round(elapsed, 2)
+            report[f"bulk_{run}_per_s"] = round(result["rows"] / elapsed, 1)
+            report[f"bulk_{run}_counts"] = {key: result[key] for key in ("inserted", "updated", "rejected")}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stocks", type=int, default=100000)
+    parser.add_argument("--single", type=int, default=1000)
+    parser.add_argument("--chunk", type=int, default=1000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    from database import Base, engine, make_engine
+    from stock_import import generate_listing, import_lines
+
+    Base.metadata.create_all(bind=engine)
+    listing = list(generate_listing(args.stocks, seed=1))
+    report = {"stocks": args.stocks, "single": args.single, "chunk": args.chunk}
+    report.update(asyncio.run(drive(args, listing)))
+    report["single_extrapolated_s"] = round(args.stocks / report["single_per_s"], 1)
+
+    cli_engine = make_engine(f"sqlite:///{os.path.join(workdir, 'cli.db')}")
+    Base.metadata.create_all(bind=cli_engine)
+    result = import_lines(cli_engine, listing, "ndjson", args.chunk)
+    report["cli_s"] = result["elapsed_s"]
+    report["cli_per_s"] = result["rows_per_sec"]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
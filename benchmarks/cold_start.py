@@ -0,0 +1,137 @@
+"""Холодный старт воркера: импорт приложения, startup и первый ответ.
+
+Каждый замер — отдельный процесс python: import main, затем TestClient
+проходит startup (миграции, восстановление очереди, фоновые задачи) и
+отдаёт GET /. База засевается --stocks акциями и один раз прогревается
+стартом приложения, так что замеры — повторный старт с актуальной схемой.
+
+    import_ms   — import main;
+    startup_ms  — обработчики startup;
+    first_ms    — первый ответ после startup;
+    total_ms    — от запуска интерпретатора до первого ответа;
+    numpy, postgres_dialect — загружены ли модули к первому ответу;
+    top_imports — самые долгие модули по python -X importtime (собственное время).
+
+С --baseline REF то же меряется на дереве из git archive REF:
+
+    python benchmarks/cold_start.py --stocks 100000 --baseline HEAD~1
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from load import ROOT
+from suite import bench_uuid
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    ready = time.perf_counter()
+    client.get("/").raise_for_status()
+    answered = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "first_ms": (answered - ready) * 1000,
+    "numpy": "numpy" in sys.modules,
+    "postgres_dialect": "sqlalchemy.dialects.postgresql" in sys.modules,
+}))
+"""
+
+SCHEMA = """
+import models
+from database import Base, engine
+Base.metadata.create_all(bind=engine)
+"""
+
+
+def run(tree, workdir, code, *flags):
+    env = dict(os.environ, PYTHONPATH=tree, BCRYPT_ROUNDS="4",
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'stock_trading.db')}")
+    return subprocess.run(
+        [sys.executable, "-W", "ignore", *flags, "-c", code],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    )
+
+
+def seed(tree, workdir, stocks):
+    run(tree, workdir, SCHEMA)
+    connection = sqlite3.connect(os.path.join(workdir, "stock_trading.db"))
+    with connection:
+        connection.executemany(
+            "INSERT INTO stocks (id, symbol, name, currency, last_price) VALUES (?, ?, ?, ?, ?)",
+            ((bench_uuid(1, i).hex, f"S{i:06d}", f"Stock {i} Holdings", "USD", 100.0) for i in range(stocks)),
+        )
+    connection.close()
+
+
+def top_imports(tree, workdir, count=10):
+    stderr = run(tree, workdir, "import main", "-X", "importtime").stderr
+    modules = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "self [us]" not in line:
+            own, _, name = line[len("import time:"):].split("|")
+            modules.append((int(own), name.strip()))
+    return [{"module": name, "ms": round(own / 1000, 1)} for own, name in sorted(modules, reverse=True)[:count]]
+
+
+def measure(tree, args):
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    seed(tree, workdir, args.stocks)
+    # Первый старт применяет миграции и прогревает файловый кэш; в отчёт не идёт
+    run(tree, workdir, PROBE)
+    samples = []
+    for _ in range(args.repeat):
+        samples.append(json.loads(run(tree, workdir, PROBE).stdout.splitlines()[-1]))
+    # Старт интерпретатора без приложения — общий для обоих деревьев
+    interpreter = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        run(tree, workdir, "pass")
+        interpreter.append((time.perf_counter() - started) * 1000)
+    report = {
+        key: round(statistics.median(sample[key] for sample in samples), 1)
+        for key in ("import_ms", "startup_ms", "first_ms")
+    }
+    report["interpreter_ms"] = round(statistics.median(interpreter), 1)
+    report["total_ms"] = round(sum(report[key] for key in ("interpreter_ms", "import_ms", "startup_ms", "first_ms")), 1)
+    report["numpy"] = samples[-1]["numpy"]
+    report["postgres_dialect"] = samples[-1]["postgres_dialect"]
+    report["top_imports"] = top_imports(tree, workdir)
+    return report
+
+
+def export(ref):
+    tree = tempfile.mkdtemp(prefix="bench-tree-")
+    archive = subprocess.run(["git", "archive", ref], cwd=ROOT, capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", tree], input=archive, check=True)
+    return tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stocks", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", metavar="REF", help="сравнить с деревом из git-ревизии")
+    args = parser.parse_args()
+
+    report = {"stocks": args.stocks, "repeat": args.repeat, "current": measure(ROOT, args)}
+    if args.baseline:
+        report["baseline_ref"] = args.baseline
+        report["baseline"] = measure(export(args.baseline), args)
+        report["total_speedup"] = round(report["baseline"]["total_ms"] / report["current"]["total_ms"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Профиль памяти потоковой выгрузки: пик не должен расти с числом строк.
+
+Для каждого размера выборки заново заполняет базу, скачивает выгрузку через
+эндпоинт /api/transactions/export под tracemalloc, отбрасывая полученные
+куски, и сравнивает пиковое потребление. Завершается с кодом 1, если пик
+любого прогона превысил --max-peak-mb (граница не зависит от числа строк)
+или вырос больше допуска:
+
+    python benchmarks/export_memory.py --rows 100000 400000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+from load import ROOT
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+async def measure(user_id, fmt):
+    import httpx
+    from main import app
+    from tokens import create_access_token
+
+    token = create_access_token({"sub": str(user_id)})
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Прогрев: импорты и пулы соединений не должны попасть в пик
+        response = await client.get("/api/transactions/history?limit=1", headers={"Authorization": f"Bearer {token}"})
+        response.raise_for_status()
+
+    # ASGITransport httpx копит всё тело ответа до конца запроса, поэтому выгрузка
+    # вызывается напрямую: куски отбрасываются сразу, как их отдал бы сервер в сокет
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/api/transactions/export", "raw_path": b"/api/transactions/export", "root_path": "",
+        "query_string": f"format={fmt}".encode(), "headers": [(b"authorization", f"Bearer {token}".encode())],
+        "server": ("bench", 80), "client": ("127.0.0.1", 1),
+    }
+    status, written = None, 0
+    requested, finished = False, asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Клиент не отключается, пока ответ не дописан
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, written
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            written += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    tracemalloc.start()
+    await app(scope, receive, send)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if status != 200:
+        raise RuntimeError(f"export answered {status}")
+    return written, peak
+
+
+def child(args):
+    sys.path.insert(0, ROOT)
+    from history_pagination import fill
+
+    user_id = fill(args.child, 50)
+    written, peak = asyncio.run(measure(user_id, args.format))
+    print(json.dumps({"rows": args.child, "bytes_written": written, "peak_mb": round(peak / 2**20, 2)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[50000, 200000])
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--max-peak-mb", type=float, default=16.0, help="граница пика для любого числа строк")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="допустимое отношение пиков")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    results = []
+    for rows in args.rows:
+        # Каждый размер — отдельный процесс со своей базой, чтобы пики не смешивались
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.db')}")
+        output = subprocess.run(
+            [sys.executable, os.path.join(HERE, "export_memory.py"), "--child", str(rows),
+             "--format", args.format],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    ratio = results[-1]["peak_mb"] / max(results[0]["peak_mb"], 0.01)
+    bounded = all(result["peak_mb"] <= args.max_peak_mb for result in results)
+    report = {"runs": results, "peak_ratio": round(ratio, 2), "flat": bounded and ratio <= args.tolerance}
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["flat"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Оценка большого портфеля в целевой валюте при многих валютах котировок.
+
+Сравнивает джойн currencies на каждую позицию в SQL с таблицей курсов в
+памяти: итоги по суммам валют (fx.total) и полную оценку с позициями
+(fx.value). Отдельно меряется сам пересчёт: поэлементный цикл Python
+против fx.RateTable.factors:
+
+    python benchmarks/fx_valuation.py --positions 50000 --currencies 150
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+from load import ROOT, percentile
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, round(percentile(timings, 50) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--positions", type=int, default=50000)
+    parser.add_argument("--currencies", type=int, default=150)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    from load import seed
+    from sqlalchemy import bindparam, func, insert, select, update
+    import fx
+    from database import engine
+    from models import Currency, Portfolio, PortfolioPosition, Stock
+
+    seed(args.positions)
+    rng = random.Random(1)
+    codes = ["USD"] + [f"C{i:03d}" for i in range(args.currencies - 1)]
+    with engine.begin() as connection:
+        fx.upsert_rates(connection, [
+            {"symbol": code, "exchange_rate": 1.0 if code == "USD" else rng.uniform(0.01, 5.0)} for code in codes
+        ])
+        portfolio_id = connection.execute(select(Portfolio.id)).scalar()
+        stock_ids = connection.execute(select(Stock.id)).scalars().all()
+        connection.execute(
+            update(Stock).where(Stock.id == bindparam("sid")).values(currency=bindparam("code")),
+            [{"sid": stock_id, "code": rng.choice(codes)} for stock_id in stock_ids],
+        )
+        connection.execute(insert(PortfolioPosition), [
+            {"id": uuid.uuid4(), "portfolio_id": portfolio_id, "stock_id": stock_id,
+             "amount": rng.randint(1, 100), "average_price": rng.uniform(50, 150)}
+            for stock_id in stock_ids
+        ])
+
+    target = codes[1]
+    report = {"positions": args.positions, "currencies": args.currencies, "target": target}
+    with engine.connect() as connection:
+        def joined():
+            # Курс подтягивается джойном на каждую позицию
+            target_rate = select(Currency.exchange_rate).where(Currency.symbol == target).scalar_subquery()
+            return connection.execute(
+                select(func.sum(PortfolioPosition.amount * Stock.last_price * Currency.exchange_rate / target_rate))
+                .join(Stock, PortfolioPosition.stock_id == Stock.id)
+                .join(Currency, Currency.symbol == Stock.currency)
+                .where(PortfolioPosition.portfolio_id == portfolio_id)
+            ).scalar()
+
+        def grouped():
+            totals = fx.load_totals(connection, portfolio_id)
+            return fx.total(totals, target, fx.rates.ensure(connection))["total_value"]
+
+        def per_position():
+            positions = fx.load_positions(connection, portfolio_id)
+            return fx.value(positions, target, fx.rates.ensure(connection))["total_value"]
+
+        joined_total, report["sql_join_total_ms"] = timed(joined, args.repeat)
+        grouped_total, report["fx_grouped_total_ms"] = timed(grouped, args.repeat)
+        detailed_total, report["fx_per_position_valuation_ms"] = timed(per_position, args.repeat)
+        report["totals_match"] = all(
+            abs(joined_total - other) <= 1e-6 * abs(joined_total) for other in (grouped_total, detailed_total)
+        )
+        report["rate_table_loads"] = fx.rates.loads
+
+        positions = fx.load_positions(connection, portfolio_id)
+        table = fx.rates.ensure(connection)
+        amount, price, currencies = positions["amount"].tolist(), positions["last_price"].tolist(), positions["currencies"]
+
+        def loop():
+            return sum(a * p * table[c] / table[target] for a, p, c in zip(amount, price, currencies))
+
+        def vectorized():
+            return float((positions["amount"] * positions["last_price"]
+                          * fx.rates.factors(currencies, target, table)).sum())
+
+        _, report["python_loop_convert_ms"] = timed(loop, args.repeat)
+        _, report["vectorized_convert_ms"] = timed(vectorized, args.repeat)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
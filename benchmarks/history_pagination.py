@@ -0,0 +1,106 @@
+"""Постоянное время выдачи страниц истории на большой таблице транзакций.
+
+Заполняет SQLite синтетической историей одного активного трейдера и
+измеряет время страницы в начале, середине и конце истории. С keyset-
+курсором и индексом (user_id, created_at, id) время не зависит от глубины:
+
+    python benchmarks/history_pagination.py --rows 10000000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from load import ROOT, percentile
+
+
+def fill(rows, stocks_count, chunk=50000):
+    from sqlalchemy import insert
+    from database import Base, engine
+    from models import Stock, Transaction, User
+
+    Base.metadata.create_all(bind=engine)
+    user_id, other_id = uuid.uuid4(), uuid.uuid4()
+    stock_ids = [uuid.uuid4() for _ in range(stocks_count)]
+    start = datetime(2020, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {"id": user_id, "email": "heavy@example.com"},
+            {"id": other_id, "email": "other@example.com"},
+        ])
+        connection.execute(insert(Stock), [
+            {"id": stock_id, "symbol": f"SYM{i}", "name": f"Stock {i}", "currency": "USD", "last_price": 100.0}
+            for i, stock_id in enumerate(stock_ids)
+        ])
+    for offset in range(0, rows, chunk):
+        batch = [
+            {
+                "id": uuid.uuid4(),
+                # Каждая десятая сделка принадлежит другому пользователю
+                "user_id": other_id if i % 10 == 0 else user_id,
+                "stock_id": stock_ids[i % stocks_count],
+                "amount": 1 + i % 7,
+                "price": 100.0,
+                "type": "BUY" if i % 3 else "SELL",
+                "created_at": start + timedelta(seconds=i),
+            }
+            for i in range(offset, min(rows, offset + chunk))
+        ]
+        with engine.begin() as connection:
+            connection.execute(insert(Transaction), batch)
+    return user_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--stocks", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    from database import engine
+    from models import Transaction
+    from pagination import encode_cursor
+    from routers.transactions import history_query
+    from sqlalchemy import select
+
+    started = time.perf_counter()
+    user_id = fill(args.rows, args.stocks)
+    report = {"rows": args.rows, "seed_s": round(time.perf_counter() - started, 1), "pages": {}}
+
+    with engine.connect() as connection:
+        ordered = (
+            select(Transaction.created_at, Transaction.id)
+            .where(Transaction.user_id == user_id)
+            .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        )
+        owned = int(args.rows * 0.9)
+        positions = {"first": None, "middle": owned // 2, "last": max(0, owned - args.limit - 1)}
+        for name, offset in positions.items():
+            cursor = None
+            if offset:
+                row = connection.execute(ordered.offset(offset).limit(1)).one()
+                cursor = encode_cursor(row.created_at, row.id)
+            timings = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                connection.execute(history_query(user_id, args.limit, cursor)).all()
+                timings.append(time.perf_counter() - t0)
+            report["pages"][name] = {
+                "p50_ms": round(percentile(timings, 50) * 1000, 3),
+                "p99_ms": round(percentile(timings, 99) * 1000, 3),
+            }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Сериализация длинных списков: модели Pydantic против serialization.py.
+
+Для каждого эндпоинта (каталог /api/stocks, позиции /api/portfolios,
+страница /api/transactions/history) строки берутся тем же запросом, что и
+в роутере, и кодируются двумя путями:
+
+    pydantic — строки -> list[схема] (from_attributes) -> dump в JSON-режиме ->
+               json.dumps, как делали FastAPI и JSONResponse до serialization.py;
+    fast_*   — serialization.encode: json (orjson, если установлен),
+               stdlib_json (orjson выключен), columnar, msgpack (если установлен).
+
+По каждому пути: медиана процессорного времени на ответ (cpu_ms), пик
+памяти под tracemalloc (peak_kib) и размер тела (bytes); same_json —
+совпадает ли разобранный JSON быстрого пути с путём Pydantic.
+
+    python benchmarks/list_serialization.py --rows 10000 --page 1000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from load import ROOT
+from suite import CHUNK, bench_uuid
+
+
+def fill(rows):
+    from database import Base, engine
+    from models import Portfolio, PortfolioPosition, Stock, Transaction, User
+
+    Base.metadata.create_all(bind=engine)
+    user_id, portfolio_id = bench_uuid(2, 0), bench_uuid(3, 0)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [{"id": user_id, "email": "bench@example.com"}])
+        connection.execute(Portfolio.__table__.insert(), [{"id": portfolio_id, "user_id": user_id}])
+    for offset in range(0, rows, CHUNK):
+        batch = range(offset, min(rows, offset + CHUNK))
+        with engine.begin() as connection:
+            connection.execute(Stock.__table__.insert(), [
+                {"id": bench_uuid(1, i), "symbol": f"S{i:06d}", "name": f"Stock {i} Holdings",
+                 "currency": "USD", "last_price": 100.0 + i % 50}
+                for i in batch
+            ])
+            connection.execute(PortfolioPosition.__table__.insert(), [
+                {"id": bench_uuid(4, i), "portfolio_id": portfolio_id, "stock_id": bench_uuid(1, i),
+                 "amount": 1 + i % 9, "average_price": 90.0 + i % 13}
+                for i in batch
+            ])
+            connection.execute(Transaction.__table__.insert(), [
+                {"id": bench_uuid(5, i), "user_id": user_id, "stock_id": bench_uuid(1, i),
+                 "amount": 1 + i % 7, "price": 100.0, "type": "BUY" if i % 3 else "SELL",
+                 "created_at": start + timedelta(seconds=i, microseconds=i % 1000)}
+                for i in batch
+            ])
+    return user_id, portfolio_id
+
+
+def endpoint_rows(user_id, portfolio_id, page):
+    """Строки и имена колонок для каждого эндпоинта — запросами роутеров."""
+    from sqlalchemy import select
+    from database import engine
+    from models import PortfolioPosition, Stock
+    from routers.transactions import history_query
+    from schemas import PortfolioPositionResponse, Stock as StockSchema, TransactionHistory
+
+    queries = {
+        "stocks": (StockSchema, select(Stock.id, Stock.symbol, Stock.name, Stock.last_price, Stock.currency)),
+        "portfolio": (PortfolioPositionResponse, select(
+            PortfolioPosition.portfolio_id,
+            Stock.name.label("stock_name"),
+            Stock.symbol.label("stock_symbol"),
+            Stock.last_price.label("current_price"),
+            PortfolioPosition.amount,
+            PortfolioPosition.average_price.label("average_purchase_price"),
+        ).join(Stock, PortfolioPosition.stock_id == Stock.id).where(PortfolioPosition.portfolio_id == portfolio_id)),
+        "history": (TransactionHistory, history_query(user_id, page - 1)),
+    }
+    found = {}
+    with engine.connect() as connection:
+        for name, (schema, query) in queries.items():
+            result = connection.execute(query)
+            found[name] = (schema, result.all(), list(result.keys()))
+    return found
+
+
+def pydantic_path(schema):
+    from pydantic import TypeAdapter
+
+    adapter = TypeAdapter(list[schema])
+
+    def render(rows):
+        # Валидация ответа и сериализация в JSON-режиме, затем JSONResponse.render
+        content = adapter.dump_python(adapter.validate_python(rows, from_attributes=True), mode="json")
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+    return render
+
+
+def measure(render, rows, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.process_time()
+        body = render(rows)
+        samples.append(time.process_time() - started)
+    tracemalloc.start()
+    render(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return body, {
+        "cpu_ms": round(statistics.median(samples) * 1000, 2),
+        "peak_kib": round(peak / 1024, 1),
+        "bytes": len(body),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="акций, позиций и сделок")
+    parser.add_argument("--page", type=int, default=1000, help="размер страницы истории (лимит эндпоинта 1000)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    import serialization
+
+    user_id, portfolio_id = fill(args.rows)
+    report = {"rows": args.rows, "page": args.page, "orjson": serialization.orjson is not None,
+              "msgpack": serialization.msgpack is not None}
+    for name, (schema, rows, keys) in endpoint_rows(user_id, portfolio_id, args.page).items():
+        paths = {"pydantic": pydantic_path(schema)}
+        for media_type, label in ((serialization.JSON, "fast_json"), (serialization.COLUMNAR, "fast_columnar")):
+            paths[label] = lambda rows, media_type=media_type: serialization.encode(schema, rows, media_type, keys)
+        if serialization.orjson is not None:
+            def stdlib(rows, orjson=serialization.orjson):
+                serialization.orjson = None
+                try:
+                    return serialization.encode(schema, rows, serialization.JSON, keys)
+                finally:
+                    serialization.orjson = orjson
+            paths["fast_stdlib_json"] = stdlib
+        if serialization.msgpack is not None:
+            paths["fast_msgpack"] = lambda rows: serialization.encode(schema, rows, serialization.MSGPACK, keys)
+
+        result = {"rows": len(rows)}
+        bodies = {}
+        for label, render in paths.items():
+            bodies[label], result[label] = measure(render, rows, args.repeat)
+        result["same_json"] = json.loads(bodies["pydantic"]) == json.loads(bodies["fast_json"])
+        result["cpu_speedup"] = round(result["pydantic"]["cpu_ms"] / max(result["fast_json"]["cpu_ms"], 1e-3), 1)
+        report[name] = result
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
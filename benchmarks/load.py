@@ -0,0 +1,137 @@
+"""Нагрузочный бенчмарк API: p50/p99 латентность и запросы в секунду.
+
+Приложение запускается в том же процессе через ASGI-транспорт httpx на
+временной SQLite базе. Чтобы сравнить «до» и «после», запустите скрипт
+на обоих коммитах с одинаковыми параметрами:
+
+    python benchmarks/load.py --requests 2000 --concurrency 64
+
+В дереве до асинхронного слоя нет ни этого каталога, ни DATABASE_URL: скрипт
+копируется в него из коммита с асинхронным слоем (seed там берёт хеш и токен
+из routers.auth) и запускается из пустого каталога, где создастся
+./stock_trading.db.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def seed(stocks_count):
+    import models
+    from database import Base, SessionLocal, engine
+    from password_hasher import hash_password
+    from tokens import create_access_token
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = models.User(
+        id=uuid.uuid4(),
+        email="bench@example.com",
+        password_hash=hash_password("bench"),
+        created_at=datetime.utcnow(),
+        updated_at=datetime.utcnow(),
+    )
+    db.add(user)
+    db.add(models.Portfolio(id=uuid.uuid4(), user_id=user.id, created_at=datetime.utcnow()))
+    stock_ids = []
+    for i in range(stocks_count):
+        stock = models.Stock(
+            id=uuid.uuid4(),
+            symbol=f"SYM{i}",
+            name=f"Stock {i}",
+            currency="USD",
+            last_price=100.0,
+            last_updated=datetime.utcnow(),
+        )
+        stock_ids.append(str(stock.id))
+        db.add(stock)
+    db.commit()
+    token = create_access_token(data={"sub": str(user.id)})
+    db.close()
+    return token, stock_ids
+
+
+async def run(args):
+    import httpx
+    from main import app
+
+    token, stock_ids = seed(args.stocks)
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies = []
+    errors = 0
+    counter = iter(range(args.requests))
+
+    async def request(client, i):
+        stock_id = stock_ids[i % len(stock_ids)]
+        if i % 4 == 0:
+            return await client.post(
+                "/api/transactions/buy",
+                json={"stock_id": stock_id, "amount": 1, "price": 100.0, "type": "BUY"},
+                headers=headers,
+            )
+        if i % 4 == 1:
+            return await client.get(f"/api/stocks/{stock_id}")
+        if i % 4 == 2:
+            return await client.get("/api/portfolios", headers=headers)
+        return await client.get("/api/users/me", headers=headers)
+
+    async def worker(client):
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            response = await request(client, i)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--stocks", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
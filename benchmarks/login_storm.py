@@ -0,0 +1,94 @@
+"""Латентность торговли во время шторма логинов.
+
+Сначала измеряет p50/p99 покупок и продаж без логинов, затем — под
+непрерывным потоком POST /api/auth/login. Для сравнения с прежним
+поведением (bcrypt в общем threadpool без ограничений):
+
+    python benchmarks/login_storm.py --workers 0 --queue-size 100000
+    python benchmarks/login_storm.py --workers 1 --queue-size 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from load import ROOT, percentile
+
+
+async def run(args):
+    import httpx
+    from load import seed
+    from main import app
+    from password_hasher import hasher
+
+    hasher.workers = args.workers
+    hasher.queue_size = args.queue_size
+    token, stock_ids = seed(args.stocks)
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+
+    async def trade(client, latencies, deadline, n):
+        i = n
+        while time.perf_counter() < deadline:
+            side = "buy" if i % 2 == 0 else "sell"
+            payload = {"stock_id": stock_ids[n % len(stock_ids)], "amount": 1, "price": 100.0, "type": side.upper()}
+            started = time.perf_counter()
+            await client.post(f"/api/transactions/{side}", json=payload, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            i += 1
+
+    async def login(client, statuses, deadline):
+        while time.perf_counter() < deadline:
+            response = await client.post("/api/auth/login", json={"email": "bench@example.com", "password": "bench"})
+            statuses[response.status_code] += 1
+            if response.status_code == 503:
+                # Клиент, уважающий Retry-After, не долбит сервер в цикле
+                await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+
+    async def phase(logins):
+        latencies, statuses = [], Counter()
+        deadline = time.perf_counter() + args.duration
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            tasks = [trade(client, latencies, deadline, n) for n in range(args.traders)]
+            tasks += [login(client, statuses, deadline) for _ in range(logins)]
+            await asyncio.gather(*tasks)
+        return {
+            "trades": len(latencies),
+            "trade_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "trade_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "logins": dict(statuses),
+        }
+
+    report = {
+        "workers": args.workers,
+        "queue_size": args.queue_size,
+        "quiet": await phase(0),
+        "storm": await phase(args.logins),
+        "hasher": hasher.stats(),
+    }
+    hasher.shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="длительность каждой фазы, секунды")
+    parser.add_argument("--traders", type=int, default=8)
+    parser.add_argument("--logins", type=int, default=200, help="одновременных клиентов логина")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--stocks", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
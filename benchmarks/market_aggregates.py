@@ -0,0 +1,172 @@
+"""Рыночные агрегаты: ad-hoc GROUP BY против счётчиков и снимка market.py.
+
+База засевается через suite.seed (пользователи, позиции), затем --trades
+сделок равномерно за последние --hours часов. Меряются:
+
+    adhoc_*    — GROUP BY по transactions / portfolio_positions на каждый вызов;
+    endpoint_* — те же ответы через /api/market/* (из памяти);
+    refresh_s, warm_s — пересборка снимка и прогрев счётчиков окна из истории;
+    record_ns  — стоимость trades.record на сделку в торговом пути.
+
+    python benchmarks/market_aggregates.py --trades 2000000 --users 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from load import ROOT
+from suite import CHUNK, bench_uuid
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 2)
+
+
+def adhoc_queries(window_minutes, stock_id):
+    from sqlalchemy import func, select
+    from models import Portfolio, PortfolioPosition, Transaction
+
+    since = datetime.utcnow() - timedelta(minutes=window_minutes)
+    most_traded = (
+        select(Transaction.stock_id, func.count(), func.sum(Transaction.amount))
+        .where(Transaction.created_at >= since)
+        .group_by(Transaction.stock_id)
+        .order_by(func.sum(Transaction.amount).desc())
+        .limit(10)
+    )
+    open_interest = (
+        select(PortfolioPosition.stock_id, func.sum(PortfolioPosition.amount), func.count())
+        .group_by(PortfolioPosition.stock_id)
+        .order_by(func.sum(PortfolioPosition.amount).desc())
+        .limit(50)
+    )
+    holders = (
+        select(Portfolio.user_id, PortfolioPosition.amount)
+        .join(Portfolio, Portfolio.id == PortfolioPosition.portfolio_id)
+        .where(PortfolioPosition.stock_id == stock_id)
+        .order_by(PortfolioPosition.amount.desc())
+        .limit(10)
+    )
+    # Окно за всё время — то, что пришлось бы считать без поминутных корзин
+    all_time = (
+        select(Transaction.stock_id, func.sum(Transaction.amount))
+        .group_by(Transaction.stock_id)
+        .order_by(func.sum(Transaction.amount).desc())
+        .limit(10)
+    )
+    return {"most_traded": most_traded, "open_interest": open_interest, "holders": holders, "all_time": all_time}
+
+
+async def endpoints(args, stock_id):
+    import httpx
+    from main import app
+
+    paths = {
+        "most_traded": f"/api/market/most-traded?minutes={args.window}",
+        "open_interest": "/api/market/open-interest",
+        "holders": f"/api/market/stocks/{stock_id}/holders",
+    }
+    report = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path in paths.values():
+            (await client.get(path)).raise_for_status()
+        for name, path in paths.items():
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                await client.get(path)
+                samples.append(time.perf_counter() - started)
+            report[f"endpoint_{name}_ms"] = round(statistics.median(samples) * 1000, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trades", type=int, default=2000000)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--window", type=int, default=60, help="окно most-traded, минут")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--stocks", type=int, default=500)
+    parser.add_argument("--positions", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    os.environ.setdefault("MARKET_WINDOW_MINUTES", str(args.window))
+    sys.path.insert(0, ROOT)
+
+    import models
+    import suite
+    from database import engine
+    from market import market, refresh
+
+    started = time.perf_counter()
+    seed_args = argparse.Namespace(
+        users=args.users, stocks=args.stocks, positions=args.positions, currencies=1,
+        transactions=0, ticks=0, seed=1, password="bench",
+    )
+    suite.seed(seed_args)
+    rng = random.Random(1)
+    stock_ids = [bench_uuid(1, i) for i in range(args.stocks)]
+    user_ids = [bench_uuid(2, i) for i in range(args.users)]
+    now = datetime.utcnow()
+    step = timedelta(hours=args.hours) / max(1, args.trades)
+    for offset in range(0, args.trades, CHUNK):
+        with engine.begin() as connection:
+            connection.execute(models.Transaction.__table__.insert(), [
+                {"id": bench_uuid(5, i), "user_id": user_ids[i % args.users],
+                 # Перекос популярности: небольшая часть акций даёт большую часть оборота
+                 "stock_id": stock_ids[min(int(rng.paretovariate(1.2)) - 1, args.stocks - 1)],
+                 "amount": rng.randint(1, 20), "price": 100.0, "type": "BUY",
+                 "created_at": now - timedelta(hours=args.hours) + step * i}
+                for i in range(offset, min(args.trades, offset + CHUNK))
+            ])
+    report = {"trades": args.trades, "hours": args.hours, "window_minutes": args.window,
+              "positions": args.users * min(args.positions, args.stocks),
+              "seed_s": round(time.perf_counter() - started, 1)}
+
+    queries = adhoc_queries(args.window, stock_ids[0])
+    with engine.connect() as connection:
+        for name, query in queries.items():
+            report[f"adhoc_{name}_ms"] = timed(lambda: connection.execute(query).all(), max(1, args.repeat // 4))
+
+    with engine.begin() as connection:
+        started = time.perf_counter()
+        refresh(connection)
+        report["refresh_s"] = round(time.perf_counter() - started, 3)
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        market.trades.warm(connection)
+        report["warm_s"] = round(time.perf_counter() - started, 3)
+        # recorded считает только живые сделки, прогрев его не трогает
+        report["window_trades"] = sum(row[1] for row in market.trades.top(args.window, args.stocks))
+        market.snapshot.load(connection)
+
+    report.update(asyncio.run(endpoints(args, stock_ids[0])))
+
+    samples = 200000
+    counters = type(market.trades)()
+    started = time.perf_counter()
+    for i in range(samples):
+        counters.record(stock_ids[i % args.stocks], 5, 100.0)
+    report["record_ns"] = round((time.perf_counter() - started) / samples * 1e9)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Накладные расходы метрик: пропускная способность API с метриками и без.
+
+Режимы чередуются раундами в одном процессе, чтобы прогрев и шум машины
+делились поровну; "capture" дополнительно сохраняет SQL для журнала
+медленных запросов (порог выставлен так, чтобы в лог ничего не писалось):
+
+    python benchmarks/metrics_overhead.py --requests 2000 --rounds 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from load import ROOT, seed
+
+
+async def run(args):
+    import httpx
+    import metrics
+    from main import app
+
+    token, stock_ids = seed(args.stocks)
+    headers = {"Authorization": f"Bearer {token}"}
+    modes = {
+        "off": (False, 0.0),
+        "on": (True, 0.0),
+        "capture": (True, 3600 * 1000.0),
+    }
+    rps = {mode: [] for mode in modes}
+
+    async def request(client, i):
+        if i % 3 == 0:
+            return await client.get(f"/api/stocks/{stock_ids[i % len(stock_ids)]}")
+        if i % 3 == 1:
+            return await client.get("/api/portfolios/value", headers=headers)
+        return await client.get("/api/users/me", headers=headers)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for round_ in range(args.rounds + 1):
+            for mode, (enabled, slow_ms) in modes.items():
+                metrics.enabled, metrics.SLOW_REQUEST_MS = enabled, slow_ms
+                counter = iter(range(args.requests))
+
+                async def worker():
+                    for i in counter:
+                        await request(client, i)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+                # Первый раунд — прогрев
+                if round_:
+                    rps[mode].append(args.requests / (time.perf_counter() - started))
+
+    report = {"requests_per_round": args.requests, "rounds": args.rounds, "concurrency": args.concurrency}
+    baseline = statistics.median(rps["off"])
+    for mode, values in rps.items():
+        report[f"{mode}_rps"] = round(statistics.median(values), 1)
+        report[f"{mode}_overhead_pct"] = round((baseline / statistics.median(values) - 1) * 100, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--stocks", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
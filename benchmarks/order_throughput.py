@@ -0,0 +1,119 @@
+"""Пропускная способность заявок: проведение в обработчике против очереди.
+
+Пользователи шлют покупки и продажи параллельно. В режиме "direct" каждая
+сделка фиксируется своим commit прямо в обработчике; в режиме "queue"
+заявка пишется в журнал order_queue, а воркер проводит их группами.
+Время режима "queue" считается до проведения последней заявки, так что
+сравниваются устойчивые заявки в секунду, а не скорость приёма:
+
+    python benchmarks/order_throughput.py --orders 3000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from load import ROOT, percentile
+
+
+def seed(users, stocks):
+    import models
+    from database import Base, engine
+    from tokens import create_access_token
+
+    Base.metadata.create_all(bind=engine)
+    now = datetime.utcnow()
+    # Id с буквой в начале hex, чтобы SQLite не принял их за числа
+    user_ids = [uuid.UUID(int=(0xA << 124) | (1 << 96) | i) for i in range(users)]
+    stock_ids = [uuid.UUID(int=(0xA << 124) | (2 << 96) | i) for i in range(stocks)]
+    with engine.begin() as connection:
+        connection.execute(models.User.__table__.insert(), [
+            {"id": user_id, "email": f"user{i}@example.com", "password_hash": "", "created_at": now, "updated_at": now}
+            for i, user_id in enumerate(user_ids)
+        ])
+        connection.execute(models.Portfolio.__table__.insert(), [
+            {"id": uuid.UUID(int=(0xA << 124) | (3 << 96) | i), "user_id": user_id, "created_at": now}
+            for i, user_id in enumerate(user_ids)
+        ])
+        connection.execute(models.Stock.__table__.insert(), [
+            {"id": stock_id, "symbol": f"SYM{i}", "name": f"Stock {i}", "currency": "USD",
+             "last_price": 100.0, "last_updated": now}
+            for i, stock_id in enumerate(stock_ids)
+        ])
+    return [create_access_token({"sub": str(user_id)}) for user_id in user_ids], [str(s) for s in stock_ids]
+
+
+async def run(args):
+    import httpx
+    from order_queue import order_queue
+    from routers import transactions
+    from main import app
+
+    tokens, stock_ids = seed(args.users, args.stocks)
+    report = {"orders": args.orders, "users": args.users, "concurrency": args.concurrency}
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for mode in ("direct", "queue"):
+            transactions.ORDER_QUEUE_ENABLED = mode == "queue"
+            rng = random.Random(args.seed)
+            # Каждая третья заявка — продажа того, что пользователь уже купил
+            plan = [(rng.randrange(args.users), rng.choice(stock_ids), "sell" if i % 3 == 2 else "buy")
+                    for i in range(args.orders)]
+            counter = iter(plan)
+            latencies, statuses = [], {}
+
+            async def worker():
+                for user, stock_id, side in counter:
+                    started = time.perf_counter()
+                    response = await client.post(
+                        f"/api/transactions/{side}",
+                        headers={"Authorization": f"Bearer {tokens[user]}"},
+                        json={"stock_id": stock_id, "amount": 1, "price": 100.0, "type": side.upper()},
+                    )
+                    latencies.append(time.perf_counter() - started)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            accepted = time.perf_counter() - started
+            await order_queue.drain()
+            elapsed = time.perf_counter() - started
+            report[mode] = {
+                "orders_per_s": round(args.orders / elapsed, 1),
+                "accept_per_s": round(args.orders / accepted, 1),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "statuses": {str(code): count for code, count in sorted(statuses.items())},
+            }
+        report["queue"].update(order_queue.stats())
+        await order_queue.stop()
+    report["speedup"] = round(report["queue"]["orders_per_s"] / report["direct"]["orders_per_s"], 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=3000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--stocks", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.setdefault("ORDER_QUEUE_PATH", os.path.join(workdir, "order_queue.log"))
+    sys.path.insert(0, ROOT)
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
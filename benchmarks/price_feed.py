@@ -0,0 +1,45 @@
+"""Пропускная способность загрузки котировок (цель — от 50k тиков/с на ядро).
+
+Тики генерируются заранее, чтобы измерялись только разбор, схлопывание
+и запись в базу:
+
+    python benchmarks/price_feed.py --ticks 1000000 --symbols 500
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from load import ROOT
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ticks", type=int, default=500000)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--window", type=float, default=0.5)
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    from load import seed
+    from database import engine
+    from price_feed import generate_ticks, ingest_lines
+
+    seed(args.symbols)
+    lines = list(generate_ticks(args.ticks, args.symbols, seed=1))
+    if args.format == "csv":
+        rows = (json.loads(line) for line in lines)
+        lines = ["symbol,price,ts"] + [f"{t['symbol']},{t['price']},{t['ts']}" for t in rows]
+
+    report = ingest_lines(engine, lines, args.format, args.window)
+    report.update(symbols=args.symbols, format=args.format, window=args.window)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Запись истории цен и чтение свечей на длинном ряду тиков.
+
+Тики растянуты на --days дней в прошлое, так что в базе оказываются
+минутные, часовые и дневные свёртки за весь период. Меряется скорость
+загрузки с записью истории и задержка чтения свечей разных интервалов
+(последние --limit свечей и весь диапазон):
+
+    python benchmarks/price_history.py --ticks 1000000 --symbols 20 --days 365
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from load import ROOT, percentile
+
+
+def history_ticks(count, symbols, days, seed=1):
+    rng = random.Random(seed)
+    prices = [100.0] * symbols
+    start = time.time() - days * 86400
+    step = days * 86400 / count
+    for i in range(count):
+        index = rng.randrange(symbols)
+        prices[index] = max(0.01, prices[index] * (1 + rng.gauss(0, 0.001)))
+        yield json.dumps({"symbol": f"SYM{index}", "price": round(prices[index], 4),
+                          "ts": start + i * step, "volume": rng.randint(1, 100)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ticks", type=int, default=1000000)
+    parser.add_argument("--symbols", type=int, default=20)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--window", type=float, default=0.5)
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    from load import seed
+    from sqlalchemy import func, select
+    import price_history
+    from database import engine
+    from models import PriceCandle, Stock
+    from price_feed import ingest_lines
+
+    seed(args.symbols)
+    lines = list(history_ticks(args.ticks, args.symbols, args.days))
+    report = {"ingest": ingest_lines(engine, lines, "ndjson", args.window)}
+    report.update(symbols=args.symbols, days=args.days, price_history=price_history.ENABLED)
+
+    with engine.connect() as connection:
+        report["candles_stored"] = connection.execute(select(func.count()).select_from(PriceCandle)).scalar()
+        stock_id = connection.execute(select(Stock.id).where(Stock.symbol == "SYM0")).scalar()
+        queries = {}
+        for interval in ("30s", "1m", "5m", "1h", "4h", "1d", "1w"):
+            seconds = price_history.parse_interval(interval)
+            for label, start, limit in (
+                ("recent", None, args.limit),
+                ("full", time.time() - args.days * 86400, price_history.MAX_CANDLES),
+            ):
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    result = price_history.candles(connection, stock_id, seconds, start, None, limit)
+                    timings.append(time.perf_counter() - started)
+                queries[f"{interval}_{label}"] = {
+                    "candles": len(result),
+                    "p50_ms": round(percentile(timings, 50) * 1000, 2),
+                }
+        report["queries"] = queries
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
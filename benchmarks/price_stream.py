@@ -0,0 +1,88 @@
+"""Рассылка цен на 10k одновременных подписчиков.
+
+Каждый подписчик — корутина, читающая свою подписку; часть из них
+искусственно медленная. Измеряется время публикации, задержка доставки
+и число схлопнутых обновлений у медленных клиентов:
+
+    python benchmarks/price_stream.py --subscribers 10000 --updates 2000
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime
+
+from load import ROOT, percentile
+
+
+async def run(args):
+    from price_stream import PriceBroker
+
+    broker = PriceBroker()
+    rng = random.Random(1)
+    symbols = [f"SYM{i}" for i in range(args.symbols)]
+    latencies = []
+    sent_at = {}
+    subscriptions = []
+
+    async def consume(subscription, slow):
+        while True:
+            updates = await subscription.get()
+            now = time.perf_counter()
+            latencies.extend(now - sent_at[update["price"]] for update in updates)
+            if slow:
+                await asyncio.sleep(0.05)
+
+    tasks = []
+    for i in range(args.subscribers):
+        subscription = broker.subscribe(rng.sample(symbols, args.per_subscriber))
+        subscriptions.append(subscription)
+        tasks.append(asyncio.create_task(consume(subscription, i % 100 < args.slow_percent)))
+    await asyncio.sleep(0)
+
+    publish_times = []
+    started = time.perf_counter()
+    for i in range(args.updates):
+        change = {"symbol": rng.choice(symbols), "price": 100.0 + i, "ts": datetime.utcnow()}
+        t0 = sent_at[change["price"]] = time.perf_counter()
+        broker.publish([change])
+        publish_times.append(time.perf_counter() - t0)
+        if i % args.yield_every == 0:
+            await asyncio.sleep(0)
+    await asyncio.sleep(0.2)
+    elapsed = time.perf_counter() - started
+
+    for task in tasks:
+        task.cancel()
+
+    return {
+        "subscribers": args.subscribers,
+        "updates_published": args.updates,
+        "deliveries": sum(s.delivered for s in subscriptions),
+        "conflated": sum(s.conflated for s in subscriptions),
+        "elapsed_s": round(elapsed, 3),
+        "publish_p50_us": round(percentile(publish_times, 50) * 1e6, 1),
+        "publish_p99_us": round(percentile(publish_times, 99) * 1e6, 1),
+        "delivery_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "delivery_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--per-subscriber", type=int, default=20)
+    parser.add_argument("--slow-percent", type=int, default=5)
+    parser.add_argument("--yield-every", type=int, default=10)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Регрессионный прогон бюджетов SQL-запросов по всем маршрутам API.
+
+Каждый маршрут вызывается на временной базе так же, как его вызывает
+клиент; число SQL-запросов сравнивается с query_budget.ROUTE_BUDGETS и
+проверяется на N+1. Скрипт завершается с кодом 1, если какой-то маршрут
+вышел за бюджет или у маршрута приложения нет ни бюджета, ни сценария:
+
+    python benchmarks/query_budgets.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import uuid
+
+from load import ROOT, seed
+
+# Долгоживущие потоки: проверяются только в dev-режиме через middleware
+SKIPPED = {("GET", "/api/stream/prices/sse")}
+
+
+async def run(args):
+    import httpx
+    import query_budget
+    from sqlalchemy import select
+    from database import engine
+    from main import app
+    from models import PortfolioPosition
+
+    token, stock_ids = seed(args.stocks)
+    headers = {"Authorization": f"Bearer {token}"}
+    results = []
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://budget") as client:
+        async def call(method, route, url, **kwargs):
+            with query_budget.count_queries() as query_log:
+                response = await client.request(method, url, **kwargs)
+            results.append({
+                "route": f"{method} {route}",
+                "status": response.status_code,
+                "queries": query_log.count,
+                "budget": query_budget.ROUTE_BUDGETS.get((method, route)),
+                "problems": query_budget.route_problems(method, route, query_log),
+            })
+            return response
+
+        stock_id = stock_ids[0]
+        order = {"stock_id": stock_id, "amount": 5, "price": 100.0, "type": "BUY"}
+        credentials = {"email": "budget@example.com", "password": "budget"}
+        await call("GET", "/", "/")
+        await call("POST", "/api/auth/register", "/api/auth/register", json=credentials)
+        await call("POST", "/api/auth/login", "/api/auth/login", json=credentials)
+        await call("GET", "/api/users/me", "/api/users/me", headers=headers)
+        await call("GET", "/api/users/cache/stats", "/api/users/cache/stats", headers=headers)
+        await call("GET", "/api/stocks", "/api/stocks")
+        await call("GET", "/api/stocks/{stock_id}", f"/api/stocks/{stock_id}")
+        await call("POST", "/api/stocks", "/api/stocks",
+                   json={"symbol": "BUDGET", "name": "Budget", "currency": "USD", "last_price": 10.0})
+        ticks = "\n".join(json.dumps({"symbol": f"SYM{i}", "price": 101.0 + i}) for i in range(args.stocks))
+        await call("POST", "/api/stocks/ticks", "/api/stocks/ticks?window=0", content=ticks, headers=headers)
+        await call("POST", "/api/stocks/import", "/api/stocks/import",
+                   content="symbol,name,last_price\nSYM0,Renamed,100.5\nIMPORTED,Imported,5\n",
+                   headers={**headers, "content-type": "text/csv"})
+        await call("GET", "/api/stocks/search", "/api/stocks/search?q=sym")
+        await call("GET", "/api/stocks/{stock_id}/candles", f"/api/stocks/{stock_id}/candles?interval=30s")
+        await call("PUT", "/api/currencies/rates", "/api/currencies/rates",
+                   json={"rates": [{"symbol": "USD", "exchange_rate": 1.0}, {"symbol": "EUR", "exchange_rate": 1.1}]},
+                   headers=headers)
+        await call("GET", "/api/currencies", "/api/currencies")
+        await call("GET", "/api/currencies/stats", "/api/currencies/stats")
+        await call("POST", "/api/transactions/buy", "/api/transactions/buy", json=order, headers=headers)
+        await call("POST", "/api/transactions/sell", "/api/transactions/sell",
+                   json={**order, "amount": 1, "type": "SELL"}, headers=headers)
+        await call("POST", "/api/transactions/batch", "/api/transactions/batch", headers=headers, json={
+            "orders": [{**order, "stock_id": sid} for sid in stock_ids[:args.batch]],
+        })
+        await call("POST", "/api/transactions", "/api/transactions", json=order, headers=headers)
+        await call("POST", "/api/transaction", "/api/transaction", json=order)
+        await call("GET", "/api/orders/{order_id}", f"/api/orders/{uuid.uuid4()}", headers=headers)
+        await call("GET", "/api/transactions/history", "/api/transactions/history", headers=headers)
+        await call("GET", "/api/transactions/export", "/api/transactions/export", headers=headers)
+        response = await call("GET", "/api/portfolios", "/api/portfolios", headers=headers)
+        portfolio_id = response.json()[0]["portfolio_id"]
+        await call("GET", "/api/portfolios/value", "/api/portfolios/value", headers=headers)
+        await call("GET", "/api/portfolios/value", "/api/portfolios/value?currency=EUR", headers=headers)
+        await call("GET", "/api/portfolios/valuation", "/api/portfolios/valuation?currency=EUR", headers=headers)
+        await call("GET", "/api/portfolios/analytics", "/api/portfolios/analytics", headers=headers)
+        await call("POST", "/api/portfolio_positions", "/api/portfolio_positions", headers=headers, json={
+            "portfolio_id": portfolio_id, "stock_id": stock_ids[-1], "amount": 3, "average_price": 90.0,
+        })
+        await call("GET", "/api/portfolios/{portfolio_id}/positions", f"/api/portfolios/{portfolio_id}/positions")
+        # Ответ создания позиции не содержит её id — берём из базы
+        with engine.connect() as connection:
+            position_id = connection.execute(
+                select(PortfolioPosition.id).where(PortfolioPosition.stock_id == uuid.UUID(stock_ids[-1]))
+            ).scalar()
+        await call("DELETE", "/api/portfolio_positions/{position_id}",
+                   f"/api/portfolio_positions/{position_id}", headers=headers)
+        await call("GET", "/api/market/most-traded", "/api/market/most-traded?minutes=5")
+        await call("GET", "/api/market/open-interest", "/api/market/open-interest")
+        await call("GET", "/api/market/stocks/{stock_id}/holders", f"/api/market/stocks/{stock_id}/holders")
+        await call("GET", "/metrics", "/metrics")
+
+    covered = {tuple(result["route"].split(" ", 1)) for result in results} | SKIPPED
+    # Список маршрутов берётся из схемы OpenAPI: в ней все HTTP-маршруты подключённых роутеров
+    uncovered = sorted(
+        f"{method.upper()} {path}"
+        for path, operations in app.openapi()["paths"].items()
+        for method in operations
+        if (method.upper(), path) not in covered
+    )
+    return results, uncovered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stocks", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=10, help="разных акций в пакетной заявке")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    results, uncovered = asyncio.run(run(args))
+    failed = [result for result in results if result["problems"] or result["status"] >= 500]
+    print(json.dumps({"routes": results, "uncovered": uncovered, "failed": len(failed) + len(uncovered)}, indent=2))
+    sys.exit(1 if failed or uncovered else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Чтение и запись под смешанной нагрузкой: профили настройки SQLite.
+
+Одновременно работают читатели (каталог, акция, портфель, история) и
+писатели (покупки и продажи) в течение --seconds секунд. Каждый профиль
+запускается в отдельном процессе, потому что настройки движка читаются
+из окружения при импорте database.py:
+
+    default — журнал DELETE, synchronous=FULL, общий пул на чтение и запись;
+    tuned   — настройки по умолчанию: WAL, synchronous=NORMAL, mmap, кэш,
+              пул query_only для GET и единственное соединение записи.
+
+    python benchmarks/sqlite_profile.py --seconds 10 --readers 32 --writers 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from load import ROOT, percentile
+
+PROFILES = {
+    "default": {
+        "SQLITE_JOURNAL_MODE": "DELETE",
+        "SQLITE_SYNCHRONOUS": "FULL",
+        "SQLITE_MMAP_SIZE": "0",
+        "SQLITE_CACHE_SIZE": "-2000",
+        "SQLITE_TEMP_STORE": "DEFAULT",
+        "DB_SEPARATE_READ_POOL": "0",
+        "DB_WRITE_POOL_SIZE": "10",
+        "DB_WRITE_MAX_OVERFLOW": "20",
+    },
+    "tuned": {},
+}
+
+
+async def run(args):
+    import httpx
+    from main import app
+    from order_throughput import seed
+
+    tokens, stock_ids = seed(args.users, args.stocks)
+    stats = {kind: {"latencies": [], "errors": 0} for kind in ("read", "write")}
+    deadline = time.perf_counter() + args.seconds
+
+    async def read(client, rng):
+        headers = {"Authorization": f"Bearer {rng.choice(tokens)}"}
+        choice = rng.randrange(4)
+        if choice == 0:
+            return await client.get("/api/stocks")
+        if choice == 1:
+            return await client.get(f"/api/stocks/{rng.choice(stock_ids)}")
+        if choice == 2:
+            return await client.get("/api/portfolios/value", headers=headers)
+        return await client.get("/api/transactions/history?limit=20", headers=headers)
+
+    async def write(client, rng):
+        side = "sell" if rng.random() < 0.3 else "buy"
+        return await client.post(
+            f"/api/transactions/{side}",
+            headers={"Authorization": f"Bearer {rng.choice(tokens)}"},
+            json={"stock_id": rng.choice(stock_ids), "amount": 1, "price": 100.0, "type": side.upper()},
+        )
+
+    async def worker(client, kind, request, rng):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await request(client, rng)
+            stats[kind]["latencies"].append(time.perf_counter() - started)
+            # 404 пустой истории и 400 продажи без позиции — ответы по делу, не ошибки
+            if response.status_code >= 500:
+                stats[kind]["errors"] += 1
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await asyncio.gather(
+            *(worker(client, "read", read, random.Random(i)) for i in range(args.readers)),
+            *(worker(client, "write", write, random.Random(-1 - i)) for i in range(args.writers)),
+        )
+
+    return {
+        kind: {
+            "requests_per_s": round(len(data["latencies"]) / args.seconds, 1),
+            "p50_ms": round(percentile(data["latencies"], 50) * 1000, 2),
+            "p99_ms": round(percentile(data["latencies"], 99) * 1000, 2),
+            "errors_5xx": data["errors"],
+        }
+        for kind, data in stats.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=32)
+    parser.add_argument("--writers", type=int, default=32)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--stocks", type=int, default=50)
+    parser.add_argument("--profile", choices=sorted(PROFILES), help="прогнать один профиль в этом процессе")
+    args = parser.parse_args()
+
+    if args.profile:
+        workdir = tempfile.mkdtemp(prefix="bench-")
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        sys.path.insert(0, ROOT)
+        print(json.dumps(asyncio.run(run(args))))
+        return
+
+    report = {"seconds": args.seconds, "readers": args.readers, "writers": args.writers}
+    for profile, env in PROFILES.items():
+        command = [sys.executable, os.path.abspath(__file__), "--profile", profile]
+        for option in ("seconds", "readers", "writers", "users", "stocks"):
+            command += [f"--{option}", str(getattr(args, option))]
+        output = subprocess.run(
+            command, env={**os.environ, **env}, capture_output=True, text=True, check=True
+        ).stdout
+        report[profile] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Поиск акций: индекс search_index.py против LIKE по таблице stocks.
+
+Каталог из --stocks синтетических бумаг (символ 3–5 букв, название из
+двух-трёх слов). Для каждого вида запроса меряются медианы:
+
+    index_*_us — SearchIndex.search в памяти, микросекунды;
+    like_*_us  — symbol LIKE 'q%' OR name LIKE '%q%' ORDER BY symbol LIMIT n;
+    endpoint_us — GET /api/stocks/search целиком через ASGI;
+    build_s, add_us — сборка индекса с нуля и добавление одной акции.
+
+    python benchmarks/stock_search.py --stocks 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from load import ROOT
+from suite import CHUNK, bench_uuid
+
+WORDS = [
+    "global", "energy", "capital", "holdings", "systems", "pharma", "digital", "mining", "foods",
+    "motors", "bank", "industries", "networks", "solar", "logistics", "media", "health", "steel",
+    "airlines", "semiconductor", "retail", "insurance", "chemicals", "water", "realty", "gold",
+]
+SUFFIXES = ["inc", "corp", "plc", "group", "ltd", "sa", "ag"]
+
+
+def catalog(count, rng):
+    symbols = set()
+    while len(symbols) < count:
+        symbols.add("".join(rng.choices(string.ascii_uppercase, k=rng.randint(3, 5))))
+    for i, symbol in enumerate(sorted(symbols)):
+        words = rng.sample(WORDS, rng.randint(1, 2)) + [rng.choice(SUFFIXES)]
+        yield {"id": bench_uuid(1, i), "symbol": symbol, "name": " ".join(words).title(),
+               "currency": "USD", "last_price": 100.0, "last_updated": datetime.utcnow()}
+
+
+def median_us(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1e6, 1)
+
+
+async def endpoint_us(query, limit, repeat):
+    import httpx
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        path = f"/api/stocks/search?q={query}&limit={limit}"
+        (await client.get(path)).raise_for_status()
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await client.get(path)
+            samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1e6, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stocks", type=int, default=100000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    sys.path.insert(0, ROOT)
+
+    from sqlalchemy import or_, select
+    import models
+    from database import Base, engine
+    from search_index import search_index
+
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(1)
+    rows = list(catalog(args.stocks, rng))
+    for offset in range(0, len(rows), CHUNK):
+        with engine.begin() as connection:
+            connection.execute(models.Stock.__table__.insert(), rows[offset:offset + CHUNK])
+
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        search_index.build(connection)
+    report = {"stocks": len(search_index), "build_s": round(time.perf_counter() - started, 2)}
+    report.update({f"index_{key}": value for key, value in search_index.stats().items()})
+
+    sample = rows[len(rows) // 2]
+    queries = {
+        "exact": sample["symbol"],
+        "symbol_prefix": sample["symbol"][:2],
+        "name_prefix": sample["name"].split()[0][:4],
+        "words": " ".join(word[:3] for word in sample["name"].split()[:2]),
+        "substring": sample["name"].split()[0][2:6],
+        "miss": "zzzzq",
+    }
+    stock = models.Stock
+    with engine.connect() as connection:
+        for kind, query in queries.items():
+            report[f"index_{kind}_us"] = median_us(lambda: search_index.search(query, args.limit), args.repeat)
+            like = (
+                select(stock.id, stock.symbol, stock.name, stock.currency)
+                .where(or_(stock.symbol.like(f"{query}%"), stock.name.like(f"%{query}%")))
+                .order_by(stock.symbol)
+                .limit(args.limit)
+            )
+            report[f"like_{kind}_us"] = median_us(lambda: connection.execute(like).all(), max(5, args.repeat // 20))
+
+    report["endpoint_us"] = asyncio.run(endpoint_us(queries["symbol_prefix"], args.limit, args.repeat))
+    report["add_us"] = median_us(
+        lambda: search_index.add(sample["id"], sample["symbol"], sample["name"], sample["currency"]), args.repeat
+    )
+    report["queries"] = queries
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
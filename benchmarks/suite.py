@@ -0,0 +1,411 @@
+"""Полный бенчмарк API: реалистичные объёмы данных и сценарий торговли.
+
+Засевает базу пользователями с портфелями и позициями, каталогом акций
+в нескольких валютах, историей цен и миллионами транзакций, затем гоняет
+все HTTP-маршруты из routers/ взвешенной смесью через ASGI-транспорт
+httpx и пишет JSON-отчёт: пропускную способность и перцентили задержки
+по каждому маршруту. WebSocket и SSE здесь не участвуют — для них есть
+benchmarks/price_stream.py.
+
+База — временная SQLite; для Postgres задайте DATABASE_URL (и при
+необходимости ASYNC_DATABASE_URL) на пустую базу:
+
+    python benchmarks/suite.py --transactions 5000000 --output before.json
+    python benchmarks/suite.py --transactions 5000000 --output after.json
+    python benchmarks/suite.py --compare before.json after.json --threshold 10
+
+В режиме сравнения регрессией считается рост p50/p99 маршрута или
+падение общей пропускной способности больше чем на threshold процентов;
+при регрессиях код выхода 1.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from load import ROOT, percentile
+
+CHUNK = 50000
+
+
+def bench_uuid(kind: int, index: int) -> uuid.UUID:
+    # Детерминированные id; буква в начале hex нужна базам, созданным до
+    # миграции sqlite_uuid_text, где колонки UUID имели NUMERIC-аффинность
+    return uuid.UUID(int=(0xA << 124) | (kind << 96) | index)
+
+
+def _insert_chunks(connection, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == CHUNK:
+            connection.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        connection.execute(table.insert(), batch)
+
+
+def _ticks_history(count, symbols, seed, days=30):
+    # Тики за последние days дней, чтобы у свечей была история
+    rng = random.Random(seed)
+    prices = [100.0] * symbols
+    start = time.time() - days * 86400
+    step = days * 86400 / max(1, count)
+    for i in range(count):
+        index = rng.randrange(symbols)
+        prices[index] = max(0.01, prices[index] * (1 + rng.gauss(0, 0.001)))
+        yield json.dumps({"symbol": f"SYM{index}", "price": round(prices[index], 4),
+                          "ts": start + i * step, "volume": rng.randint(1, 100)})
+
+
+def seed(args) -> dict:
+    """Заполняет базу и возвращает контекст сценария: токены, id акций и позиций."""
+    import fx
+    import models
+    import valuation
+    from database import Base, engine
+    from password_hasher import hash_password
+    from price_feed import ingest_lines
+    from tokens import create_access_token
+
+    rng = random.Random(args.seed)
+    Base.metadata.create_all(bind=engine)
+    now = datetime.utcnow()
+    codes = ["USD"] + [f"C{i:02d}" for i in range(1, args.currencies)]
+    stock_ids = [bench_uuid(1, i) for i in range(args.stocks)]
+    prices = [round(rng.uniform(10, 500), 2) for _ in stock_ids]
+    user_ids = [bench_uuid(2, i) for i in range(args.users)]
+    portfolio_ids = [bench_uuid(3, i) for i in range(args.users)]
+    password_hash = hash_password(args.password)
+
+    positions = {}
+    with engine.begin() as connection:
+        fx.upsert_rates(connection, [
+            {"symbol": code, "exchange_rate": 1.0 if code == "USD" else round(rng.uniform(0.01, 2.0), 4)}
+            for code in codes
+        ])
+        _insert_chunks(connection, models.Stock.__table__, (
+            {"id": stock_id, "symbol": f"SYM{i}", "name": f"Stock {i}",
+             # Большая часть каталога в базовой валюте, остальное вразнобой
+             "currency": "USD" if i % 3 else rng.choice(codes), "last_price": prices[i], "last_updated": now}
+            for i, stock_id in enumerate(stock_ids)
+        ))
+        _insert_chunks(connection, models.User.__table__, (
+            {"id": user_id, "email": f"user{i}@example.com", "password_hash": password_hash,
+             "created_at": now, "updated_at": now}
+            for i, user_id in enumerate(user_ids)
+        ))
+        _insert_chunks(connection, models.Portfolio.__table__, (
+            {"id": portfolio_id, "user_id": user_id, "created_at": now}
+            for user_id, portfolio_id in zip(user_ids, portfolio_ids)
+        ))
+        position_rows = []
+        for u, portfolio_id in enumerate(portfolio_ids):
+            held = rng.sample(range(args.stocks), min(args.positions, args.stocks))
+            positions[u] = {"ids": [], "held": set(held)}
+            for s in held:
+                position_id = bench_uuid(4, len(position_rows))
+                positions[u]["ids"].append((position_id, s))
+                position_rows.append({
+                    "id": position_id, "portfolio_id": portfolio_id, "stock_id": stock_ids[s],
+                    "amount": rng.randint(100, 1000), "average_price": round(prices[s] * rng.uniform(0.8, 1.2), 2),
+                })
+        _insert_chunks(connection, models.PortfolioPosition.__table__, position_rows)
+        valuation.rebuild(connection)
+
+    started = now - timedelta(days=730)
+    step = timedelta(days=730) / max(1, args.transactions)
+    for offset in range(0, args.transactions, CHUNK):
+        with engine.begin() as connection:
+            connection.execute(models.Transaction.__table__.insert(), [
+                {"id": bench_uuid(5, i), "user_id": user_ids[i % args.users],
+                 "stock_id": stock_ids[rng.randrange(args.stocks)], "amount": rng.randint(1, 20),
+                 "price": round(rng.uniform(10, 500), 2), "type": "SELL" if i % 4 == 3 else "BUY",
+                 "created_at": started + step * i}
+                for i in range(offset, min(args.transactions, offset + CHUNK))
+            ])
+    if args.ticks:
+        ingest_lines(engine, _ticks_history(args.ticks, args.stocks, args.seed), "ndjson", 0.5)
+
+    return {
+        "codes": codes,
+        "stock_ids": [str(stock_id) for stock_id in stock_ids],
+        "portfolio_ids": [str(portfolio_id) for portfolio_id in portfolio_ids],
+        "tokens": [create_access_token({"sub": str(user_id)}) for user_id in user_ids],
+        "positions": positions,
+        "password": args.password,
+        "registered": 0,
+    }
+
+
+# Сценарии маршрутов: (вес, метод, шаблон пути, функция запроса)
+def _user(ctx, rng):
+    u = rng.randrange(len(ctx["tokens"]))
+    return u, {"Authorization": f"Bearer {ctx['tokens'][u]}"}
+
+
+def _stock(ctx, rng):
+    return rng.choice(ctx["stock_ids"])
+
+
+async def _buy(client, ctx, rng):
+    u, headers = _user(ctx, rng)
+    return await client.post("/api/transactions/buy", headers=headers, json={
+        "stock_id": _stock(ctx, rng), "amount": rng.randint(1, 10), "price": 100.0, "type": "BUY"})
+
+
+async def _sell(client, ctx, rng):
+    u, headers = _user(ctx, rng)
+    stock_id = ctx["stock_ids"][rng.choice(sorted(ctx["positions"][u]["held"]) or [0])]
+    return await client.post("/api/transactions/sell", headers=headers, json={
+        "stock_id": stock_id, "amount": 1, "price": 100.0, "type": "SELL"})
+
+
+async def _batch(client, ctx, rng):
+    u, headers = _user(ctx, rng)
+    return await client.post("/api/transactions/batch", headers=headers, json={"orders": [
+        {"stock_id": _stock(ctx, rng), "amount": rng.randint(1, 5), "price": 100.0, "type": "BUY"}
+        for _ in range(10)
+    ]})
+
+
+async def _create_position(client, ctx, rng):
+    u, headers = _user(ctx, rng)
+    free = [s for s in range(len(ctx["stock_ids"])) if s not in ctx["positions"][u]["held"]]
+    s = rng.choice(free or [0])
+    ctx["positions"][u]["held"].add(s)
+    return await client.post("/api/portfolio_positions", headers=headers, json={
+        "portfolio_id": ctx["portfolio_ids"][u], "stock_id": ctx["stock_ids"][s],
+        "amount": 10, "average_price": 100.0})
+
+
+async def _delete_position(client, ctx, rng):
+    u, headers = _user(ctx, rng)
+    ids = ctx["positions"][u]["ids"]
+    position_id, s = ids.pop() if ids else (uuid.uuid4(), None)
+    ctx["positions"][u]["held"].discard(s)
+    return await client.delete(f"/api/portfolio_positions/{position_id}", headers=headers)
+
+
+async def _register(client, ctx, rng):
+    ctx["registered"] += 1
+    return await client.post("/api/auth/register", json={
+        "email": f"new{ctx['registered']}-{rng.random()}@example.com", "password": "bench"})
+
+
+async def _login(client, ctx, rng):
+    u = rng.randrange(len(ctx["tokens"]))
+    return await client.post("/api/auth/login", json={"email": f"user{u}@example.com", "password": ctx["password"]})
+
+
+async def _ticks(client, ctx, rng):
+    lines = "\n".join(
+        json.dumps({"symbol": f"SYM{rng.randrange(len(ctx['stock_ids']))}", "price": round(rng.uniform(10, 500), 2)})
+        for _ in range(100)
+    )
+    return await client.post("/api/stocks/ticks?window=0", headers=_user(ctx, rng)[1], content=lines)
+
+
+async def _export(client, ctx, rng):
+    u, headers = _user(ctx, rng)
+    async with client.stream("GET", "/api/transactions/export?format=ndjson", headers=headers) as response:
+        async for _ in response.aiter_bytes():
+            pass
+    return response
+
+
+def _get(path, auth=False, **params):
+    async def request(client, ctx, rng):
+        headers = _user(ctx, rng)[1] if auth else {}
+        url = path.format(stock_id=_stock(ctx, rng), portfolio_id=rng.choice(ctx["portfolio_ids"]))
+        return await client.get(url, headers=headers, params={
+            key: value(ctx, rng) if callable(value) else value for key, value in params.items()})
+    return request
+
+
+MIX = [
+    (20, "POST", "/api/transactions/buy", _buy),
+    (12, "POST", "/api/transactions/sell", _sell),
+    (2, "POST", "/api/transactions/batch", _batch),
+    (1, "POST", "/api/transactions", lambda c, ctx, rng: c.post("/api/transactions", headers=_user(ctx, rng)[1], json={
+        "stock_id": _stock(ctx, rng), "amount": 1, "price": 100.0, "type": "BUY"})),
+    (1, "POST", "/api/transaction", lambda c, ctx, rng: c.post("/api/transaction", json={
+        "stock_id": _stock(ctx, rng), "amount": 1, "price": 100.0, "type": "BUY"})),
+    (10, "GET", "/api/stocks", _get("/api/stocks")),
+    (10, "GET", "/api/stocks/{stock_id}", _get("/api/stocks/{stock_id}")),
+    (4, "GET", "/api/stocks/{stock_id}/candles", _get("/api/stocks/{stock_id}/candles", interval="1h")),
+    (1, "POST", "/api/stocks", lambda c, ctx, rng: c.post("/api/stocks", json={
+        "symbol": f"NEW{rng.random()}", "name": "New", "currency": "USD", "last_price": 10.0})),
+    (2, "POST", "/api/stocks/ticks", _ticks),
+    (8, "GET", "/api/portfolios", _get("/api/portfolios", auth=True)),
+    (8, "GET", "/api/portfolios/value", _get("/api/portfolios/value", auth=True)),
+    (2, "GET", "/api/portfolios/valuation", _get(
+        "/api/portfolios/valuation", auth=True, currency=lambda ctx, rng: rng.choice(ctx["codes"]))),
+    (2, "GET", "/api/portfolios/analytics", _get("/api/portfolios/analytics", auth=True)),
+    (2, "GET", "/api/portfolios/{portfolio_id}/positions", _get("/api/portfolios/{portfolio_id}/positions")),
+    (1, "POST", "/api/portfolio_positions", _create_position),
+    (1, "DELETE", "/api/portfolio_positions/{position_id}", _delete_position),
+    (6, "GET", "/api/transactions/history", _get("/api/transactions/history", auth=True, limit=50)),
+    (1, "GET", "/api/transactions/export", _export),
+    (4, "GET", "/api/users/me", _get("/api/users/me", auth=True)),
+    (1, "GET", "/api/users/cache/stats", _get("/api/users/cache/stats", auth=True)),
+    (1, "GET", "/api/currencies", _get("/api/currencies")),
+    (1, "PUT", "/api/currencies/rates", lambda c, ctx, rng: c.put("/api/currencies/rates", headers=_user(ctx, rng)[1], json={"rates": [
+        {"symbol": code, "exchange_rate": round(rng.uniform(0.01, 2.0), 4)} for code in ctx["codes"][1:4]]})),
+    (1, "GET", "/api/currencies/stats", _get("/api/currencies/stats")),
+    (1, "POST", "/api/auth/login", _login),
+    (1, "POST", "/api/auth/register", _register),
+    (1, "GET", "/metrics", _get("/metrics")),
+    (1, "GET", "/", _get("/")),
+]
+
+
+async def drive(args, ctx) -> dict:
+    import httpx
+    from main import app
+
+    rng = random.Random(args.seed)
+    weights = [weight for weight, *_ in MIX]
+    plan = rng.choices(range(len(MIX)), weights=weights, k=args.requests)
+    stats = {f"{method} {path}": {"latencies": [], "4xx": 0, "5xx": 0} for _, method, path, _ in MIX}
+    counter = iter(plan)
+
+    async def worker(client, worker_rng):
+        for index in counter:
+            _, method, path, request = MIX[index]
+            started = time.perf_counter()
+            response = await request(client, ctx, worker_rng)
+            route = stats[f"{method} {path}"]
+            route["latencies"].append(time.perf_counter() - started)
+            if response.status_code >= 500:
+                route["5xx"] += 1
+            elif response.status_code >= 400:
+                route["4xx"] += 1
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://suite", timeout=None) as client:
+        started = time.perf_counter()
+        # Отладочные print в маршрутах не должны попадать в JSON-отчёт
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.gather(*(worker(client, random.Random(args.seed + i)) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    every = [latency for route in stats.values() for latency in route["latencies"]]
+    return {
+        "requests": len(every),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(every) / elapsed, 1),
+        "p50_ms": round(percentile(every, 50) * 1000, 2),
+        "p99_ms": round(percentile(every, 99) * 1000, 2),
+        "routes": {
+            name: {
+                "count": len(route["latencies"]),
+                "4xx": route["4xx"],
+                "5xx": route["5xx"],
+                "p50_ms": round(percentile(route["latencies"], 50) * 1000, 2),
+                "p90_ms": round(percentile(route["latencies"], 90) * 1000, 2),
+                "p99_ms": round(percentile(route["latencies"], 99) * 1000, 2),
+                "mean_ms": round(statistics.mean(route["latencies"]) * 1000, 2) if route["latencies"] else 0.0,
+            }
+            for name, route in stats.items()
+        },
+    }
+
+
+def compare(base: dict, new: dict, threshold: float, min_ms: float) -> dict:
+    """Сравнивает два отчёта; изменения меньше min_ms считаются шумом."""
+    regressions, changes = [], {}
+
+    def change(before, after):
+        return round((after / before - 1) * 100, 1) if before else 0.0
+
+    for name, after in new["load"]["routes"].items():
+        before = base["load"]["routes"].get(name)
+        if not before or not before["count"] or not after["count"]:
+            continue
+        changes[name] = {}
+        for metric in ("p50_ms", "p99_ms"):
+            pct = change(before[metric], after[metric])
+            changes[name][metric] = pct
+            if pct > threshold and after[metric] - before[metric] > min_ms:
+                regressions.append(f"{name} {metric}: {before[metric]} -> {after[metric]} (+{pct}%)")
+        if after["5xx"] > before["5xx"]:
+            regressions.append(f"{name} 5xx: {before['5xx']} -> {after['5xx']}")
+    rps = change(base["load"]["rps"], new["load"]["rps"])
+    if rps < -threshold:
+        regressions.append(f"rps: {base['load']['rps']} -> {new['load']['rps']} ({rps}%)")
+    return {"threshold_pct": threshold, "rps_change_pct": rps, "routes": changes, "regressions": regressions}
+
+
+def _revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--stocks", type=int, default=500)
+    parser.add_argument("--positions", type=int, default=20, help="позиций на пользователя")
+    parser.add_argument("--currencies", type=int, default=20)
+    parser.add_argument("--transactions", type=int, default=1000000)
+    parser.add_argument("--ticks", type=int, default=100000, help="тиков истории цен")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--output", help="файл для JSON-отчёта")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="сравнить два отчёта")
+    parser.add_argument("--threshold", type=float, default=10.0, help="допуск регрессии, %%")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="изменения задержки меньше этого — шум")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as base, open(args.compare[1]) as new:
+            result = compare(json.load(base), json.load(new), args.threshold, args.min_ms)
+        print(json.dumps(result, indent=2))
+        sys.exit(1 if result["regressions"] else 0)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    # bcrypt меряется отдельно (login_storm.py); здесь он не должен заслонять остальные маршруты
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    sys.path.insert(0, ROOT)
+
+    started = time.perf_counter()
+    ctx = seed(args)
+    report = {
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+        "seed": {
+            "users": args.users, "stocks": args.stocks, "positions": args.users * min(args.positions, args.stocks),
+            "currencies": args.currencies, "transactions": args.transactions, "ticks": args.ticks,
+            "seconds": round(time.perf_counter() - started, 1),
+        },
+        "concurrency": args.concurrency,
+        "load": asyncio.run(drive(args, ctx)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
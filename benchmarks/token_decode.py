@@ -0,0 +1,51 @@
+"""Пропускная способность проверки JWT: jose.jwt.decode против tokens.
+
+    python benchmarks/token_decode.py --tokens 1000 --rounds 20
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+
+from load import ROOT
+
+
+def measure(fn, tokens, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for token in tokens:
+            fn(token)
+    elapsed = time.perf_counter() - started
+    return round(len(tokens) * rounds / elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=1000, help="разных токенов (активных пользователей)")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from jose import jwt
+    import tokens
+
+    tokens.set_keyring(tokens.Keyring({"old": "old-secret", "new": "new-secret"}, active_kid="new"))
+    issued = [tokens.create_access_token({"sub": str(uuid.uuid4())}) for _ in range(args.tokens)]
+    secret = tokens.keyring.active_secret()
+
+    def uncached(token):
+        return tokens.keyring.verify(token)
+
+    report = {
+        "tokens": args.tokens,
+        "jose_decode_per_s": measure(lambda t: jwt.decode(t, secret, algorithms=["HS256"]), issued, args.rounds),
+        "keyring_verify_per_s": measure(uncached, issued, args.rounds),
+        "cached_decode_per_s": measure(tokens.decode_token, issued, args.rounds),
+        "token_cache": tokens.token_cache.stats(),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
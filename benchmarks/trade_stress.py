@@ -0,0 +1,167 @@
+"""Стресс-тест конкурентных сделок: позиции должны сходиться с историей.
+
+Параллельно отправляет тысячи покупок и продаж одной и той же бумаги и
+проверяет, что итоговая позиция равна сумме BUY минус сумма SELL и никогда
+не уходит в минус. Затем набирает позицию и продаёт её параллельно заявками
+на сумму больше имеющейся: остаток должен быть равен начальному минус
+исполненные продажи и ни в один момент не быть отрицательным. В конце
+агрегат стоимости портфеля сверяется с valuation.check(). Завершается
+с кодом 1 при любом расхождении.
+
+    python benchmarks/trade_stress.py --orders 5000 --concurrency 200 --sells 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+from load import ROOT, seed
+
+
+async def run(args):
+    import httpx
+    import valuation
+    from sqlalchemy import case, func, select
+    from database import AsyncSessionLocal, SessionLocal, engine
+    from main import app
+    from models import PortfolioPosition, Transaction
+
+    token, stock_ids = seed(2)
+    stock_id, sold_id = stock_ids
+    headers = {"Authorization": f"Bearer {token}"}
+    statuses = {}
+    rng = random.Random(args.seed)
+    orders = iter(range(args.orders))
+
+    async def worker(client):
+        for _ in orders:
+            side = "buy" if rng.random() < args.buy_ratio else "sell"
+            response = await client.post(
+                f"/api/transactions/{side}",
+                json={"stock_id": stock_id, "amount": rng.randint(1, 5), "price": 100.0, "type": side.upper()},
+                headers=headers,
+            )
+            key = f"{side}:{response.status_code}"
+            statuses[key] = statuses.get(key, 0) + 1
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+        sell_race = await race_sells(client, headers, sold_id, args, rng, AsyncSessionLocal)
+
+    db = SessionLocal()
+    signed = case((Transaction.type == "BUY", Transaction.amount), else_=-Transaction.amount)
+    expected = db.execute(
+        select(func.coalesce(func.sum(signed), 0)).where(Transaction.stock_id == uuid.UUID(stock_id))
+    ).scalar()
+    actual = db.execute(
+        select(func.coalesce(func.sum(PortfolioPosition.amount), 0))
+        .where(PortfolioPosition.stock_id == uuid.UUID(stock_id))
+    ).scalar()
+    negative = db.execute(select(func.count()).where(PortfolioPosition.amount < 0)).scalar()
+    db.close()
+    with engine.connect() as connection:
+        mismatches = valuation.check(connection)
+
+    return {
+        "orders": args.orders,
+        "elapsed_s": round(elapsed, 3),
+        "statuses": statuses,
+        "expected_position": expected,
+        "actual_position": actual,
+        "negative_positions": negative,
+        "sell_race": sell_race,
+        "valuation_mismatches": len(mismatches),
+        "consistent": expected == actual and negative == 0 and sell_race["consistent"] and not mismatches,
+    }
+
+
+async def race_sells(client, headers, stock_id, args, rng, session_factory):
+    """Продаёт одну позицию параллельно заявками на сумму больше неё."""
+    from sqlalchemy import select
+    from models import PortfolioPosition
+
+    response = await client.post(
+        "/api/transactions/buy",
+        json={"stock_id": stock_id, "amount": args.start, "price": 100.0, "type": "BUY"},
+        headers=headers,
+    )
+    response.raise_for_status()
+
+    amount = select(PortfolioPosition.amount).where(PortfolioPosition.stock_id == uuid.UUID(stock_id))
+    sells = iter([rng.randint(1, 5) for _ in range(args.sells)])
+    filled = rejected = 0
+    lowest = args.start
+    done = asyncio.Event()
+
+    async def seller():
+        nonlocal filled, rejected
+        for size in sells:
+            response = await client.post(
+                "/api/transactions/sell",
+                json={"stock_id": stock_id, "amount": size, "price": 100.0, "type": "SELL"},
+                headers=headers,
+            )
+            if response.status_code == 200:
+                filled += size
+            else:
+                rejected += 1
+
+    async def watcher():
+        # Остаток читается, пока идут продажи: отрицательным он не должен быть ни в какой момент
+        nonlocal lowest
+        while not done.is_set():
+            async with session_factory() as db:
+                value = (await db.execute(amount)).scalar()
+            if value is not None:
+                lowest = min(lowest, value)
+            await asyncio.sleep(0.001)
+
+    watching = asyncio.create_task(watcher())
+    await asyncio.gather(*(seller() for _ in range(args.concurrency)))
+    done.set()
+    await watching
+
+    async with session_factory() as db:
+        final = (await db.execute(amount)).scalar()
+    final = final or 0
+    return {
+        "start": args.start,
+        "sells": args.sells,
+        "filled_amount": filled,
+        "rejected_orders": rejected,
+        "final_amount": final,
+        "lowest_amount": min(lowest, final),
+        "consistent": final == args.start - filled and min(lowest, final) >= 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--buy-ratio", type=float, default=0.5)
+    parser.add_argument("--start", type=int, default=1000, help="позиция перед параллельными продажами")
+    parser.add_argument("--sells", type=int, default=2000, help="продаж по 1-5 акций против этой позиции")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="stress-")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'stress.db')}")
+    sys.path.insert(0, ROOT)
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["consistent"] else 1)
+
+
+if __name__ == "__main__":
+    main()
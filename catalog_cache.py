@@ -0,0 +1,107 @@
+"""Кэш сериализованного каталога акций с версионированием и ETag.
+
+Каталог меняется только при create_stock и записи цен; эти пути вызывают
+bump(). Ответ GET /api/stocks хранится готовыми байтами вместе со strong
+ETag (хэш тела), отдельно для каждого формата ответа, и пересобирается,
+только если версия изменилась.
+
+Счётчик версии задаётся CATALOG_CACHE_BACKEND:
+    local             — в памяти процесса (по умолчанию);
+    sqlite:///<path>  — общий файл SQLite, видимый всем воркерам и CLI;
+    off               — кэш выключен, каталог собирается на каждый запрос.
+"""
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+
+
+class LocalVersion:
+    def __init__(self):
+        self._counter = itertools.count(1)
+        self._value = next(self._counter)
+
+    def value(self) -> int:
+        return self._value
+
+    def bump(self):
+        self._value = next(self._counter)
+
+
+class SQLiteVersion:
+    """Счётчик в отдельном файле SQLite, общий для процессов на одной машине."""
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS catalog_version (name TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+            self._connection.execute("INSERT OR IGNORE INTO catalog_version VALUES ('stocks', 1)")
+
+    def value(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT version FROM catalog_version WHERE name = 'stocks'"
+            ).fetchone()[0]
+
+    def bump(self):
+        with self._lock:
+            self._connection.execute("UPDATE catalog_version SET version = version + 1 WHERE name = 'stocks'")
+
+
+class CatalogCache:
+    def __init__(self, backend=None, enabled: bool = True):
+        self.backend = backend or LocalVersion()
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # формат ответа -> (version, body, etag)
+
+    async def get(self, render, variant=None):
+        """Возвращает (body, etag); render — корутина, собирающая тело ответа в байтах.
+
+        variant различает представления каталога (формат по Accept): у каждого своё тело и ETag.
+        """
+        # Версию читаем до запроса к базе: данные не могут оказаться старее версии
+        version = self.backend.value()
+        entry = self._entries.get(variant)
+        if self.enabled and entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        body = await render()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self._entries[variant] = (version, body, etag)
+        return body, etag
+
+    def bump(self):
+        self.backend.bump()
+
+    def stats(self) -> dict:
+        return {"version": self.backend.value(), "hits": self.hits, "misses": self.misses}
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Для If-None-Match используется слабое сравнение: префикс W/ игнорируется
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def _from_env():
+    setting = os.getenv("CATALOG_CACHE_BACKEND", "local")
+    if setting == "off":
+        return CatalogCache(enabled=False)
+    if setting.startswith("sqlite:///"):
+        return CatalogCache(SQLiteVersion(setting[len("sqlite:///"):]))
+    return CatalogCache()
+
+
+catalog_cache = _from_env()
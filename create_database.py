@@ -1,3 +1,5 @@
-from database import Base, engine
+from database import engine
+from migrations import migrate
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+with engine.connect() as connection:
+    migrate(connection)
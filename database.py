@@ -1,17 +1,170 @@
-from sqlalchemy import create_engine
+# Требуется SQLAlchemy 2.0+ (проверено на 2.0.36 и 2.1)
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./stock_trading.db"
+import query_budget
+from metrics import TimedQueuePool, instrument_engine
+
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./stock_trading.db")
+
+# Асинхронные драйверы: aiosqlite локально, asyncpg для Postgres
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(SQLALCHEMY_DATABASE_URL))
+
+# Отдельная база (реплика) для чтения; по умолчанию читаем ту же
+READ_DATABASE_URL = os.getenv("DATABASE_READ_URL")
+# Отдельный пул соединений только для чтения (для SQLite)
+SEPARATE_READ_POOL = os.getenv("DB_SEPARATE_READ_POOL", "1") == "1"
+
+# Настройки пула соединений
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+# SQLite допускает одного писателя: остальные соединения на запись только ждут блокировку
+WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", "1" if IS_SQLITE else str(POOL_SIZE)))
+WRITE_MAX_OVERFLOW = int(os.getenv("DB_WRITE_MAX_OVERFLOW", "0" if IS_SQLITE else str(MAX_OVERFLOW)))
+
+# PRAGMA для каждого нового соединения SQLite. WAL позволяет читать параллельно
+# с записью, synchronous=NORMAL в WAL не теряет целостность (только последние
+# транзакции при отказе питания); отрицательный cache_size — в КиБ
+SQLITE_PRAGMAS = {
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", str(-64 * 1024))),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+# Очередь заявок (order_queue.py) обрезает журнал сразу после commit группы:
+# этот commit должен пережить отказ питания, поэтому соединения записи тогда
+# работают не ниже synchronous=FULL
+ORDER_QUEUE_ENABLED = os.getenv("ORDER_QUEUE_ENABLED", "0") == "1"
+WEAK_SYNCHRONOUS = ("OFF", "NORMAL", "0", "1")
+
+
+def is_memory_sqlite(url: str) -> bool:
+    return url.startswith("sqlite") and (url.endswith("://") or ":memory:" in url or "mode=memory" in url)
+
+
+def sqlite_on_connect(read_only: bool = False, durable: bool = False):
+    pragmas = dict(SQLITE_PRAGMAS)
+    if durable and str(pragmas["synchronous"]).upper() in WEAK_SYNCHRONOUS:
+        pragmas["synchronous"] = "FULL"
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            # Соединение чтения не может ничего записать даже по ошибке
+            cursor.execute("PRAGMA query_only=1")
+        cursor.close()
+    return on_connect
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+
+def make_engine(url: str, asynchronous: bool = False, read_only: bool = False, durable: bool = False, **kwargs):
+    """Движок с настройками СУБД и инструментированием; kwargs — настройки пула.
+
+    durable — commit SQLite переживает отказ питания (synchronous=FULL).
+    """
+    sqlite = url.startswith("sqlite")
+    if asynchronous:
+        # Пул задаётся явно: в SQLAlchemy 2.0 файловый aiosqlite по умолчанию получает
+        # NullPool, который не принимает pool_size/max_overflow/pool_timeout.
+        # TimedQueuePool — AsyncAdaptedQueuePool с замером ожидания соединения
+        engine = create_async_engine(
+            url,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+            pool_pre_ping=True,
+            poolclass=TimedQueuePool,
+            **kwargs,
+        )
+    else:
+        engine = create_engine(url, connect_args={"check_same_thread": False} if sqlite else {}, **kwargs)
+    if sqlite:
+        event.listen(getattr(engine, "sync_engine", engine), "connect", sqlite_on_connect(read_only, durable))
+    # Счётчики SQL для /metrics и журнал медленных запросов, журнал для бюджетов запросов
+    instrument_engine(engine)
+    query_budget.instrument_engine(engine)
+    return engine
+
+
+# Синхронный движок остаётся для скриптов (create_database.py, migrations.py и т.п.)
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = make_engine(
+    ASYNC_DATABASE_URL, asynchronous=True, durable=ORDER_QUEUE_ENABLED,
+    pool_size=WRITE_POOL_SIZE, max_overflow=WRITE_MAX_OVERFLOW,
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+# GET-маршруты читают через свой пул: в SQLite — соединения query_only, которые
+# в WAL не ждут писателя; в Postgres — реплика из DATABASE_READ_URL, если задана
+if READ_DATABASE_URL or (IS_SQLITE and SEPARATE_READ_POOL and not is_memory_sqlite(ASYNC_DATABASE_URL)):
+    async_read_engine = make_engine(
+        to_async_url(READ_DATABASE_URL) if READ_DATABASE_URL else ASYNC_DATABASE_URL,
+        asynchronous=True,
+        read_only=IS_SQLITE and not READ_DATABASE_URL,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+    )
+else:
+    async_read_engine = async_engine
+AsyncReadSessionLocal = async_sessionmaker(
+    async_read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
 
+
+def dialect_insert(bind):
+    """insert() с ON CONFLICT для СУБД bind (Connection или Engine).
+
+    Диалект импортируется при первом вызове: воркер на SQLite не загружает
+    модуль Postgres и наоборот.
+    """
+    if bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
@@ -0,0 +1,210 @@
+"""Курсы валют и пересчёт стоимости портфеля в целевую валюту.
+
+currencies.exchange_rate — стоимость одной единицы валюты в общей базе
+(у базовой валюты курс 1), поэтому сумма из A в B — amount * rate[A] / rate[B].
+
+Таблица курсов живёт в памяти процесса: загружается один раз, после
+изменения валют через API сбрасывается (invalidate), а на случай записи
+из других воркеров или CLI перечитывается не реже FX_REFRESH_SECONDS.
+Пересчёт векторный: курс ищется один раз на уникальную валюту. Для
+итогов портфеля база сначала суммирует позиции по валюте котировки, так
+что пересчитываются десятки сумм, а не каждая позиция.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from sqlalchemy import String, func, select, type_coerce
+
+from database import dialect_insert
+from models import Currency, PortfolioPosition, Stock
+
+currencies = Currency.__table__
+
+REFRESH_SECONDS = float(os.getenv("FX_REFRESH_SECONDS", "60"))
+
+
+class UnknownCurrency(KeyError):
+    def __init__(self, symbols):
+        self.symbols = sorted(symbols)
+        super().__init__(", ".join(self.symbols))
+
+
+def normalize(symbol) -> str:
+    return (symbol or "").strip().upper()
+
+
+class RateTable:
+    """Снимок курсов {symbol: rate}; заменяется целиком, читается без блокировок."""
+
+    def __init__(self, refresh_seconds: float = REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.rates = None
+        self.loads = 0
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def stale(self) -> bool:
+        return self.rates is None or time.monotonic() - self._loaded_at >= self.refresh_seconds
+
+    def load(self, connection) -> dict:
+        rows = connection.execute(select(currencies.c.symbol, currencies.c.exchange_rate))
+        rates = {normalize(symbol): rate for symbol, rate in rows if rate}
+        with self._lock:
+            self.rates, self._loaded_at = rates, time.monotonic()
+            self.loads += 1
+        return rates
+
+    def ensure(self, connection) -> dict:
+        """Курсы из памяти; connection синхронный, база читается только для устаревшей таблицы."""
+        rates = self.rates
+        return self.load(connection) if rates is None or self.stale() else rates
+
+    def invalidate(self):
+        with self._lock:
+            self.rates = None
+
+    def factors(self, codes, target: str, rates: dict = None) -> "np.ndarray":
+        """Множители пересчёта в target для массива кодов валют."""
+        # NumPy импортируется при первом пересчёте, а не при старте воркера
+        import numpy as np
+
+        rates = self.rates if rates is None else rates
+        target = normalize(target)
+        index = {}
+        inverse = np.fromiter((index.setdefault(code, len(index)) for code in codes), dtype=np.intp, count=len(codes))
+        unique = list(index)
+        # Валюта без курса пересчитывается только сама в себя
+        others = [code for code in unique if code != target]
+        missing = {code for code in others if code not in rates}
+        if others and target not in rates:
+            missing.add(target)
+        if missing:
+            raise UnknownCurrency(missing)
+        per_code = np.array(
+            [1.0 if code == target else rates[code] / rates[target] for code in unique],
+            dtype=np.float64,
+        )
+        return per_code[inverse]
+
+    def stats(self) -> dict:
+        return {"currencies": len(self.rates or ()), "loads": self.loads}
+
+
+rates = RateTable()
+
+
+def positions_query(portfolio_id):
+    # type_coerce(String) — без разбора UUID в Python, как в analytics.history_query
+    return (
+        select(
+            type_coerce(PortfolioPosition.stock_id, String),
+            Stock.symbol,
+            Stock.currency,
+            PortfolioPosition.amount,
+            PortfolioPosition.average_price,
+            Stock.last_price,
+        )
+        .join(Stock, PortfolioPosition.stock_id == Stock.id)
+        .where(PortfolioPosition.portfolio_id == portfolio_id)
+    )
+
+
+def load_positions(connection, portfolio_id) -> dict:
+    """Позиции портфеля колонками; connection синхронный."""
+    import numpy as np
+
+    rows = connection.execute(positions_query(portfolio_id)).cursor.fetchall()
+    stock_ids, symbols, codes, amount, average, price = list(zip(*rows)) or [()] * 6
+    return {
+        "stock_ids": list(stock_ids),
+        "symbols": list(symbols),
+        "currencies": [normalize(code) for code in codes],
+        "amount": np.asarray(amount, dtype=np.float64),
+        "average_price": np.nan_to_num(np.asarray(average, dtype=np.float64)),
+        "last_price": np.nan_to_num(np.asarray(price, dtype=np.float64)),
+    }
+
+
+def totals_query(portfolio_id):
+    return (
+        select(
+            Stock.currency,
+            func.sum(PortfolioPosition.amount * Stock.last_price),
+            func.sum(PortfolioPosition.amount * PortfolioPosition.average_price),
+        )
+        .join(Stock, PortfolioPosition.stock_id == Stock.id)
+        .where(PortfolioPosition.portfolio_id == portfolio_id)
+        .group_by(Stock.currency)
+    )
+
+
+def load_totals(connection, portfolio_id) -> dict:
+    """Суммы позиций по валюте котировки; connection синхронный."""
+    import numpy as np
+
+    rows = connection.execute(totals_query(portfolio_id)).all()
+    codes, market, cost = list(zip(*rows)) or [()] * 3
+    return {
+        "currencies": [normalize(code) for code in codes],
+        "market_value": np.nan_to_num(np.asarray(market, dtype=np.float64)),
+        "cost_basis": np.nan_to_num(np.asarray(cost, dtype=np.float64)),
+    }
+
+
+def total(totals: dict, target: str, table: dict) -> dict:
+    """Итоги портфеля в валюте target из сумм по валютам."""
+    factor = rates.factors(totals["currencies"], target, table)
+    market = float(totals["market_value"] @ factor)
+    cost = float(totals["cost_basis"] @ factor)
+    return {"currency": normalize(target), "total_value": market, "cost_basis": cost, "unrealized_pnl": market - cost}
+
+
+def value(positions: dict, target: str, table: dict) -> dict:
+    """Стоимость и себестоимость позиций в валюте target (векторно)."""
+    target = normalize(target)
+    factor = rates.factors(positions["currencies"], target, table)
+    market = positions["amount"] * positions["last_price"] * factor
+    cost = positions["amount"] * positions["average_price"] * factor
+    return {
+        "currency": target,
+        "total_value": float(market.sum()),
+        "cost_basis": float(cost.sum()),
+        "unrealized_pnl": float((market - cost).sum()),
+        "positions": [
+            {"stock_id": stock_id, "symbol": symbol, "currency": code, "amount": int(amount),
+             "rate": rate, "market_value": mv, "cost_basis": cb}
+            for stock_id, symbol, code, amount, rate, mv, cb in zip(
+                positions["stock_ids"], positions["symbols"], positions["currencies"],
+                positions["amount"].tolist(), factor.tolist(), market.tolist(), cost.tolist(),
+            )
+        ],
+    }
+
+
+def upsert_rates(connection, items) -> int:
+    """Массово создаёт или обновляет валюты [{symbol, exchange_rate, name?}] по symbol."""
+    if not items:
+        return 0
+    insert_ = dialect_insert(connection)
+    now = datetime.utcnow()
+    # Повтор символа в пачке: побеждает последний (один upsert не может менять строку дважды)
+    latest = {normalize(item["symbol"]): item for item in items}
+    rows = [
+        {"id": uuid4(), "symbol": symbol, "name": item.get("name"),
+         "exchange_rate": item["exchange_rate"], "last_updated": now}
+        for symbol, item in latest.items()
+    ]
+    stmt = insert_(currencies)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[currencies.c.symbol],
+        set_={
+            "name": func.coalesce(stmt.excluded.name, currencies.c.name),
+            "exchange_rate": stmt.excluded.exchange_rate,
+            "last_updated": stmt.excluded.last_updated,
+        },
+    )
+    connection.execute(stmt, rows)
+    return len(rows)
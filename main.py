@@ -1,13 +1,56 @@
 from fastapi import FastAPI
-from routers import auth, users, stocks, portfolios, transactions
+from database import async_engine, async_read_engine
+from migrations import MIGRATE_ON_STARTUP, migrate
+from password_hasher import hasher
+from order_queue import ENABLED as ORDER_QUEUE_ENABLED, order_queue
+from market import market
+from search_index import search_index
+from metrics import MetricsMiddleware
+from query_budget import MODE as QUERY_BUDGET_MODE, QueryBudgetMiddleware
+from routers import auth, users, stocks, portfolios, transactions, stream, currencies, monitoring, orders
+from routers import market as market_router
 
 app = FastAPI()
+# Латентность по маршрутам, число и время SQL на запрос, журнал медленных запросов
+app.add_middleware(MetricsMiddleware)
+# Dev-режим: сверка числа SQL-запросов с бюджетом маршрута (QUERY_BUDGET_MODE=warn|raise)
+if QUERY_BUDGET_MODE != "off":
+    app.add_middleware(QueryBudgetMiddleware)
 
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(stocks.router)
 app.include_router(portfolios.router)
 app.include_router(transactions.router)
+app.include_router(stream.router)
+app.include_router(currencies.router)
+app.include_router(monitoring.router)
+app.include_router(orders.router)
+app.include_router(market_router.router)
+
+@app.on_event("startup")
+async def startup():
+    # Схема приводится к последней версии до любой работы с базой; при актуальной
+    # схеме это одно чтение schema_version без блокировки
+    if MIGRATE_ON_STARTUP:
+        async with async_engine.connect() as connection:
+            await connection.run_sync(migrate)
+    # Заявки, принятые до перезапуска и не проведённые, дочитываются из журнала
+    if ORDER_QUEUE_ENABLED:
+        await order_queue.start()
+    # Снимок открытого объёма и держателей обновляется в фоне
+    market.start()
+    # Индекс поиска по символам строится в фоне
+    search_index.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await order_queue.stop()
+    await market.stop()
+    await search_index.stop()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
+    hasher.shutdown()
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,343 @@
+"""Рыночные агрегаты: самые торгуемые акции, открытый объём, крупнейшие держатели.
+
+Сделки за последние MARKET_WINDOW_MINUTES считаются в памяти процесса
+поминутными корзинами: торговый путь (routers/transactions.py и воркер
+order_queue) после commit вызывает trades.record с id сделки. При первом
+обращении счётчики прогреваются сделками окна из transactions, так что
+перезапуск не обнуляет картину; сделки, записанные во время прогрева,
+сверяются с ним по id. Другие воркеры пишут свои сделки в свои счётчики.
+
+Открытый объём и держатели считаются GROUP BY по portfolio_positions не на
+каждый запрос, а раз в MARKET_SNAPSHOT_SECONDS: снимок пишется в
+market_open_interest и market_top_holders и держится в памяти. Фоновая
+задача есть в каждом воркере, но пересобирает таблицы один: под
+блокировкой (BEGIN IMMEDIATE в SQLite, pg_try_advisory_xact_lock в
+Postgres) задача проверяет возраст снимка и, если его недавно пересобрал
+соседний воркер, только перечитывает таблицы. Эндпоинты /api/market/*
+отвечают из памяти; процессы без фоновой задачи перечитывают таблицы
+снимка не чаще того же интервала.
+
+Пересборка снимка и проверка счётчиков по истории:
+
+    python market.py rebuild
+    python market.py most-traded --minutes 15
+"""
+import argparse
+import asyncio
+import contextvars
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select
+
+from models import MarketOpenInterest, MarketTopHolder, Portfolio, PortfolioPosition, Stock, Transaction
+
+WINDOW_MINUTES = int(os.getenv("MARKET_WINDOW_MINUTES", "60"))
+SNAPSHOT_SECONDS = float(os.getenv("MARKET_SNAPSHOT_SECONDS", "60"))
+TOP_HOLDERS = int(os.getenv("MARKET_TOP_HOLDERS", "10"))
+RANKINGS = ("volume", "trades", "notional")
+# Ключ pg_try_advisory_xact_lock для пересборки снимка (у миграций свой ключ)
+SNAPSHOT_LOCK_KEY = 0x6D6B7473
+# Снимок моложе этой доли интервала пересобрал соседний воркер — его только читаем
+SNAPSHOT_FRESH_SHARE = 0.9
+# Позиция показателя в счётчиках корзины [сделки, объём, оборот]
+_COUNTER_INDEX = {"trades": 0, "volume": 1, "notional": 2}
+
+log = logging.getLogger("market")
+open_interest = MarketOpenInterest.__table__
+top_holders = MarketTopHolder.__table__
+positions = PortfolioPosition.__table__
+
+
+class TradeCounters:
+    """Сделки по акциям поминутно: {минута: {stock_id: [сделки, объём, оборот]}}."""
+
+    def __init__(self, window_minutes: int = WINDOW_MINUTES):
+        self.window = window_minutes
+        self.recorded = 0
+        self.warmed = False
+        self._buckets = {}
+        self._warming = None  # сделки, записанные во время прогрева: [(id, акция, объём, цена, время)]
+        self._lock = threading.Lock()
+
+    def record(self, stock_id, amount, price, at: float = None, trade_id=None):
+        at = time.time() if at is None else at
+        with self._lock:
+            if self._warming is not None:
+                self._warming.append((trade_id, stock_id, amount, price, at))
+            self._add(self._buckets, stock_id, amount, price, at)
+            self.recorded += 1
+
+    def _add(self, buckets, stock_id, amount, price, at):
+        minute = int(at // 60)
+        bucket = buckets.get(minute)
+        if bucket is None:
+            bucket = buckets[minute] = {}
+            # Новая минута — заодно выбрасываем корзины, вышедшие из окна
+            for old in [m for m in buckets if m <= minute - self.window]:
+                del buckets[old]
+        counters = bucket.get(stock_id)
+        if counters is None:
+            counters = bucket[stock_id] = [0, 0, 0.0]
+        counters[0] += 1
+        counters[1] += amount
+        counters[2] += amount * price
+
+    def warm(self, connection):
+        """Заполняет счётчики сделками окна из transactions; connection синхронный.
+
+        Корзины собираются отдельно и подменяют текущие, только если прогрев
+        ещё не выполнен. Сделки, записанные торговым путём за время SELECT,
+        добавляются по id, если SELECT их не увидел, так что они не теряются
+        и не считаются дважды. Параллельный вызов, пока идёт прогрев, сразу
+        возвращается.
+        """
+        with self._lock:
+            if self.warmed or self._warming is not None:
+                return
+            self._warming = []
+        try:
+            since = datetime.utcnow() - timedelta(minutes=self.window)
+            rows = connection.execute(
+                select(Transaction.id, Transaction.stock_id, Transaction.amount, Transaction.price, Transaction.created_at)
+                .where(Transaction.created_at >= since)
+            )
+            buckets, seen = {}, set()
+            for trade_id, stock_id, amount, price, created_at in rows:
+                seen.add(trade_id)
+                self._add(buckets, stock_id, amount or 0, price or 0.0, created_at.replace(tzinfo=timezone.utc).timestamp())
+            with self._lock:
+                if not self.warmed:
+                    for trade_id, stock_id, amount, price, at in self._warming:
+                        if trade_id is None or trade_id not in seen:
+                            self._add(buckets, stock_id, amount, price, at)
+                    self._buckets = buckets
+                    self.warmed = True
+        finally:
+            with self._lock:
+                self._warming = None
+
+    def top(self, minutes: int, limit: int, by: str = "volume") -> list:
+        """[(stock_id, сделки, объём, оборот)] за последние minutes минут, лучшие limit по by."""
+        since = int(time.time() // 60) - min(minutes, self.window)
+        totals = {}
+        with self._lock:
+            buckets = [bucket for minute, bucket in self._buckets.items() if minute > since]
+            for bucket in buckets:
+                for stock_id, (trades, volume, notional) in bucket.items():
+                    total = totals.get(stock_id)
+                    if total is None:
+                        totals[stock_id] = [trades, volume, notional]
+                    else:
+                        total[0] += trades
+                        total[1] += volume
+                        total[2] += notional
+        key = _COUNTER_INDEX[by]
+        best = heapq.nlargest(limit, totals.items(), key=lambda item: item[1][key])
+        return [(stock_id, *counters) for stock_id, counters in best]
+
+
+def refresh(connection) -> datetime:
+    """Пересчитывает таблицы снимка по portfolio_positions; connection синхронный."""
+    now = datetime.utcnow()
+    held = positions.c.amount > 0
+    connection.execute(delete(open_interest))
+    connection.execute(insert(open_interest).from_select(
+        ["stock_id", "open_interest", "holders", "updated_at"],
+        select(positions.c.stock_id, func.sum(positions.c.amount), func.count(), literal(now, DateTime))
+        .where(held)
+        .group_by(positions.c.stock_id),
+    ))
+    ranked = (
+        select(
+            positions.c.stock_id,
+            Portfolio.user_id,
+            positions.c.amount,
+            func.row_number().over(
+                partition_by=positions.c.stock_id,
+                order_by=(positions.c.amount.desc(), Portfolio.user_id),
+            ).label("rank"),
+        )
+        .join(Portfolio, Portfolio.id == positions.c.portfolio_id)
+        .where(held)
+        .subquery()
+    )
+    connection.execute(delete(top_holders))
+    connection.execute(insert(top_holders).from_select(
+        ["stock_id", "rank", "user_id", "amount", "updated_at"],
+        select(ranked.c.stock_id, ranked.c.rank, ranked.c.user_id, ranked.c.amount, literal(now, DateTime))
+        .where(ranked.c.rank <= TOP_HOLDERS),
+    ))
+    return now
+
+
+def snapshot_due(connection, max_age: float) -> bool:
+    updated_at = connection.execute(select(func.max(open_interest.c.updated_at))).scalar()
+    if updated_at is None:
+        # Пустой снимок актуален, пока ни у кого нет позиций
+        return connection.execute(select(literal(1)).where(positions.c.amount > 0).limit(1)).first() is not None
+    return (datetime.utcnow() - updated_at).total_seconds() >= max_age
+
+
+def claim_refresh(connection, max_age: float) -> bool:
+    """Берёт право пересобрать снимок; False — пересобирает другой воркер или снимок свежий.
+
+    Блокировка держится до commit'а вызывающего. Возраст сначала читается
+    без блокировки: в обычном цикле чужого воркера она не берётся вовсе.
+    """
+    if not snapshot_due(connection, max_age):
+        return False
+    if connection.dialect.name == "sqlite":
+        # SELECT выше транзакцию в pysqlite не открывал. Писатель в SQLite один: второй воркер ждёт здесь и затем видит свежий снимок
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+    elif connection.dialect.name == "postgresql":
+        if not connection.execute(select(func.pg_try_advisory_xact_lock(SNAPSHOT_LOCK_KEY))).scalar():
+            return False
+    return snapshot_due(connection, max_age)
+
+
+class MarketSnapshot:
+    """Снимок открытого объёма и держателей в памяти; заменяется целиком."""
+
+    def __init__(self, reload_seconds: float = SNAPSHOT_SECONDS):
+        self.reload_seconds = reload_seconds
+        self.as_of = None
+        self.symbols = {}
+        self.by_stock = {}
+        self.ranked = []
+        self.holders = {}
+        self.loads = 0
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_seconds
+
+    def load(self, connection):
+        symbols = dict(connection.execute(select(Stock.id, Stock.symbol)).all())
+        rows = connection.execute(
+            select(open_interest.c.stock_id, open_interest.c.open_interest, open_interest.c.holders,
+                   open_interest.c.updated_at)
+            .order_by(open_interest.c.open_interest.desc(), open_interest.c.stock_id)
+        ).all()
+        holders = {}
+        for stock_id, rank, user_id, amount in connection.execute(
+            select(top_holders.c.stock_id, top_holders.c.rank, top_holders.c.user_id, top_holders.c.amount)
+            .order_by(top_holders.c.stock_id, top_holders.c.rank)
+        ):
+            holders.setdefault(stock_id, []).append({"rank": rank, "user_id": user_id, "amount": amount})
+
+        ranked = [
+            {"stock_id": stock_id, "symbol": symbols.get(stock_id), "open_interest": total, "holders": count}
+            for stock_id, total, count, _ in rows
+        ]
+        with self._lock:
+            self.symbols = symbols
+            self.ranked = ranked
+            self.by_stock = {row["stock_id"]: row for row in ranked}
+            self.holders = holders
+            self.as_of = max((row[3] for row in rows), default=None)
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+
+    def ensure(self, connection):
+        if self.stale():
+            self.load(connection)
+
+
+class Market:
+    def __init__(self):
+        self.trades = TradeCounters()
+        self.snapshot = MarketSnapshot()
+        self.refreshes = 0
+        self._task = None
+
+    def record(self, stock_id, amount, price, trade_id=None):
+        self.trades.record(stock_id, amount, price, trade_id=trade_id)
+
+    def stale(self) -> bool:
+        return not self.trades.warmed or self.snapshot.stale()
+
+    def ensure(self, connection):
+        """Прогревает счётчики и подгружает снимок при необходимости; connection синхронный."""
+        if not self.trades.warmed:
+            self.trades.warm(connection)
+        self.snapshot.ensure(connection)
+
+    def most_traded(self, minutes: int, limit: int, by: str = "volume") -> list:
+        return [
+            {"stock_id": stock_id, "symbol": self.snapshot.symbols.get(stock_id),
+             "trades": trades, "volume": volume, "notional": notional}
+            for stock_id, trades, volume, notional in self.trades.top(minutes, limit, by)
+        ]
+
+    def start(self):
+        """Запускает фоновое обновление снимка (MARKET_SNAPSHOT_SECONDS=0 — только через CLI)."""
+        if self._task is None and SNAPSHOT_SECONDS > 0:
+            # Пустой контекст: иначе задача унаследует счётчики SQL запроса, который её запустил
+            self._task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._snapshot_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _snapshot_loop(self):
+        from database import AsyncSessionLocal
+
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.run_sync(lambda session: self._refresh(session.connection()))
+                    await db.commit()
+            except Exception:
+                log.exception("market snapshot refresh failed")
+            await asyncio.sleep(SNAPSHOT_SECONDS)
+
+    def _refresh(self, connection):
+        if claim_refresh(connection, SNAPSHOT_SECONDS * SNAPSHOT_FRESH_SHARE):
+            refresh(connection)
+            self.refreshes += 1
+        self.snapshot.load(connection)
+
+    def stats(self) -> dict:
+        return {
+            "trades_recorded": self.trades.recorded,
+            "snapshot_refreshes": self.refreshes,
+            "snapshot_loads": self.snapshot.loads,
+            "snapshot_as_of": self.snapshot.as_of,
+        }
+
+
+market = Market()
+
+
+def main():
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Market-wide aggregates")
+    parser.add_argument("command", choices=["rebuild", "most-traded"])
+    parser.add_argument("--minutes", type=int, default=WINDOW_MINUTES)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--by", choices=RANKINGS, default="volume")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            as_of = refresh(connection)
+        print(f"Rebuilt market snapshot as of {as_of.isoformat()} in {time.perf_counter() - started:.2f}s")
+        return
+    with engine.connect() as connection:
+        market.ensure(connection)
+    print(json.dumps(market.most_traded(args.minutes, args.limit, args.by), default=str, indent=2))
+
+
+if __name__ == "__main__":
+    main()
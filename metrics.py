@@ -0,0 +1,286 @@
+"""Метрики запросов в формате Prometheus и журнал медленных запросов.
+
+MetricsMiddleware (чистый ASGI) меряет каждый HTTP-запрос и пишет
+гистограммы по шаблону маршрута (/api/stocks/{stock_id}, а не по URL,
+чтобы число серий было ограничено). Слушатели before/after_cursor_execute
+на движках считают SQL-запросы: общая гистограмма длительности плюс
+счётчики текущего запроса через contextvar. TimedQueuePool меряет
+ожидание соединения из пула, run_in_threadpool — ожидание потока.
+
+Настройки:
+    METRICS_ENABLED=0       — выключить сбор (middleware и события остаются, но ничего не делают);
+    SLOW_REQUEST_MS=500     — писать в лог logger'а "slow_requests" запросы дольше порога
+                              вместе с их SQL (0 — журнал выключен);
+    SLOW_REQUEST_SQL_LIMIT  — сколько SQL-запросов сохранять на запрос для журнала.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool as _run_in_threadpool
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+enabled = os.getenv("METRICS_ENABLED", "1") == "1"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_SQL_LIMIT = int(os.getenv("SLOW_REQUEST_SQL_LIMIT", "50"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_log = logging.getLogger("slow_requests")
+
+
+class Histogram:
+    def __init__(self, name: str, help_: str, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name
+        self.help = help_
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Счётчики по корзинам (не накопительные) + сумма + число наблюдений
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for label_values, counts, total, count in sorted(snapshot):
+            base = _labels(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(zip(self.labels, label_values), le=_number(bound))} {cumulative}"
+            yield f"{self.name}_sum{base} {_number(total)}"
+            yield f"{self.name}_count{base} {count}"
+
+
+class Counter:
+    def __init__(self, name: str, help_: str, labels=()):
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for label_values, value in snapshot:
+            yield f"{self.name}{_labels(zip(self.labels, label_values))} {_number(value)}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs, **extra) -> str:
+    items = [*pairs, *extra.items()]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+def _number(value) -> str:
+    return value if isinstance(value, str) else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _render_snapshot(name: str, help_: str, kind: str, values: dict, labels) -> list:
+    lines = [f"# HELP {name} {help_}", f"# TYPE {name} {kind}"]
+    for label_values, value in sorted(values.items()):
+        lines.append(f"{name}{_labels(zip(labels, label_values))} {_number(value)}")
+    return lines
+
+
+def render_gauges(name: str, help_: str, values: dict, labels=()) -> list:
+    """Строки gauge для значений, снимаемых в момент опроса: {label_values: value}."""
+    return _render_snapshot(name, help_, "gauge", values, labels)
+
+
+def render_counters(name: str, help_: str, values: dict, labels=()) -> list:
+    """Строки counter для счётчиков модулей, которые только растут: {label_values: value}."""
+    return _render_snapshot(name, help_, "counter", values, labels)
+
+
+requests_total = Counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+request_seconds = Histogram("http_request_duration_seconds", "HTTP request latency", labels=("method", "route"))
+request_queries = Histogram(
+    "http_request_db_queries", "SQL statements per HTTP request", COUNT_BUCKETS, labels=("method", "route")
+)
+request_db_seconds = Histogram(
+    "http_request_db_duration_seconds", "Time spent in SQL per HTTP request", labels=("method", "route")
+)
+query_seconds = Histogram("db_query_duration_seconds", "SQL statement latency", labels=("dialect",))
+pool_wait_seconds = Histogram("db_pool_checkout_wait_seconds", "Wait for a pooled connection")
+threadpool_wait_seconds = Histogram("threadpool_wait_seconds", "Wait for a worker thread")
+threadpool_run_seconds = Histogram("threadpool_run_seconds", "Time spent running in a worker thread")
+slow_requests_total = Counter("http_slow_requests_total", "Requests slower than SLOW_REQUEST_MS", ("method", "route"))
+
+REGISTRY = [
+    requests_total, request_seconds, request_queries, request_db_seconds, slow_requests_total,
+    query_seconds, pool_wait_seconds, threadpool_wait_seconds, threadpool_run_seconds,
+]
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time", "pool_wait", "statements")
+
+    def __init__(self, capture: bool):
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.statements = [] if capture else None
+
+
+current = contextvars.ContextVar("request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if enabled and context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    query_seconds.observe(elapsed, conn.dialect.name)
+    stats = current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.statements is not None and len(stats.statements) < SLOW_REQUEST_SQL_LIMIT:
+            stats.statements.append((elapsed, statement))
+
+
+def instrument_engine(engine):
+    """Вешает счётчики SQL на движок (для AsyncEngine — на его sync_engine)."""
+    engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул асинхронного движка, который меряет ожидание свободного соединения."""
+
+    def _do_get(self):
+        if not enabled:
+            return super()._do_get()
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            elapsed = time.perf_counter() - started
+            pool_wait_seconds.observe(elapsed)
+            stats = current.get()
+            if stats is not None:
+                stats.pool_wait += elapsed
+
+
+async def run_in_threadpool(fn, *args, **kwargs):
+    """fastapi.concurrency.run_in_threadpool с замером ожидания потока и работы."""
+    if not enabled:
+        return await _run_in_threadpool(fn, *args, **kwargs)
+    submitted = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        threadpool_wait_seconds.observe(started - submitted)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            threadpool_run_seconds.observe(time.perf_counter() - started)
+
+    return await _run_in_threadpool(timed)
+
+
+def threadpool_gauges() -> list:
+    """Загрузка пула потоков AnyIO, в котором FastAPI выполняет sync-код."""
+    from anyio import to_thread
+
+    limiter = to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    return [
+        *render_gauges("threadpool_size", "Worker thread limit", {(): limiter.total_tokens}),
+        *render_gauges("threadpool_busy", "Worker threads in use", {(): statistics.borrowed_tokens}),
+        *render_gauges("threadpool_waiting", "Tasks waiting for a worker thread", {(): statistics.tasks_waiting}),
+    ]
+
+
+def render(extra_lines=()) -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled:
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(capture=SLOW_REQUEST_MS > 0)
+        token = current.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current.reset(token)
+            route = scope.get("route")
+            # Для несовпавших URL одна серия, иначе число меток не ограничено
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            requests_total.inc(method, path, status)
+            request_seconds.observe(elapsed, method, path)
+            request_queries.observe(stats.queries, method, path)
+            request_db_seconds.observe(stats.db_time, method, path)
+            if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS:
+                slow_requests_total.inc(method, path)
+                log_slow_request(scope, status, elapsed, stats)
+
+
+def log_slow_request(scope, status, elapsed, stats):
+    statements = "".join(
+        f"\n  [{took * 1000:.1f} ms] {' '.join(statement.split())}" for took, statement in stats.statements or ()
+    )
+    slow_log.warning(
+        "%s %s -> %s in %.1f ms: %d queries, %.1f ms in SQL, %.1f ms waiting for pool%s",
+        scope["method"], scope["path"], status, elapsed * 1000,
+        stats.queries, stats.db_time * 1000, stats.pool_wait * 1000, statements,
+    )
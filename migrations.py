@@ -0,0 +1,245 @@
+"""Версионные миграции схемы: выполняются один раз при старте под блокировкой.
+
+Применённые шаги записываются в schema_version. Воркер при старте сначала
+читает версию без блокировки: если схема актуальна (обычный случай), он
+ничего не ждёт. Иначе берётся блокировка — BEGIN IMMEDIATE в SQLite,
+pg_advisory_xact_lock в Postgres, — версия перечитывается (миграцию мог
+провести соседний воркер) и недостающие шаги выполняются в одной
+транзакции. Каждый шаг идемпотентен: база, созданная прежним
+create_database.py, и пустая база приводятся к одной схеме.
+
+Новый шаг дописывается в конец MIGRATIONS со следующим номером; уже
+выпущенные шаги не меняются.
+
+    python migrations.py status
+    python migrations.py upgrade
+    python migrations.py check     # код 1, если есть невыполненные шаги или расхождения
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table, delete, func, inspect, insert, select, type_coerce, update,
+)
+from sqlalchemy.schema import CreateTable
+
+import models
+import valuation
+from database import Base, SQLITE_PRAGMAS
+
+log = logging.getLogger("migrations")
+
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+# Сколько воркер ждёт блокировку, пока миграцию проводит другой (SQLite busy_timeout)
+LOCK_TIMEOUT_MS = int(os.getenv("MIGRATION_LOCK_TIMEOUT_MS", "600000"))
+# Ключ pg_advisory_xact_lock, общий для всех воркеров приложения
+ADVISORY_LOCK_KEY = 0x726B7369
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String),
+    Column("applied_at", DateTime),
+)
+
+positions = models.PortfolioPosition.__table__
+
+
+def uuid_columns(connection, table_name) -> list:
+    """Столбцы таблицы SQLite с объявленным типом UUID (числовая аффинность)."""
+    info = connection.exec_driver_sql(f"PRAGMA table_info({table_name})").all()
+    return [row[1] for row in info if row[2].upper() == "UUID"]
+
+
+def create_tables(connection):
+    # Недостающие таблицы создаются вместе со своими индексами; существующие не трогаются
+    Base.metadata.create_all(connection)
+
+
+def sqlite_uuid_text(connection):
+    """Пересоздаёт таблицы SQLite со столбцами UUID как CHAR(32).
+
+    Тип UUID в SQLite получает числовую аффинность: hex-id из одних цифр и
+    одной «e» сохранялся как число. Значения копируются как есть — id,
+    уже превращённые в числа, восстановить нельзя.
+    """
+    if connection.dialect.name != "sqlite":
+        return
+    existing = set(inspect(connection).get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        if not uuid_columns(connection, table.name):
+            continue
+        inspector = inspect(connection)
+        present = {column["name"] for column in inspector.get_columns(table.name)}
+        indexed = {index["name"] for index in inspector.get_indexes(table.name)}
+        columns = ", ".join(column.name for column in table.columns if column.name in present)
+        temporary = f"{table.name}__migrating"
+        ddl = str(CreateTable(table).compile(dialect=connection.dialect))
+        connection.exec_driver_sql(ddl.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {temporary} ", 1))
+        connection.exec_driver_sql(f"INSERT INTO {temporary} ({columns}) SELECT {columns} FROM {table.name}")
+        connection.exec_driver_sql(f"DROP TABLE {table.name}")
+        connection.exec_driver_sql(f"ALTER TABLE {temporary} RENAME TO {table.name}")
+        # Индексы удалились вместе со старой таблицей; возвращаем те, что были, — недостающие добавят следующие шаги
+        for index in table.indexes:
+            if index.name in indexed:
+                index.create(connection)
+
+
+def transaction_indexes(connection):
+    for index in models.Transaction.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def unique_positions(connection):
+    """Сливает повторные позиции (портфель, акция) и создаёт уникальный индекс.
+
+    Количество складывается, средняя цена взвешивается по количеству. Id
+    читаются строками: старые базы могут хранить испорченные UUID.
+    """
+    index = next(index for index in positions.indexes if index.unique)
+    if any(found["name"] == index.name for found in inspect(connection).get_indexes(positions.name)):
+        return
+    row_id, portfolio_id, stock_id = (
+        type_coerce(positions.c[name], String) for name in ("id", "portfolio_id", "stock_id")
+    )
+    duplicates = connection.execute(
+        select(portfolio_id, stock_id).group_by(portfolio_id, stock_id).having(func.count() > 1)
+    ).all()
+    for portfolio, stock in duplicates:
+        rows = connection.execute(
+            select(row_id, positions.c.amount, positions.c.average_price)
+            .where(portfolio_id == portfolio, stock_id == stock)
+            .order_by(row_id)
+        ).all()
+        amount = sum(row.amount or 0 for row in rows)
+        cost = sum((row.amount or 0) * (row.average_price or 0.0) for row in rows)
+        keep, *extra = rows
+        connection.execute(
+            update(positions).where(row_id == keep[0])
+            .values(amount=amount, average_price=cost / amount if amount else keep.average_price)
+        )
+        connection.execute(delete(positions).where(row_id.in_([row[0] for row in extra])))
+    index.create(connection)
+
+
+def backfill_valuations(connection):
+    # Агрегат стоимости портфелей пересчитывается по позициям (см. valuation.py)
+    valuation.rebuild(connection)
+
+
+MIGRATIONS = [
+    (1, "create_tables", create_tables),
+    (2, "sqlite_uuid_text", sqlite_uuid_text),
+    (3, "transaction_indexes", transaction_indexes),
+    (4, "unique_positions", unique_positions),
+    (5, "backfill_valuations", backfill_valuations),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def applied(connection) -> set:
+    if not inspect(connection).has_table(schema_version.name):
+        return set()
+    return set(connection.execute(select(schema_version.c.version)).scalars())
+
+
+def pending(connection) -> list:
+    done = applied(connection)
+    return [migration for migration in MIGRATIONS if migration[0] not in done]
+
+
+def _lock(connection):
+    """Открывает транзакцию под блокировкой миграций; снимается commit'ом или rollback'ом."""
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql(f"PRAGMA busy_timeout={LOCK_TIMEOUT_MS}")
+        # Блокировка записи с начала транзакции: второй воркер ждёт здесь, а не посреди DDL
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+    elif connection.dialect.name == "postgresql":
+        connection.execute(select(func.pg_advisory_xact_lock(ADVISORY_LOCK_KEY)))
+
+
+def migrate(connection) -> list:
+    """Выполняет невыполненные шаги и возвращает их имена.
+
+    connection синхронный и без открытой транзакции; из AsyncConnection
+    функцию вызывают через run_sync.
+    """
+    todo = pending(connection)
+    connection.rollback()
+    if not todo:
+        return []
+    try:
+        _lock(connection)
+        todo = pending(connection)
+        schema_version.create(connection, checkfirst=True)
+        for version, name, step in todo:
+            started = time.perf_counter()
+            step(connection)
+            connection.execute(insert(schema_version).values(version=version, name=name, applied_at=datetime.utcnow()))
+            log.info("Applied migration %s %s in %.2fs", version, name, time.perf_counter() - started)
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        if connection.dialect.name == "sqlite":
+            connection.exec_driver_sql(f"PRAGMA busy_timeout={SQLITE_PRAGMAS['busy_timeout']}")
+    return [name for _, name, _ in todo]
+
+
+def drift(connection) -> dict:
+    """Расхождения базы с моделями: нет таблиц, индексов или столбцы UUID в SQLite."""
+    inspector = inspect(connection)
+    existing = set(inspector.get_table_names())
+    report = {"missing_tables": [], "missing_indexes": [], "uuid_columns": []}
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            report["missing_tables"].append(table.name)
+            continue
+        found = {index["name"] for index in inspector.get_indexes(table.name)}
+        report["missing_indexes"] += [index.name for index in table.indexes if index.name not in found]
+        if connection.dialect.name == "sqlite":
+            report["uuid_columns"] += [f"{table.name}.{name}" for name in uuid_columns(connection, table.name)]
+    return report
+
+
+def status(connection) -> dict:
+    done = applied(connection)
+    return {
+        "version": max(done, default=0),
+        "latest": LATEST,
+        "pending": [name for version, name, _ in MIGRATIONS if version not in done],
+        "drift": drift(connection),
+    }
+
+
+def main():
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Schema migrations")
+    parser.add_argument("command", choices=["status", "upgrade", "check"])
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        started = time.perf_counter()
+        with engine.connect() as connection:
+            names = migrate(connection)
+        print(f"Applied {len(names)} migrations in {time.perf_counter() - started:.2f}s: {', '.join(names) or '-'}")
+        return
+    with engine.connect() as connection:
+        report = status(connection)
+    print(json.dumps(report, indent=2))
+    if args.command == "check" and (report["pending"] or any(report["drift"].values())):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
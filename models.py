@@ -1,5 +1,4 @@
-from sqlalchemy import Column, String, Float, Integer, DateTime, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Float, Integer, DateTime, ForeignKey, Index, Uuid
 from sqlalchemy.orm import relationship
 from database import Base
 import uuid
@@ -7,7 +6,7 @@ from datetime import datetime
 
 class User(Base):
     __tablename__ = "users"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
     email = Column(String, unique=True, index=True)
     password_hash = Column(String)
     created_at = Column(DateTime)
@@ -15,7 +14,7 @@ class User(Base):
 
 class Stock(Base):
     __tablename__ = "stocks"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
     symbol = Column(String, unique=True, index=True)
     name = Column(String)
     currency = Column(String)
@@ -24,32 +23,114 @@ class Stock(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
-    stock_id = Column(UUID(as_uuid=True), ForeignKey("stocks.id"))
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(Uuid(as_uuid=True), ForeignKey("users.id"))
+    stock_id = Column(Uuid(as_uuid=True), ForeignKey("stocks.id"))
     amount = Column(Integer)
     price = Column(Float)
     type = Column(String)
     created_at = Column(DateTime)
 
+    __table_args__ = (
+        # Keyset-пагинация истории: (user_id, created_at, id) и фильтр по акции
+        Index("ix_transactions_user_created", "user_id", "created_at", "id"),
+        Index("ix_transactions_user_stock_created", "user_id", "stock_id", "created_at", "id"),
+        # Прогрев скользящих счётчиков market.py сделками последних минут
+        Index("ix_transactions_created", "created_at"),
+    )
+
 class Portfolio(Base):
     __tablename__ = "portfolios"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"))
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(Uuid(as_uuid=True), ForeignKey("users.id"))
     created_at = Column(DateTime)
 
 class PortfolioPosition(Base):
     __tablename__ = "portfolio_positions"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    portfolio_id = Column(UUID(as_uuid=True), ForeignKey("portfolios.id"))
-    stock_id = Column(UUID(as_uuid=True), ForeignKey("stocks.id"))
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    portfolio_id = Column(Uuid(as_uuid=True), ForeignKey("portfolios.id"))
+    stock_id = Column(Uuid(as_uuid=True), ForeignKey("stocks.id"))
     amount = Column(Integer)
     average_price = Column(Float)
 
+    __table_args__ = (
+        # Одна позиция на акцию в портфеле; нужен для INSERT ... ON CONFLICT
+        Index("ux_portfolio_positions_portfolio_stock", "portfolio_id", "stock_id", unique=True),
+    )
+
+class PortfolioValuation(Base):
+    """Поддерживаемый агрегат стоимости портфеля (см. valuation.py)."""
+    __tablename__ = "portfolio_valuations"
+    portfolio_id = Column(Uuid(as_uuid=True), ForeignKey("portfolios.id"), primary_key=True)
+    cost_basis = Column(Float, default=0.0)
+    market_value = Column(Float, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class PriceTick(Base):
+    """Полная история тиков: узкая append-only таблица, ts — секунды эпохи."""
+    __tablename__ = "price_ticks"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    stock_id = Column(Uuid(as_uuid=True), ForeignKey("stocks.id"), nullable=False)
+    ts = Column(Float, nullable=False)
+    price = Column(Float, nullable=False)
+    volume = Column(Float, default=0.0)
+
+    __table_args__ = (
+        Index("ix_price_ticks_stock_ts", "stock_id", "ts"),
+    )
+
+class PriceCandle(Base):
+    """Предагрегированные свечи 1m/1h/1d (см. price_history.py)."""
+    __tablename__ = "price_candles"
+    stock_id = Column(Uuid(as_uuid=True), ForeignKey("stocks.id"), primary_key=True)
+    interval = Column(Integer, primary_key=True)  # длина свечи в секундах
+    bucket = Column(Float, primary_key=True)  # начало свечи, секунды эпохи
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float)
+    volume = Column(Float, default=0.0)
+    ticks = Column(Integer, default=0)
+    # Время первого и последнего тика: open/close верны и при тиках не по порядку
+    first_ts = Column(Float)
+    last_ts = Column(Float)
+
 class Currency(Base):
     __tablename__ = "currencies"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = Column(String)
     symbol = Column(String, unique=True, index=True)
     exchange_rate = Column(Float)
-    last_updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+    last_updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Order(Base):
+    # Заявка из очереди (order_queue.py); при исполнении id транзакции совпадает с id заявки
+    __tablename__ = "orders"
+    id = Column(Uuid(as_uuid=True), primary_key=True)
+    user_id = Column(Uuid(as_uuid=True), ForeignKey("users.id"), index=True)
+    stock_id = Column(Uuid(as_uuid=True), ForeignKey("stocks.id"))
+    amount = Column(Integer)
+    price = Column(Float)
+    type = Column(String)
+    status = Column(String)  # FILLED или REJECTED
+    error = Column(String)
+    created_at = Column(DateTime)
+    processed_at = Column(DateTime)
+
+class MarketOpenInterest(Base):
+    """Снимок market.py: суммарный открытый объём по акции."""
+    __tablename__ = "market_open_interest"
+    stock_id = Column(Uuid(as_uuid=True), ForeignKey("stocks.id"), primary_key=True)
+    open_interest = Column(Integer)
+    holders = Column(Integer)
+    updated_at = Column(DateTime)
+
+class MarketTopHolder(Base):
+    """Снимок market.py: крупнейшие держатели акции, rank с 1."""
+    __tablename__ = "market_top_holders"
+    stock_id = Column(Uuid(as_uuid=True), ForeignKey("stocks.id"), primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    user_id = Column(Uuid(as_uuid=True), ForeignKey("users.id"))
+    amount = Column(Integer)
+    updated_at = Column(DateTime)
@@ -0,0 +1,400 @@
+"""Очередь заявок с журналом предзаписи и единственным писателем.
+
+В режиме ORDER_QUEUE_ENABLED=1 /api/transactions/buy и /sell не проводят
+сделку в обработчике, а дописывают заявку строкой JSON в журнал
+(ORDER_QUEUE_PATH) и отвечают 202 с id заявки. fsync журнала групповой:
+заявки, пришедшие пока шёл предыдущий fsync, подтверждаются следующим
+одним вызовом. Ответ уходит только после fsync, так что принятая заявка
+переживает падение процесса.
+
+Единственный фоновый воркер забирает из очереди до ORDER_QUEUE_GROUP
+заявок, проводит их по пользователям через trading.apply_orders и
+фиксирует группу одним commit вместе со строками таблицы orders. SQLite
+допускает одного писателя, поэтому HTTP-обработчики больше не спорят за
+блокировку базы, а число commit на заявку падает в размер группы раз.
+
+Id транзакции совпадает с id заявки. При старте журнал перечитывается,
+заявки, уже записанные в orders, пропускаются — повторное применение
+идемпотентно. Журнал обрезается, когда все заявки из него проведены.
+Журналом владеет один процесс (эксклюзивный flock): второй воркер с тем
+же ORDER_QUEUE_PATH не стартует — иначе обрезка стёрла бы чужие заявки.
+Заявки каждого пользователя проводятся в своей точке сохранения: ошибка
+одного пользователя отклоняет только его заявки. Упавший воркер
+перезапускается. Статус заявки: GET /api/orders/{order_id}.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from uuid import UUID, uuid4
+
+try:
+    import fcntl
+except ImportError:  # без flock владение журналом не гарантировать — очередь не включается
+    fcntl = None
+
+from fastapi import HTTPException
+from sqlalchemy import select, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from database import ORDER_QUEUE_ENABLED, AsyncReadSessionLocal, AsyncSessionLocal, dialect_insert
+from market import market
+from models import Order, Stock
+from schemas import TransactionCreate
+from trading import BATCH_RETRIES, BatchConflict, apply_orders
+
+ENABLED = ORDER_QUEUE_ENABLED
+JOURNAL_PATH = os.getenv("ORDER_QUEUE_PATH", "./order_queue.log")
+GROUP_SIZE = int(os.getenv("ORDER_QUEUE_GROUP", "500"))
+# Пауза перед повтором группы, если база заблокирована; растёт вдвое до RETRY_MAX_DELAY
+RETRY_DELAY = 0.1
+RETRY_MAX_DELAY = 5.0
+# Сколько раз повторять группу при блокировке, прежде чем отклонить её
+BUSY_RETRIES = int(os.getenv("ORDER_QUEUE_BUSY_RETRIES", "8"))
+# Блокировка и занятость SQLite; конфликт сериализации, взаимоблокировка, lock_not_available Postgres
+BUSY_CODES = ("SQLITE_BUSY", "SQLITE_LOCKED", "40001", "40P01", "55P03")
+BUSY_MARKERS = ("database is locked", "database is busy", "deadlock detected", "could not obtain lock")
+
+log = logging.getLogger("order_queue")
+orders = Order.__table__
+
+
+def busy(exc) -> bool:
+    """Временная ли ошибка базы: повтор группы может пройти. Прочие OperationalError постоянны."""
+    code = next(
+        (value for value in (getattr(exc.orig, name, None) for name in ("sqlite_errorname", "sqlstate", "pgcode")) if value),
+        "",
+    )
+    return code.startswith(BUSY_CODES) or any(marker in str(exc.orig).lower() for marker in BUSY_MARKERS)
+
+
+class OrderQueue:
+    def __init__(self, path: str = JOURNAL_PATH, group_size: int = GROUP_SIZE):
+        self.path = path
+        self.group_size = group_size
+        self.pending = {}  # id -> заявка, записанная в журнал и ещё не проведённая
+        self.submitted = self.groups = self.filled = self.rejected = self.syncs = 0
+        self._journal = None
+        self._queue = None
+        self._unsynced = []  # (future, смещение строки) ждут fsync
+        self._size = 0  # длина журнала в байтах, включая ещё не сброшенные строки
+        self._sync_wanted = None
+        self._tasks = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self.running:
+            return
+        journal = self._lock_journal()
+        try:
+            recovered = await self._recover()
+        except BaseException:
+            journal.close()
+            raise
+        self._journal = journal
+        self._size = os.fstat(journal.fileno()).st_size
+        self._queue = asyncio.Queue()
+        self._sync_wanted = asyncio.Event()
+        for order in recovered:
+            self.pending[order["id"]] = order
+            self._queue.put_nowait(order)
+        self._tasks = [self._spawn(loop) for loop in (self._sync_loop, self._apply_loop)]
+        if recovered:
+            log.info("recovered %d orders from %s", len(recovered), self.path)
+
+    async def stop(self):
+        """Дожидается проведения принятых заявок и останавливает воркер."""
+        if not self.running:
+            return
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._journal.close()
+
+    def _lock_journal(self):
+        """Открывает журнал на дозапись под эксклюзивной блокировкой процесса."""
+        if fcntl is None:
+            raise RuntimeError("Order queue needs fcntl.flock to own its journal")
+        journal = open(self.path, "a", encoding="utf-8")
+        try:
+            fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            journal.close()
+            raise RuntimeError(
+                f"Order journal {self.path} is locked by another process: "
+                "run the queue in one worker or give each worker its own ORDER_QUEUE_PATH"
+            )
+        return journal
+
+    def _spawn(self, loop):
+        # Пустой контекст: иначе воркер унаследует счётчики SQL запроса, который его запустил
+        task = contextvars.Context().run(asyncio.create_task, loop())
+        task.add_done_callback(functools.partial(self._restart, loop))
+        return task
+
+    def _restart(self, loop, task):
+        # Упавший цикл запускается заново: иначе заявки застрянут в PENDING, а drain() не дождётся очереди
+        if task.cancelled() or task not in self._tasks:
+            return
+        log.error("order queue %s died, restarting", loop.__name__, exc_info=task.exception())
+        self._tasks[self._tasks.index(task)] = self._spawn(loop)
+
+    async def drain(self):
+        """Ждёт, пока все принятые заявки будут проведены."""
+        if self.running:
+            await self._queue.join()
+
+    async def submit(self, user_id, data, type_: str) -> dict:
+        if data.amount <= 0:
+            raise HTTPException(status_code=400, detail="Amount must be greater than 0")
+        await self.start()
+        # Заявка на неизвестную акцию не попадает в журнал: её строку orders не записать (внешний ключ)
+        async with AsyncReadSessionLocal() as db:
+            if await db.scalar(select(Stock.id).where(Stock.id == data.stock_id)) is None:
+                raise HTTPException(status_code=404, detail="Stock not found")
+        order = {
+            "id": str(uuid4()),
+            "user_id": str(user_id),
+            "stock_id": str(data.stock_id),
+            "amount": data.amount,
+            "price": data.price,
+            "type": type_,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        self.pending[order["id"]] = order
+        # json.dumps пишет только ASCII: длина строки равна числу байт
+        line = json.dumps(order) + "\n"
+        self._journal.write(line)
+        durable = asyncio.get_running_loop().create_future()
+        self._unsynced.append((durable, self._size))
+        self._size += len(line)
+        self._sync_wanted.set()
+        try:
+            await durable
+        except OSError:
+            self.pending.pop(order["id"], None)
+            raise HTTPException(status_code=503, detail="Order journal is unavailable")
+        self.submitted += 1
+        self._queue.put_nowait(order)
+        return order
+
+    def status(self, order_id) -> dict:
+        return self.pending.get(str(order_id))
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "submitted": self.submitted,
+            "filled": self.filled,
+            "rejected": self.rejected,
+            "groups": self.groups,
+            "syncs": self.syncs,
+        }
+
+    async def _recover(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        recovered = []
+        with open(self.path, encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    recovered.append(json.loads(line))
+                except ValueError:
+                    # Недописанная последняя строка: ответ по ней не отправлялся
+                    continue
+        if not recovered:
+            return []
+        ids = [UUID(order["id"]) for order in recovered]
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Order.id).where(Order.id.in_(ids)))
+            applied = {str(order_id) for order_id in result.scalars()}
+        return [order for order in recovered if order["id"] not in applied]
+
+    async def _sync_loop(self):
+        while True:
+            await self._sync_wanted.wait()
+            self._sync_wanted.clear()
+            waiters, self._unsynced = self._unsynced, []
+            try:
+                self._journal.flush()
+                await asyncio.to_thread(os.fsync, self._journal.fileno())
+            except OSError as exc:
+                for waiter, _ in await self._rollback(waiters):
+                    waiter.set_exception(exc)
+                continue
+            self.syncs += 1
+            for waiter, _ in waiters:
+                waiter.set_result(None)
+
+    async def _rollback(self, waiters) -> list:
+        """Обрезает журнал до первой неподтверждённой строки; возвращает заявки, которым ответить 503.
+
+        Клиент получит отказ, поэтому строка не должна ожить при перезапуске:
+        пока обрезка не сброшена на диск, ответа нет. Строки, дописанные после
+        сбойной пачки, обрезаются вместе с ней и тоже получают отказ.
+        """
+        while True:
+            waiters += self._unsynced
+            self._unsynced = []
+            offset = waiters[0][1]
+            try:
+                self._journal.truncate(offset)
+                self._size = offset
+                await asyncio.to_thread(os.fsync, self._journal.fileno())
+                return waiters
+            except OSError as exc:
+                log.error("order journal rollback to %d failed: %s", offset, exc)
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def _apply_loop(self):
+        while True:
+            group = [await self._queue.get()]
+            while len(group) < self.group_size and not self._queue.empty():
+                group.append(self._queue.get_nowait())
+            try:
+                await self._apply_group(group)
+            finally:
+                for _ in group:
+                    self._queue.task_done()
+            # Всё из журнала проведено — его можно начать заново
+            if not self.pending:
+                self._journal.truncate(0)
+                self._size = 0
+
+    async def _apply_group(self, group):
+        by_user = defaultdict(list)
+        for order in group:
+            by_user[order["user_id"]].append(order)
+
+        attempt = 0
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self._begin(db)
+                    rows = await self._apply(db, by_user)
+                    await db.commit()
+                break
+            except OperationalError as exc:
+                attempt += 1
+                if busy(exc) and attempt <= BUSY_RETRIES:
+                    # База занята другим писателем: заявки остаются в журнале, группа повторяется
+                    log.warning("order group of %d not applied (attempt %d): %s", len(group), attempt, exc)
+                    await asyncio.sleep(min(RETRY_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY))
+                    continue
+                # Постоянная ошибка (нет таблицы, столбца) или блокировка не отпустила: повтор не поможет
+                log.error("order group of %d failed, rejecting it: %s", len(group), exc)
+                rows = await self._reject(group, "Database is busy" if busy(exc) else "Database error")
+                break
+            except Exception:
+                log.exception("order group of %d failed, rejecting it", len(group))
+                rows = await self._reject(group, "Order could not be applied")
+                break
+
+        self.groups += 1
+        for row in rows:
+            self.pending.pop(str(row["id"]), None)
+            if row["status"] == "FILLED":
+                self.filled += 1
+                market.record(row["stock_id"], row["amount"], row["price"], row["id"])
+            else:
+                self.rejected += 1
+
+    @staticmethod
+    async def _begin(db):
+        # pysqlite открывает транзакцию только перед первой записью, и RELEASE
+        # первой точки сохранения фиксировал бы её; открываем явно, сразу с блокировкой записи
+        if db.bind.dialect.name == "sqlite":
+            await db.execute(text("BEGIN IMMEDIATE"))
+
+    async def _apply(self, db, by_user) -> list:
+        rows = []
+        for user_id, user_orders in by_user.items():
+            rows += await self._apply_user(db, user_id, user_orders)
+        await db.execute(self._insert(db), rows)
+        return rows
+
+    async def _apply_user(self, db, user_id, user_orders) -> list:
+        """Проводит заявки пользователя в точке сохранения; при ошибке отклоняет только их."""
+        error = "Positions changed concurrently"
+        for _ in range(BATCH_RETRIES):
+            try:
+                async with db.begin_nested():
+                    results = await apply_orders(
+                        db, UUID(user_id),
+                        [TransactionCreate(**order) for order in user_orders],
+                        [UUID(order["id"]) for order in user_orders],
+                    )
+            except (BatchConflict, IntegrityError):
+                # Позиции изменили в обход очереди — перечитываем и повторяем
+                continue
+            except OperationalError:
+                raise
+            except HTTPException as exc:
+                error = exc.detail
+            except Exception:
+                log.exception("orders of user %s not applied", user_id)
+                error = "Order could not be applied"
+            else:
+                return [self._row(order, result["status"], result.get("error")) for order, result in zip(user_orders, results)]
+            break
+        return [self._row(order, "REJECTED", error) for order in user_orders]
+
+    async def _reject(self, group, error) -> list:
+        """Записывает группу отклонённой; заявку, которую не удалось записать, снимает с ожидания."""
+        rows, lost = [], []
+        try:
+            async with AsyncSessionLocal() as db:
+                await self._begin(db)
+                for order in group:
+                    row = self._row(order, "REJECTED", error)
+                    try:
+                        async with db.begin_nested():
+                            await db.execute(self._insert(db), [row])
+                    except Exception:
+                        log.exception("order %s could not be recorded", order["id"])
+                        lost.append(order)
+                        continue
+                    rows.append(row)
+                await db.commit()
+        except Exception:
+            log.exception("rejected group of %d could not be recorded", len(group))
+            rows, lost = [], group
+        for order in lost:
+            # Журнал обрезается, только когда ожидающих нет, — незаписанная заявка держала бы его вечно.
+            # Она остаётся в логе целиком, чтобы её можно было разобрать вручную
+            log.error("order dropped unrecorded: %s", json.dumps(order))
+            self.pending.pop(order["id"], None)
+            self.rejected += 1
+        return rows
+
+    @staticmethod
+    def _insert(db):
+        # Строка orders с этим id уже есть (повтор журнала) — она не перезаписывается
+        return dialect_insert(db.bind)(orders).on_conflict_do_nothing(index_elements=[orders.c.id])
+
+    @staticmethod
+    def _row(order, status, error=None) -> dict:
+        return {
+            "id": UUID(order["id"]),
+            "user_id": UUID(order["user_id"]),
+            "stock_id": UUID(order["stock_id"]),
+            "amount": order["amount"],
+            "price": order["price"],
+            "type": order["type"],
+            "status": status,
+            "error": error,
+            "created_at": datetime.fromisoformat(order["created_at"]),
+            "processed_at": datetime.utcnow(),
+        }
+
+
+order_queue = OrderQueue()
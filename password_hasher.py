@@ -0,0 +1,146 @@
+"""Хэширование паролей bcrypt в отдельном ограниченном пуле процессов.
+
+bcrypt намеренно медленный, поэтому вызовы hash/verify уходят из event
+loop и общего threadpool в собственный ProcessPoolExecutor. Число
+одновременно принятых операций ограничено: при переполнении очереди
+запрос сразу получает HasherBusy, а роутер отвечает 503 с Retry-After,
+вместо того чтобы копить логины и тормозить торговые эндпоинты. Если
+процесс пула погиб, пул пересоздаётся при следующем вызове, а запросы,
+попавшие на сломанный пул, получают тот же 503.
+
+Настройки окружения:
+    BCRYPT_ROUNDS        — стоимость новых хэшей (12); старые хэши с другой
+                           стоимостью пересчитываются при успешном логине;
+    PASSWORD_WORKERS     — размер пула процессов (ядра минус одно, от 1 до 4);
+                           0 — выполнять в threadpool без отдельных процессов;
+    PASSWORD_WORKER_NICE — насколько понизить приоритет процессов пула (10),
+                           чтобы bcrypt не отнимал CPU у обработки запросов;
+    PASSWORD_QUEUE_SIZE  — максимум операций в работе и в очереди (workers * 8);
+    PASSWORD_RETRY_AFTER — значение заголовка Retry-After в секундах (1).
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import run_in_threadpool
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, max(1, (os.cpu_count() or 1) - 1)))))
+PASSWORD_QUEUE_SIZE = int(os.getenv("PASSWORD_QUEUE_SIZE", str(max(1, PASSWORD_WORKERS) * 8)))
+PASSWORD_RETRY_AFTER = int(os.getenv("PASSWORD_RETRY_AFTER", "1"))
+PASSWORD_WORKER_NICE = int(os.getenv("PASSWORD_WORKER_NICE", "10"))
+
+_contexts = {}
+
+
+def _context(rounds):
+    # passlib импортируется лениво: в родительском процессе он не нужен
+    context = _contexts.get(rounds)
+    if context is None:
+        from passlib.context import CryptContext
+
+        # min = max = rounds: хэш с любой другой стоимостью считается устаревшим
+        context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds,
+        )
+        _contexts[rounds] = context
+    return context
+
+
+def _init_worker(niceness):
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return _context(rounds).hash(password)
+
+
+def verify_and_update(password: str, password_hash: str, rounds: int = BCRYPT_ROUNDS):
+    """Возвращает (верен ли пароль, новый хэш или None, если пересчёт не нужен)."""
+    return _context(rounds).verify_and_update(password, password_hash)
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers=PASSWORD_WORKERS, queue_size=PASSWORD_QUEUE_SIZE, rounds=BCRYPT_ROUNDS):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rounds = rounds
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.pool_restarts = 0
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn, а не fork: родитель многопоточный и держит соединения с БД
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(PASSWORD_WORKER_NICE,),
+            )
+        return self._executor
+
+    def check_capacity(self):
+        """Ранний отказ, пока запрос ещё не сходил в базу."""
+        if self.pending >= self.queue_size:
+            self.rejected += 1
+            raise HasherBusy()
+
+    async def _submit(self, fn, *args):
+        # Проверка и инкремент без await между ними — атомарны внутри event loop
+        self.check_capacity()
+        self.pending += 1
+        try:
+            if self.workers > 0:
+                executor = self._pool()
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+                except BrokenProcessPool:
+                    # Процесс пула погиб (OOM, segfault) — сломанный пул больше не примет
+                    # задач. Следующий вызов создаст новый, этот запрос получает 503
+                    if self._executor is executor:
+                        self._executor = None
+                        self.pool_restarts += 1
+                        executor.shutdown(wait=False, cancel_futures=True)
+                    raise HasherBusy()
+            return await run_in_threadpool(fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password, password, self.rounds)
+
+    async def verify_and_update(self, password: str, password_hash: str):
+        return await self._submit(verify_and_update, password, password_hash, self.rounds)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "pool_restarts": self.pool_restarts,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hasher = PasswordHasher()
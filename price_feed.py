@@ -0,0 +1,312 @@
+"""Потоковая загрузка котировок в stocks.last_price.
+
+Тики (NDJSON или CSV с колонками symbol,price[,ts][,volume]) схлопываются по
+символу в пределах окна: в базу уходит только последняя цена символа за окно,
+одним executemany UPDATE. Все тики окна без схлопывания пишутся в историю
+цен (price_history.record). Тот же путь используют эндпоинт
+POST /api/stocks/ticks и командная строка:
+
+    python price_feed.py ticks.ndjson --window 0.5
+    python price_feed.py --generate 1000000 --symbols 500 > ticks.ndjson
+"""
+import argparse
+import codecs
+import csv
+import io
+import json
+import math
+import random
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, select, update
+
+from models import Stock
+from price_stream import broker
+from catalog_cache import catalog_cache
+import price_history
+from valuation import apply_price_changes
+
+stocks = Stock.__table__
+
+DEFAULT_WINDOW = 0.5
+SYMBOL_CHUNK = 500
+
+
+class TickError(ValueError):
+    """Битый тик в потоке; applied — сколько тиков до него уже записано в базу."""
+
+    def __init__(self, number, reason, applied):
+        self.number = number
+        self.applied = applied
+        # Окна до ошибки уже закоммичены: клиент досылает поток с тика applied + 1, а не целиком
+        super().__init__(f"tick {number}: {reason}; {applied} ticks before it were already applied")
+
+
+def parse_ts(value):
+    if value is None or value == "":
+        return datetime.utcnow()
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value)
+    try:
+        return datetime.utcfromtimestamp(float(value))
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+
+def csv_columns(header_line):
+    columns = [name.strip().lower() for name in next(csv.reader([header_line]))]
+    optional = [columns.index(name) if name in columns else None for name in ("ts", "volume")]
+    return (columns.index("symbol"), columns.index("price"), *optional)
+
+
+def _number(value, field):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {field}: {value!r}")
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"Invalid {field}: {value!r}")
+    return number
+
+
+def check_tick(symbol, price, ts, volume):
+    """Проверяет тик как stock_import.validate; ValueError с причиной, если он не годится."""
+    if not isinstance(symbol, str) or not symbol:
+        raise ValueError(f"Invalid symbol: {symbol!r}")
+    if ts is not None:
+        # ts остаётся сырым, но разбираемым: иначе ошибка всплыла бы в drain, после записи прежних окон
+        try:
+            parse_ts(ts)
+        except (TypeError, ValueError, OverflowError, OSError):
+            raise ValueError(f"Invalid ts: {ts!r}")
+    return symbol, _number(price, "price"), ts, _number(volume or 0, "volume")
+
+
+def iter_ticks(lines, fmt="ndjson", columns=None):
+    """Разбирает строки в кортежи (symbol, price, ts, volume); ts остаётся сырым.
+
+    Для CSV без columns первая строка считается заголовком. Битый тик —
+    ValueError: цена должна быть конечным неотрицательным числом.
+    """
+    if fmt == "csv":
+        lines = iter(lines)
+        if columns is None:
+            header = next(lines, None)
+            if header is None:
+                return
+            columns = csv_columns(header)
+        symbol_at, price_at, ts_at, volume_at = columns
+        width = max(index for index in columns if index is not None) + 1
+        for row in csv.reader(lines):
+            if row:
+                if len(row) < width:
+                    raise ValueError(f"Expected {width} columns, got {len(row)}")
+                yield check_tick(
+                    row[symbol_at],
+                    row[price_at],
+                    row[ts_at] if ts_at is not None else None,
+                    row[volume_at] if volume_at is not None else 0.0,
+                )
+        return
+    for line in lines:
+        if line.strip():
+            tick = json.loads(line)
+            if not isinstance(tick, dict):
+                raise ValueError(f"Tick must be an object, got {type(tick).__name__}")
+            yield check_tick(tick.get("symbol"), tick.get("price"), tick.get("ts"), tick.get("volume"))
+
+
+class Coalescer:
+    """Хранит последний тик каждого символа до сброса окна (и все тики окна для истории)."""
+
+    def __init__(self, window: float = DEFAULT_WINDOW, keep_ticks: bool = False):
+        self.window = window
+        self.keep_ticks = keep_ticks
+        self.pending = {}
+        self.ticks = []
+        self.received = 0
+        self._opened_at = time.monotonic()
+
+    def add(self, symbol, price, ts, volume=0.0):
+        self.pending[symbol] = (price, ts)
+        if self.keep_ticks:
+            self.ticks.append((symbol, price, ts, volume))
+        self.received += 1
+
+    def due(self) -> bool:
+        return bool(self.pending) and time.monotonic() - self._opened_at >= self.window
+
+    def drain(self):
+        """Возвращает ({symbol: (price, ts)}, тики окна) и открывает новое окно."""
+        pending, self.pending = self.pending, {}
+        ticks, self.ticks = self.ticks, []
+        self._opened_at = time.monotonic()
+        return {symbol: (price, parse_ts(ts)) for symbol, (price, ts) in pending.items()}, ticks
+
+
+def apply_prices(connection, prices: dict, ticks=None) -> list:
+    """Записывает цены {symbol: (price, ts)} и возвращает применённые изменения.
+
+    ticks — все тики окна [(symbol, price, ts, volume)] для истории цен.
+
+    connection синхронный; из AsyncSession функцию вызывают через run_sync.
+    """
+    symbols = list(prices)
+    current = []
+    for start in range(0, len(symbols), SYMBOL_CHUNK):
+        chunk = symbols[start:start + SYMBOL_CHUNK]
+        current.extend(connection.execute(
+            select(stocks.c.id, stocks.c.symbol, stocks.c.last_price).where(stocks.c.symbol.in_(chunk))
+        ))
+    if not current:
+        return []
+    if ticks:
+        price_history.record(connection, {symbol: stock_id for stock_id, symbol, _ in current}, ticks)
+
+    changes = []
+    for stock_id, symbol, old_price in current:
+        price, ts = prices[symbol]
+        changes.append({
+            "stock_id": stock_id,
+            "symbol": symbol,
+            "price": price,
+            "ts": ts,
+            "delta": price - (old_price or 0.0),
+        })
+    connection.execute(
+        update(stocks)
+        .where(stocks.c.id == bindparam("stock_id"))
+        .values(last_price=bindparam("price"), last_updated=bindparam("ts")),
+        changes,
+    )
+    apply_price_changes(connection, changes)
+    return changes
+
+
+def moved(changes) -> list:
+    """Изменения, сдвинувшие цену: повтор той же цены не рассылается и не сбрасывает кэш каталога."""
+    return [change for change in changes if change["delta"]]
+
+
+def _report(coalescer, applied, elapsed):
+    return {
+        "ticks": coalescer.received,
+        "applied_updates": applied,
+        "elapsed_s": round(elapsed, 3),
+        "ticks_per_sec": round(coalescer.received / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+async def ingest_stream(db, chunks, fmt="ndjson", window=DEFAULT_WINDOW) -> dict:
+    """Загружает тики из асинхронного потока байтов (тело HTTP-запроса)."""
+    started = time.perf_counter()
+    coalescer = Coalescer(window, keep_ticks=price_history.ENABLED)
+    applied = committed = 0
+
+    async def flush():
+        nonlocal applied, committed
+        received = coalescer.received
+        prices, ticks = coalescer.drain()
+        changes = await db.run_sync(lambda session: apply_prices(session.connection(), prices, ticks))
+        await db.commit()
+        committed = received
+        published = moved(changes)
+        if published:
+            catalog_cache.bump()
+        broker.publish(published)
+        applied += len(changes)
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    columns = None
+    try:
+        async for chunk in chunks:
+            buffer += decoder.decode(chunk)
+            lines = buffer.split("\n")
+            buffer = lines.pop()
+            if fmt == "csv" and columns is None and lines:
+                columns = csv_columns(lines.pop(0))
+            for tick in iter_ticks(lines, fmt, columns):
+                coalescer.add(*tick)
+            if coalescer.due():
+                await flush()
+        if buffer and (fmt != "csv" or columns is not None):
+            for tick in iter_ticks([buffer], fmt, columns):
+                coalescer.add(*tick)
+        if coalescer.pending:
+            await flush()
+    except ValueError as exc:
+        # Несохранённое окно отбрасывается целиком; записанные окна остаются
+        await db.rollback()
+        raise TickError(coalescer.received + 1, exc, committed) from exc
+
+    return _report(coalescer, applied, time.perf_counter() - started)
+
+
+def ingest_lines(engine, lines, fmt="ndjson", window=DEFAULT_WINDOW) -> dict:
+    """Синхронная загрузка из итерируемого набора строк (CLI, бенчмарки)."""
+    started = time.perf_counter()
+    coalescer = Coalescer(window, keep_ticks=price_history.ENABLED)
+    applied = committed = 0
+
+    def flush():
+        nonlocal applied, committed
+        received = coalescer.received
+        with engine.begin() as connection:
+            changes = apply_prices(connection, *coalescer.drain())
+        committed = received
+        if moved(changes):
+            catalog_cache.bump()
+        applied += len(changes)
+
+    try:
+        for tick in iter_ticks(lines, fmt):
+            coalescer.add(*tick)
+            if coalescer.due():
+                flush()
+        if coalescer.pending:
+            flush()
+    except ValueError as exc:
+        raise TickError(coalescer.received + 1, exc, committed) from exc
+    return _report(coalescer, applied, time.perf_counter() - started)
+
+
+def generate_ticks(count, symbols=100, seed=None):
+    """Синтетические тики: случайное блуждание цен по символам SYM0..SYM{n-1}."""
+    rng = random.Random(seed)
+    prices = [100.0] * symbols
+    now = time.time()
+    for i in range(count):
+        index = rng.randrange(symbols)
+        prices[index] = max(0.01, prices[index] * (1 + rng.gauss(0, 0.001)))
+        yield json.dumps({"symbol": f"SYM{index}", "price": round(prices[index], 4), "ts": now + i * 1e-4})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk price-feed ingestion")
+    parser.add_argument("path", nargs="?", help="файл с тиками, '-' для stdin")
+    parser.add_argument("--format", choices=["ndjson", "csv"])
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW)
+    parser.add_argument("--generate", type=int, metavar="N", help="вывести N синтетических тиков в stdout")
+    parser.add_argument("--symbols", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.generate:
+        for line in generate_ticks(args.generate, args.symbols):
+            sys.stdout.write(line + "\n")
+        return
+    if not args.path:
+        parser.error("path or --generate is required")
+
+    from database import engine
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    stream = sys.stdin if args.path == "-" else io.open(args.path, newline="")
+    with stream:
+        print(json.dumps(ingest_lines(engine, stream, fmt, args.window)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""История цен и OHLCV-свечи.
+
+Каждый тик фида пишется в узкую append-only таблицу price_ticks
+(stock_id, ts, price, volume) с индексом (stock_id, ts); ts хранится
+секундами эпохи, чтобы нарезка на интервалы была арифметикой, одинаковой
+для SQLite и Postgres. При той же записи обновляются предагрегированные
+свечи 1m/1h/1d в price_candles — upsert'ом, который корректно сливает
+свечи и при тиках не по порядку.
+
+Свеча произвольного интервала собирается из самой крупной подходящей
+свёртки (интервал кратен ей), а для интервалов короче минуты или не
+кратных минуте — из сырых тиков. Число свечей в ответе ограничено, так
+что диапазон чтения всегда ограничен.
+
+Пересборка свёрток из тиков:
+
+    python price_history.py rebuild
+"""
+import argparse
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import case, delete, insert, select
+
+from database import dialect_insert
+from models import PriceCandle, PriceTick
+
+ticks_table = PriceTick.__table__
+candles_table = PriceCandle.__table__
+
+ENABLED = os.getenv("PRICE_HISTORY_ENABLED", "1") == "1"
+ROLLUPS = {"1m": 60, "1h": 3600, "1d": 86400}
+MAX_CANDLES = 5000
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_INTERVAL = re.compile(r"^(\d+)([smhdw]?)$")
+
+
+def parse_interval(value: str) -> int:
+    """'30s', '5m', '4h', '1d', '1w' или число секунд -> секунды."""
+    match = _INTERVAL.match(value.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid interval {value!r}")
+    return int(match.group(1)) * _UNITS[match.group(2) or "s"]
+
+
+def to_epoch(value) -> float:
+    """Время тика или запроса в секунды эпохи; наивные datetime считаются UTC."""
+    if value is None or value == "":
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _insert(connection):
+    return dialect_insert(connection)
+
+
+def _upsert_candles(connection, rows):
+    stmt = _insert(connection)(candles_table)
+    new, old = stmt.excluded, candles_table.c
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[old.stock_id, old.interval, old.bucket],
+        set_={
+            # Правые части видят старую строку, поэтому порядок колонок не важен
+            "open": case((new.first_ts < old.first_ts, new.open), else_=old.open),
+            "first_ts": case((new.first_ts < old.first_ts, new.first_ts), else_=old.first_ts),
+            "close": case((new.last_ts >= old.last_ts, new.close), else_=old.close),
+            "last_ts": case((new.last_ts >= old.last_ts, new.last_ts), else_=old.last_ts),
+            "high": case((new.high > old.high, new.high), else_=old.high),
+            "low": case((new.low < old.low, new.low), else_=old.low),
+            "volume": old.volume + new.volume,
+            "ticks": old.ticks + new.ticks,
+        },
+    )
+    connection.execute(stmt, rows)
+
+
+def record(connection, stock_ids: dict, ticks: list) -> int:
+    """Пишет тики [(symbol, price, ts, volume)] и обновляет свёртки; stock_ids — {symbol: id}."""
+    rows = [
+        {"stock_id": stock_ids[symbol], "ts": to_epoch(ts), "price": price, "volume": volume}
+        for symbol, price, ts, volume in ticks
+        if symbol in stock_ids
+    ]
+    if not rows:
+        return 0
+    connection.execute(insert(ticks_table), rows)
+
+    candles = {}
+    for row in rows:
+        ts, price = row["ts"], row["price"]
+        for interval in ROLLUPS.values():
+            key = (row["stock_id"], interval, ts - ts % interval)
+            candle = candles.get(key)
+            if candle is None:
+                candles[key] = [price, price, price, price, row["volume"], 1, ts, ts]
+                continue
+            if ts < candle[6]:
+                candle[0], candle[6] = price, ts
+            if ts >= candle[7]:
+                candle[3], candle[7] = price, ts
+            if price > candle[1]:
+                candle[1] = price
+            if price < candle[2]:
+                candle[2] = price
+            candle[4] += row["volume"]
+            candle[5] += 1
+    _upsert_candles(connection, [
+        {"stock_id": stock_id, "interval": interval, "bucket": bucket,
+         "open": c[0], "high": c[1], "low": c[2], "close": c[3],
+         "volume": c[4], "ticks": c[5], "first_ts": c[6], "last_ts": c[7]}
+        for (stock_id, interval, bucket), c in candles.items()
+    ])
+    return len(rows)
+
+
+def aggregate(buckets, opens, highs, lows, closes, volumes, counts, interval):
+    """Сливает упорядоченные по времени свечи (или тики) в свечи длины interval."""
+    # Свёртка нужна только пересборке и крупным интервалам: NumPy не грузится при старте
+    import numpy as np
+
+    buckets = np.asarray(buckets, dtype=np.float64)
+    if not len(buckets):
+        return []
+    keys = np.floor(buckets / interval)
+    starts = np.flatnonzero(np.diff(keys, prepend=np.nan))
+    ends = np.append(starts[1:], len(keys)) - 1
+    columns = zip(
+        (keys[starts] * interval).tolist(),
+        np.asarray(opens, dtype=np.float64)[starts].tolist(),
+        np.maximum.reduceat(np.asarray(highs, dtype=np.float64), starts).tolist(),
+        np.minimum.reduceat(np.asarray(lows, dtype=np.float64), starts).tolist(),
+        np.asarray(closes, dtype=np.float64)[ends].tolist(),
+        np.add.reduceat(np.asarray(volumes, dtype=np.float64), starts).tolist(),
+        np.add.reduceat(np.asarray(counts, dtype=np.int64), starts).tolist(),
+    )
+    return [
+        {"time": datetime.fromtimestamp(bucket, timezone.utc).replace(tzinfo=None),
+         "open": o, "high": h, "low": l, "close": c, "volume": v, "ticks": n}
+        for bucket, o, h, l, c, v, n in columns
+    ]
+
+
+def source_for(interval: int):
+    """Самая крупная свёртка, на которую делится интервал, или None (сырые тики)."""
+    fitting = [size for size in ROLLUPS.values() if interval % size == 0]
+    return max(fitting) if fitting else None
+
+
+def candles_query(stock_id, interval, start, end):
+    base = source_for(interval)
+    if base is None:
+        return (
+            select(PriceTick.ts, PriceTick.price, PriceTick.volume)
+            .where(PriceTick.stock_id == stock_id, PriceTick.ts >= start, PriceTick.ts < end)
+            .order_by(PriceTick.ts)
+        )
+    return (
+        select(PriceCandle.bucket, PriceCandle.open, PriceCandle.high, PriceCandle.low, PriceCandle.close,
+               PriceCandle.volume, PriceCandle.ticks)
+        .where(
+            PriceCandle.stock_id == stock_id,
+            PriceCandle.interval == base,
+            PriceCandle.bucket >= start,
+            PriceCandle.bucket < end,
+        )
+        .order_by(PriceCandle.bucket)
+    )
+
+
+def candle_range(interval, start=None, end=None, limit=MAX_CANDLES):
+    """Границы чтения в секундах эпохи: не больше limit свечей, начало выровнено."""
+    end = to_epoch(end) if end is not None else time.time()
+    earliest = end - interval * min(limit, MAX_CANDLES)
+    start = max(to_epoch(start), earliest) if start is not None else earliest
+    return start - start % interval, end
+
+
+def candles(connection, stock_id, interval, start=None, end=None, limit=MAX_CANDLES):
+    start, end = candle_range(interval, start, end, limit)
+    rows = connection.execute(candles_query(stock_id, interval, start, end)).all()
+    if not rows:
+        return []
+    columns = list(zip(*rows))
+    if len(columns) == 3:
+        # Сырые тики: каждый — свеча из одной цены
+        ts, price, volume = columns
+        columns = [ts, price, price, price, price, volume, [1] * len(rows)]
+    return aggregate(*columns, interval)[-limit:]
+
+
+def rebuild(connection) -> int:
+    """Пересчитывает price_candles из price_ticks; возвращает число свечей."""
+    import numpy as np
+
+    connection.execute(delete(candles_table))
+    total = 0
+    stock_ids = connection.execute(select(PriceTick.stock_id).distinct()).scalars().all()
+    for stock_id in stock_ids:
+        rows = connection.execute(
+            select(PriceTick.ts, PriceTick.price, PriceTick.volume)
+            .where(PriceTick.stock_id == stock_id)
+            .order_by(PriceTick.ts)
+        ).all()
+        ts, price, volume = (np.asarray(column, dtype=np.float64) for column in zip(*rows))
+        for interval in ROLLUPS.values():
+            keys = np.floor(ts / interval)
+            starts = np.flatnonzero(np.diff(keys, prepend=np.nan))
+            ends = np.append(starts[1:], len(keys)) - 1
+            batch = [
+                {"stock_id": stock_id, "interval": interval, "bucket": b, "open": o, "high": h, "low": l,
+                 "close": c, "volume": v, "ticks": n, "first_ts": f, "last_ts": t}
+                for b, o, h, l, c, v, n, f, t in zip(
+                    (keys[starts] * interval).tolist(), price[starts].tolist(),
+                    np.maximum.reduceat(price, starts).tolist(), np.minimum.reduceat(price, starts).tolist(),
+                    price[ends].tolist(), np.add.reduceat(volume, starts).tolist(),
+                    np.diff(np.append(starts, len(keys))).tolist(), ts[starts].tolist(), ts[ends].tolist(),
+                )
+            ]
+            connection.execute(insert(candles_table), batch)
+            total += len(batch)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Price history maintenance")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    from database import engine
+
+    with engine.begin() as connection:
+        print(f"Rebuilt {rebuild(connection)} candles")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Внутрипроцессная рассылка изменений цен подписчикам (WebSocket / SSE).
+
+Каждая подписка хранит не очередь, а последнюю цену по каждому символу:
+если клиент не успевает читать, старые значения заменяются новыми. Память
+на подписчика ограничена числом его символов, а публикация никогда не ждёт
+медленного клиента. Клиента, который слишком долго не принимает данные,
+эндпоинт отключает (см. routers/stream.py).
+"""
+import asyncio
+from collections import defaultdict
+
+MAX_SYMBOLS_PER_SUBSCRIPTION = 1000
+
+
+class Subscription:
+    def __init__(self, symbols):
+        self.symbols = frozenset(symbols)
+        self.pending = {}
+        self.delivered = 0
+        self.conflated = 0
+        self._ready = asyncio.Event()
+
+    def offer(self, update: dict):
+        if update["symbol"] in self.pending:
+            self.conflated += 1
+        self.pending[update["symbol"]] = update
+        self._ready.set()
+
+    async def get(self) -> list:
+        """Ждёт и забирает все накопившиеся изменения."""
+        await self._ready.wait()
+        self._ready.clear()
+        updates, self.pending = list(self.pending.values()), {}
+        self.delivered += len(updates)
+        return updates
+
+
+class PriceBroker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self.published = 0
+
+    @property
+    def subscriptions(self) -> int:
+        return len({sub for subs in self._subscribers.values() for sub in subs})
+
+    def subscribe(self, symbols) -> Subscription:
+        subscription = Subscription(symbols)
+        for symbol in subscription.symbols:
+            self._subscribers[symbol].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for symbol in subscription.symbols:
+            subscribers = self._subscribers.get(symbol)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[symbol]
+
+    def publish(self, changes):
+        """changes: словари с ключами symbol, price, ts. Вызывать из event loop."""
+        for change in changes:
+            subscribers = self._subscribers.get(change["symbol"])
+            if not subscribers:
+                continue
+            update = {
+                "symbol": change["symbol"],
+                "price": change["price"],
+                "ts": change["ts"].isoformat(),
+            }
+            for subscription in subscribers:
+                subscription.offer(update)
+            self.published += 1
+
+
+broker = PriceBroker()
+
+
+def parse_symbols(raw: str) -> list:
+    symbols = [symbol.strip() for symbol in raw.split(",") if symbol.strip()]
+    if not symbols:
+        raise ValueError("At least one symbol is required")
+    if len(symbols) > MAX_SYMBOLS_PER_SUBSCRIPTION:
+        raise ValueError(f"At most {MAX_SYMBOLS_PER_SUBSCRIPTION} symbols per subscription")
+    return symbols
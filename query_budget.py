@@ -0,0 +1,220 @@
+"""Бюджет SQL-запросов на маршрут и поиск N+1.
+
+Слушатель after_cursor_execute пишет каждый запрос в журнал текущей
+области (contextvar), открытой через count_queries() или query_budget().
+N+1 — один и тот же нормализованный запрос (литералы и списки IN
+свёрнуты) повторился в области не меньше QUERY_BUDGET_REPEAT раз.
+
+    with query_budget(3):                    # в тесте или скрипте
+        ...
+    @query_budget(2)                         # на функции, sync или async
+    async def handler(...): ...
+
+ROUTE_BUDGETS — потолок запросов для каждого маршрута API. В dev-режиме
+(QUERY_BUDGET_MODE=warn или raise) QueryBudgetMiddleware сверяет с ним
+каждый запрос: warn пишет в лог "query_budget", raise бросает
+QueryBudgetExceeded. Прогон всех маршрутов против бюджетов:
+
+    python benchmarks/query_budgets.py
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import re
+from collections import Counter
+
+from sqlalchemy import event
+
+MODE = os.getenv("QUERY_BUDGET_MODE", "off")
+REPEAT_THRESHOLD = int(os.getenv("QUERY_BUDGET_REPEAT", "5"))
+
+log = logging.getLogger("query_budget")
+
+# (метод, шаблон пути) -> максимум SQL-запросов за запрос, включая поиск
+# пользователя по токену при промахе кэша; None — число запросов зависит от
+# входа, маршрут не проверяется
+ROUTE_BUDGETS = {
+    ("GET", "/"): 0,
+    ("POST", "/api/auth/register"): 2,
+    ("POST", "/api/auth/login"): 2,  # второй — сохранение пересчитанного хэша
+    ("GET", "/api/users/me"): 1,
+    ("GET", "/api/users/cache/stats"): 1,
+    ("GET", "/api/stocks"): 1,
+    ("GET", "/api/stocks/{stock_id}"): 1,
+    # Из индекса в памяти; сборка идёт в фоновой задаче вне запроса
+    ("GET", "/api/stocks/search"): 0,
+    # Чтение и upsert на каждую пачку листинга
+    ("POST", "/api/stocks/import"): None,
+    ("GET", "/api/stocks/{stock_id}/candles"): 2,
+    ("POST", "/api/stocks"): 2,
+    # По пять запросов на каждый сброс окна схлопывания
+    ("POST", "/api/stocks/ticks"): None,
+    ("GET", "/api/portfolios"): 3,
+    ("GET", "/api/portfolios/value"): 4,
+    ("GET", "/api/portfolios/valuation"): 3,
+    ("GET", "/api/portfolios/analytics"): 3,
+    ("POST", "/api/portfolio_positions"): 4,
+    ("DELETE", "/api/portfolio_positions/{position_id}"): 4,
+    ("GET", "/api/portfolios/{portfolio_id}/positions"): 1,
+    ("POST", "/api/transactions/buy"): 4,
+    ("POST", "/api/transactions/sell"): 5,
+    # Запись позиций — по запросу на каждую изменённую акцию пакета
+    ("POST", "/api/transactions/batch"): None,
+    ("POST", "/api/transaction"): 1,
+    ("POST", "/api/transactions"): 3,
+    ("GET", "/api/transactions/history"): 2,
+    ("GET", "/api/transactions/export"): 2,
+    ("GET", "/api/currencies"): 1,
+    ("PUT", "/api/currencies/rates"): 2,
+    ("GET", "/api/currencies/stats"): 0,
+    ("GET", "/api/orders/{order_id}"): 2,
+    # Ответы из памяти; до 4 запросов — прогрев счётчиков и перечитывание снимка
+    ("GET", "/api/market/most-traded"): 4,
+    ("GET", "/api/market/open-interest"): 4,
+    ("GET", "/api/market/stocks/{stock_id}/holders"): 5,
+    ("GET", "/api/stream/prices/sse"): 0,
+    ("GET", "/metrics"): 0,
+}
+_UNKNOWN = object()
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|\$\d+|:\w+))*\s*\)")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def normalize(statement: str) -> str:
+    """SQL без литералов и с одинаковым видом списков параметров: ключ для поиска N+1."""
+    statement = " ".join(statement.split())
+    return _IN_LIST.sub("(?)", _LITERALS.sub("?", statement))
+
+
+class QueryLog:
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def repeated(self, threshold: int = None) -> list:
+        """[(нормализованный запрос, повторы)] для запросов, повторённых не меньше threshold раз."""
+        threshold = REPEAT_THRESHOLD if threshold is None else threshold
+        counts = Counter(normalize(statement) for statement in self.statements)
+        return [(statement, times) for statement, times in counts.most_common() if times >= threshold]
+
+    def problems(self, max_queries=None, repeat_threshold=None) -> list:
+        found = []
+        if max_queries is not None and self.count > max_queries:
+            found.append(f"{self.count} queries, budget {max_queries}")
+        for statement, times in self.repeated(repeat_threshold):
+            found.append(f"possible N+1: {times}x {statement}")
+        return found
+
+    def report(self) -> str:
+        return "\n".join(f"  {' '.join(statement.split())}" for statement in self.statements)
+
+
+_current = contextvars.ContextVar("query_log", default=None)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    query_log = _current.get()
+    # Запрос засчитывается и во все объемлющие области
+    while query_log is not None:
+        query_log.statements.append(statement)
+        query_log = query_log.parent
+
+
+def instrument_engine(engine):
+    engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+class count_queries:
+    """Контекстный менеджер: собирает SQL, выполненный внутри, в QueryLog."""
+
+    def __enter__(self) -> QueryLog:
+        self.log = QueryLog(_current.get())
+        self._token = _current.set(self.log)
+        return self.log
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+        return False
+
+
+class query_budget:
+    """Падает с QueryBudgetExceeded, если в области больше max_queries запросов или есть N+1."""
+
+    def __init__(self, max_queries: int = None, repeat_threshold: int = None):
+        self.max_queries = max_queries
+        self.repeat_threshold = repeat_threshold
+
+    def __enter__(self) -> QueryLog:
+        self._counter = count_queries()
+        return self._counter.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._counter.__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            self.check(self._counter.log)
+        return False
+
+    def check(self, query_log: QueryLog, label: str = "block"):
+        problems = query_log.problems(self.max_queries, self.repeat_threshold)
+        if problems:
+            raise QueryBudgetExceeded(f"{label}: " + "; ".join(problems) + "\n" + query_log.report())
+
+    def __call__(self, fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with query_budget(self.max_queries, self.repeat_threshold):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with query_budget(self.max_queries, self.repeat_threshold):
+                    return fn(*args, **kwargs)
+        return wrapper
+
+
+def route_problems(method: str, route: str, query_log: QueryLog) -> list:
+    budget = ROUTE_BUDGETS.get((method, route), _UNKNOWN)
+    if budget is None:
+        return []
+    if budget is _UNKNOWN:
+        # Служебные маршруты FastAPI (/docs, /openapi.json) бюджета не требуют
+        return ["no budget in ROUTE_BUDGETS"] if route.startswith("/api/") else query_log.problems()
+    return query_log.problems(budget)
+
+
+class QueryBudgetMiddleware:
+    """Dev-режим: сверяет число запросов каждого HTTP-запроса с ROUTE_BUDGETS."""
+
+    def __init__(self, app, mode: str = None):
+        self.app = app
+        self.mode = mode or MODE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.mode == "off":
+            return await self.app(scope, receive, send)
+        with count_queries() as query_log:
+            await self.app(scope, receive, send)
+        method = scope["method"]
+        route = getattr(scope.get("route"), "path", None) or "unmatched"
+        problems = route_problems(method, route, query_log)
+        if not problems:
+            return
+        message = f"{method} {route}: " + "; ".join(problems)
+        if self.mode == "raise":
+            raise QueryBudgetExceeded(message + "\n" + query_log.report())
+        log.warning("%s\n%s", message, query_log.report())
@@ -1,38 +1,51 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from models import User
 from schemas import UserCreate
-from passlib.context import CryptContext
+from password_hasher import HasherBusy, PASSWORD_RETRY_AFTER, hasher
 import uuid
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
+from datetime import datetime
+from tokens import create_access_token, user_claims
 
 
-SECRET_KEY = "secret_key" 
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 300
-
 router = APIRouter()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-def create_access_token(data: dict, expires_delta: timedelta = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=500)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+def _hasher_busy():
+    return HTTPException(
+        status_code=503,
+        detail="Too many authentication requests, try again later",
+        headers={"Retry-After": str(PASSWORD_RETRY_AFTER)},
+    )
+
+
+def _check_hasher_capacity():
+    # Очередь пула переполнена: отвечаем сразу, не обращаясь к базе
+    try:
+        hasher.check_capacity()
+    except HasherBusy:
+        raise _hasher_busy()
+
+
+async def _run_hasher(operation, *args):
+    try:
+        return await operation(*args)
+    except HasherBusy:
+        raise _hasher_busy()
 
 @router.post("/api/auth/register")
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    _check_hasher_capacity()
+    result = await db.execute(select(User).where(User.email == user.email))
+    db_user = result.scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = pwd_context.hash(user.password)
+    # Возвращаем соединение в пул на время bcrypt, иначе шторм логинов выбирает весь пул
+    await db.close()
+    hashed_password = await _run_hasher(hasher.hash, user.password)
     new_user = User(
         id=uuid.uuid4(),
         email=user.email,
@@ -41,24 +54,40 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         updated_at=datetime.utcnow()
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    # Пока считался хэш, тот же email мог зарегистрировать параллельный запрос
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
 
     access_token = create_access_token(
-        data={"sub": str(new_user.id)}
+        data=user_claims(new_user)
     )
 
     return {"id": new_user.id, "token": access_token}
 
 @router.post("/api/auth/login")
-def login(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if not db_user or not pwd_context.verify(user.password, db_user.password_hash):
+async def login(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    _check_hasher_capacity()
+    result = await db.execute(select(User).where(User.email == user.email))
+    db_user = result.scalars().first()
+    if not db_user:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
-    
+    await db.close()
+    verified, new_hash = await _run_hasher(hasher.verify_and_update, user.password, db_user.password_hash)
+    if not verified:
+        raise HTTPException(status_code=400, detail="Incorrect email or password")
+    # Хэш со старой стоимостью пересчитан при проверке — сохраняем его
+    if new_hash:
+        db.add(db_user)
+        db_user.password_hash = new_hash
+        db_user.updated_at = datetime.utcnow()
+        await db.commit()
+
 
     access_token = create_access_token(
-        data={"sub": str(db_user.id)}
+        data=user_claims(db_user)
     )
 
     return {"token": access_token}
\ No newline at end of file
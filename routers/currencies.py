@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, get_read_db
+from models import Currency, User as UserModel
+from schemas import Currency as CurrencySchema, CurrencyRatesUpdate
+from routers.users import get_current_user
+import fx
+
+router = APIRouter()
+
+@router.get("/api/currencies", response_model=list[CurrencySchema])
+async def read_currencies(db: AsyncSession = Depends(get_read_db)):
+    result = await db.execute(select(Currency).order_by(Currency.symbol))
+    return result.scalars().all()
+
+@router.put("/api/currencies/rates", response_model=dict)
+async def update_rates(
+    update: CurrencyRatesUpdate,
+    current_user: UserModel = Depends(get_current_user),  # Курсы меняют все пересчитанные оценки
+    db: AsyncSession = Depends(get_async_db)):
+    # Один upsert на всю пачку курсов, затем таблица курсов в памяти перечитывается
+    updated = await db.run_sync(
+        lambda session: fx.upsert_rates(session.connection(), [rate.dict() for rate in update.rates])
+    )
+    await db.commit()
+    fx.rates.invalidate()
+    return {"updated": updated}
+
+@router.get("/api/currencies/stats", response_model=dict)
+async def read_rate_stats():
+    return fx.rates.stats()
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from uuid import UUID
+from database import get_read_db
+from models import Stock
+from schemas import MostTradedStock, OpenInterestReport, StockHolders
+from market import RANKINGS, WINDOW_MINUTES, market
+
+router = APIRouter()
+
+async def ensure_market(db: AsyncSession):
+    # Обычно всё уже в памяти и соединение из пула не берётся
+    market.start()
+    if market.stale():
+        await db.run_sync(lambda session: market.ensure(session.connection()))
+
+@router.get("/api/market/most-traded", response_model=list[MostTradedStock])
+async def read_most_traded(
+    minutes: int = Query(15, ge=1, le=WINDOW_MINUTES),
+    limit: int = Query(10, ge=1, le=100),
+    by: str = "volume",
+    db: AsyncSession = Depends(get_read_db)
+):
+    if by not in RANKINGS:
+        raise HTTPException(status_code=400, detail=f"Unsupported ranking, use one of: {', '.join(RANKINGS)}")
+    await ensure_market(db)
+    rows = market.most_traded(minutes, limit, by)
+    missing = [row["stock_id"] for row in rows if row["symbol"] is None]
+    if missing:
+        # Акции могли появиться после снимка
+        result = await db.execute(select(Stock.id, Stock.symbol).where(Stock.id.in_(missing)))
+        symbols = dict(result.all())
+        for row in rows:
+            if row["symbol"] is None:
+                row["symbol"] = symbols.get(row["stock_id"])
+    return rows
+
+@router.get("/api/market/open-interest", response_model=OpenInterestReport)
+async def read_open_interest(
+    limit: int = Query(50, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_db)
+):
+    await ensure_market(db)
+    snapshot = market.snapshot
+    return {"as_of": snapshot.as_of, "stocks": snapshot.ranked[:limit]}
+
+@router.get("/api/market/stocks/{stock_id}/holders", response_model=StockHolders)
+async def read_stock_holders(stock_id: UUID, db: AsyncSession = Depends(get_read_db)):
+    await ensure_market(db)
+    snapshot = market.snapshot
+    symbol = snapshot.symbols.get(stock_id)
+    if symbol is None:
+        # Акция могла появиться после снимка
+        result = await db.execute(select(Stock.symbol).where(Stock.id == stock_id))
+        symbol = result.scalar()
+        if symbol is None:
+            raise HTTPException(status_code=404, detail="Stock not found")
+
+    row = snapshot.by_stock.get(stock_id, {"open_interest": 0, "holders": 0})
+    return {
+        "stock_id": stock_id,
+        "symbol": symbol,
+        "open_interest": row["open_interest"],
+        "holders": row["holders"],
+        "as_of": snapshot.as_of,
+        "top_holders": snapshot.holders.get(stock_id, []),
+    }
@@ -0,0 +1,73 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from catalog_cache import catalog_cache
+from database import async_engine, async_read_engine
+from password_hasher import hasher
+from price_stream import broker
+from order_queue import order_queue
+from market import market
+from search_index import search_index
+from routers.users import user_cache
+from tokens import token_cache
+import analytics
+import fx
+import metrics
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def cache_gauges() -> list:
+    caches = {
+        "catalog": catalog_cache.stats(),
+        "users": user_cache.stats(),
+        "tokens": token_cache.stats(),
+        "analytics_history": analytics.history_cache.stats(),
+    }
+    lines = []
+    for field in ("hits", "misses"):
+        lines += metrics.render_counters(
+            f"cache_{field}_total", f"Cache {field}",
+            {(name,): stats[field] for name, stats in caches.items() if field in stats}, ("cache",),
+        )
+    lines += metrics.render_gauges(
+        "cache_size", "Cache size",
+        {(name,): stats["size"] for name, stats in caches.items() if "size" in stats}, ("cache",),
+    )
+    return lines
+
+def pool_gauges() -> list:
+    pools = {"write": async_engine.sync_engine.pool, "read": async_read_engine.sync_engine.pool}
+    # Без отдельной базы для чтения оба имени указывают на один пул
+    if pools["read"] is pools["write"]:
+        del pools["read"]
+    return [
+        *metrics.render_gauges("db_pool_size", "Configured pool size",
+                               {(name,): pool.size() for name, pool in pools.items()}, ("pool",)),
+        *metrics.render_gauges("db_pool_checked_out", "Connections in use",
+                               {(name,): pool.checkedout() for name, pool in pools.items()}, ("pool",)),
+        *metrics.render_gauges("db_pool_overflow", "Connections above pool size",
+                               {(name,): max(0, pool.overflow()) for name, pool in pools.items()}, ("pool",)),
+    ]
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    hasher_stats = hasher.stats()
+    queue_stats = order_queue.stats()
+    lines = [
+        *cache_gauges(),
+        *pool_gauges(),
+        *metrics.threadpool_gauges(),
+        *metrics.render_gauges("password_hasher_pending", "Password hashes queued or running", {(): hasher_stats["pending"]}),
+        *metrics.render_counters("password_hasher_rejected_total", "Password hashes rejected as busy", {(): hasher_stats["rejected"]}),
+        *metrics.render_counters("password_hasher_pool_restarts_total", "Password hasher pools recreated after a worker died",
+                                 {(): hasher_stats["pool_restarts"]}),
+        *metrics.render_counters("fx_rate_table_loads_total", "FX rate table loads", {(): fx.rates.loads}),
+        *metrics.render_gauges("price_stream_subscriptions", "Live price subscriptions", {(): broker.subscriptions}),
+        *metrics.render_gauges("order_queue_pending", "Orders journaled and not yet applied", {(): queue_stats["pending"]}),
+        *metrics.render_counters("market_trades_recorded_total", "Trades fed into rolling market counters", {(): market.trades.recorded}),
+        *metrics.render_counters("market_snapshot_refreshes_total", "Market snapshot rebuilds in this process", {(): market.refreshes}),
+        *metrics.render_gauges("stock_search_index_size", "Stocks in the in-memory search index", {(): len(search_index)}),
+        *metrics.render_counters("order_queue_groups_total", "Order groups committed by the queue worker", {(): queue_stats["groups"]}),
+    ]
+    return PlainTextResponse(metrics.render(lines), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from uuid import UUID
+from database import get_read_db
+from models import Order, User as UserModel
+from schemas import OrderStatus
+from routers.users import get_current_user
+from order_queue import order_queue
+
+router = APIRouter()
+
+@router.get("/api/orders/{order_id}", response_model=OrderStatus)
+async def read_order(
+    order_id: UUID,
+    current_user: UserModel = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    # Заявка ещё в очереди — её нет в базе, статус берётся из памяти
+    order = order_queue.status(order_id)
+    if order is not None and order["user_id"] == str(current_user.id):
+        return {**order, "status": "PENDING"}
+
+    result = await db.execute(select(Order).where(Order.id == order_id, Order.user_id == current_user.id))
+    order = result.scalars().first()
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
@@ -1,60 +1,145 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
-from models import Portfolio, PortfolioPosition, Stock, User as UserModel
-from schemas import Portfolio as PortfolioSchema, PortfolioPosition as PortfolioPositionSchema, PortfolioPositionResponse, PortfolioPositionCreate
+from fastapi import APIRouter, Depends, HTTPException, Request
+from metrics import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, get_read_db
+from models import Portfolio, PortfolioPosition, PortfolioValuation, Stock, User as UserModel
+from schemas import Portfolio as PortfolioSchema, PortfolioPosition as PortfolioPositionSchema, PortfolioPositionResponse, PortfolioPositionCreate, PortfolioValue, PortfolioAnalytics, PortfolioValuationReport
+from typing import Optional
 from uuid import UUID
 import uuid
 from datetime import datetime
 from routers.users import get_current_user
+from valuation import apply_delta, last_price
+import analytics
+import fx
+import serialization
 
 router = APIRouter()
 
 @router.get("/api/portfolios", response_model=list[PortfolioPositionResponse])
-def get_portfolio(
+async def get_portfolio(
+    request: Request,
     current_user: UserModel = Depends(get_current_user),  # Проверяем авторизацию
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     # Получаем портфель пользователя
-    portfolio = db.query(Portfolio).filter(Portfolio.user_id == current_user.id).first()
+    result = await db.execute(select(Portfolio).where(Portfolio.user_id == current_user.id))
+    portfolio = result.scalars().first()
     if not portfolio:
         raise HTTPException(status_code=404, detail="Portfolio not found for this user")
 
     # Получаем позиции в портфеле с объединением таблиц
-    positions = db.query(
-        PortfolioPosition.portfolio_id,
-        Stock.name.label("stock_name"),
-        Stock.symbol.label("stock_symbol"),
-        Stock.last_price.label("current_price"),
-        PortfolioPosition.amount,
-        PortfolioPosition.average_price.label("average_purchase_price")
-    ).join(Stock, PortfolioPosition.stock_id == Stock.id) \
-     .filter(PortfolioPosition.portfolio_id == portfolio.id) \
-     .all()
+    result = await db.execute(
+        select(
+            PortfolioPosition.portfolio_id,
+            Stock.name.label("stock_name"),
+            Stock.symbol.label("stock_symbol"),
+            Stock.last_price.label("current_price"),
+            PortfolioPosition.amount,
+            PortfolioPosition.average_price.label("average_purchase_price")
+        ).join(Stock, PortfolioPosition.stock_id == Stock.id)
+         .where(PortfolioPosition.portfolio_id == portfolio.id)
+    )
+    positions = result.all()
 
     if not positions:
         raise HTTPException(status_code=404, detail="No positions found in the portfolio")
 
-    return positions
+    # Строки сразу в байты ответа, минуя модели Pydantic; колонки сопоставляются с полями по имени
+    return serialization.respond(request, PortfolioPositionResponse, positions, result.keys())
+
+async def value_in_currency(db: AsyncSession, user_id, currency: str, load, convert) -> dict:
+    result = await db.execute(select(Portfolio.id).where(Portfolio.user_id == user_id))
+    portfolio_id = result.scalar()
+    if portfolio_id is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found for this user")
+
+    # Курсы берутся из таблицы в памяти, а не джойном на каждую позицию
+    data, table = await db.run_sync(
+        lambda session: (load(session.connection(), portfolio_id), fx.rates.ensure(session.connection()))
+    )
+    try:
+        return convert(data, currency, table)
+    except fx.UnknownCurrency as exc:
+        raise HTTPException(status_code=422, detail=f"No exchange rate for: {', '.join(exc.symbols)}")
+
+@router.get("/api/portfolios/valuation", response_model=PortfolioValuationReport)
+async def get_portfolio_valuation(
+    currency: str,
+    current_user: UserModel = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await value_in_currency(db, current_user.id, currency, fx.load_positions, fx.value)
+
+@router.get("/api/portfolios/value", response_model=PortfolioValue)
+async def get_portfolio_value(
+    currency: Optional[str] = None,
+    current_user: UserModel = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    if currency:
+        return await value_in_currency(db, current_user.id, currency, fx.load_totals, fx.total)
+
+    # Стоимость берётся из поддерживаемого агрегата, позиции не сканируются
+    result = await db.execute(
+        select(Portfolio.id, PortfolioValuation.cost_basis, PortfolioValuation.market_value)
+        .outerjoin(PortfolioValuation, PortfolioValuation.portfolio_id == Portfolio.id)
+        .where(Portfolio.user_id == current_user.id)
+    )
+    row = result.first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Portfolio not found for this user")
+
+    return {"total_value": row.market_value or 0.0, "cost_basis": row.cost_basis or 0.0}
+
+@router.get("/api/portfolios/analytics", response_model=PortfolioAnalytics)
+async def get_portfolio_analytics(
+    method: str = "fifo",
+    current_user: UserModel = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    if method not in analytics.METHODS:
+        raise HTTPException(status_code=400, detail=f"Unsupported method, use one of: {', '.join(analytics.METHODS)}")
+
+    cached = analytics.history_cache.get(current_user.id)
+    history = await db.run_sync(
+        lambda session: analytics.load_history(session.connection(), current_user.id, cached)
+    )
+    if history is None:
+        raise HTTPException(status_code=404, detail="No transactions found for this user")
+    analytics.history_cache.set(current_user.id, history)
+    symbols, prices = await db.run_sync(
+        lambda session: analytics.load_prices(session.connection(), history["stock_ids"])
+    )
+    # Соединение больше не нужно, а расчёт на NumPy не должен держать event loop
+    await db.close()
+    return await run_in_threadpool(analytics.compute, history, prices, symbols, method)
 
 @router.post("/api/portfolio_positions", response_model=PortfolioPositionSchema)
-def create_portfolio_position(
+async def create_portfolio_position(
     position_data: PortfolioPositionCreate,  # Тело запроса
     current_user: UserModel = Depends(get_current_user),  # Проверка авторизации
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Проверяем, существует ли портфель
-    portfolio = db.query(Portfolio).filter(Portfolio.id == position_data.portfolio_id).first()
-    if not portfolio:
+    # Портфель и акция читаются одним запросом: LEFT JOIN по id акции
+    result = await db.execute(
+        select(Portfolio.user_id, Stock.id.label("stock_id"), Stock.last_price)
+        .select_from(Portfolio)
+        .outerjoin(Stock, Stock.id == position_data.stock_id)
+        .where(Portfolio.id == position_data.portfolio_id)
+    )
+    found = result.first()
+    if not found:
         raise HTTPException(status_code=404, detail="Portfolio not found")
 
     # Проверяем, что текущий пользователь владеет этим портфелем
-    if portfolio.user_id != current_user.id:
+    if found.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="You do not have access to this portfolio")
 
     # Проверяем, существует ли акция
-    stock = db.query(Stock).filter(Stock.id == position_data.stock_id).first()
-    if not stock:
+    if found.stock_id is None:
         raise HTTPException(status_code=404, detail="Stock not found")
 
     # Проверяем, что количество акций положительное
@@ -72,8 +157,17 @@ def create_portfolio_position(
 
     # Добавляем позицию в базу данных
     db.add(new_position)
-    db.commit()
-    db.refresh(new_position)
+    # Без котировки рыночная стоимость позиции нулевая, как в valuation.last_price
+    await apply_delta(
+        db, new_position.portfolio_id,
+        new_position.amount * new_position.average_price,
+        new_position.amount * (found.last_price or 0.0),
+    )
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Position for this stock already exists")
 
     return new_position
 
@@ -81,29 +175,40 @@ def create_portfolio_position(
 
 
 @router.delete("/api/portfolio_positions/{position_id}", response_model=dict)
-def delete_portfolio_position(
+async def delete_portfolio_position(
     position_id: UUID,
     current_user: UserModel = Depends(get_current_user),  # Проверка авторизации
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Проверяем, существует ли позиция
-    position = db.query(PortfolioPosition).filter(PortfolioPosition.id == position_id).first()
-    if not position:
+    # Позиция и владелец портфеля читаются одним запросом
+    result = await db.execute(
+        select(PortfolioPosition, Portfolio.user_id)
+        .join(Portfolio, Portfolio.id == PortfolioPosition.portfolio_id)
+        .where(PortfolioPosition.id == position_id)
+    )
+    found = result.first()
+    if not found:
         raise HTTPException(status_code=404, detail="Portfolio position not found")
+    position, owner_id = found
 
     # Проверяем, что текущий пользователь владеет этим портфелем
-    portfolio = db.query(Portfolio).filter(Portfolio.id == position.portfolio_id).first()
-    if portfolio.user_id != current_user.id:
+    if owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="You do not have access to this portfolio")
 
     # Удаляем позицию из базы данных
-    db.delete(position)
-    db.commit()
+    await db.delete(position)
+    await apply_delta(
+        db, position.portfolio_id,
+        -position.amount * position.average_price,
+        -position.amount * last_price(position.stock_id),
+    )
+    await db.commit()
 
     return {"message": "Portfolio position deleted successfully"}
 
 
 @router.get("/api/portfolios/{portfolio_id}/positions", response_model=list[PortfolioPositionSchema])
-def read_portfolio_positions(portfolio_id: UUID, db: Session = Depends(get_db)):
-    positions = db.query(PortfolioPosition).filter(PortfolioPosition.portfolio_id == portfolio_id).all()
+async def read_portfolio_positions(portfolio_id: UUID, db: AsyncSession = Depends(get_read_db)):
+    result = await db.execute(select(PortfolioPosition).where(PortfolioPosition.portfolio_id == portfolio_id))
+    positions = result.scalars().all()
     return positions
\ No newline at end of file
@@ -1,28 +1,82 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
-from models import Stock
-from schemas import Stock as StockSchema, StockCreate as StockCreateSchema
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, get_read_db
+from models import Stock, User as UserModel
+from schemas import Candle as CandleSchema, Stock as StockSchema, StockCreate as StockCreateSchema, StockImportReport, StockSearchResult
 from uuid import UUID, uuid4
 from datetime import datetime
+from typing import Optional
+from price_feed import DEFAULT_WINDOW, ingest_stream
+from stock_import import CHUNK as IMPORT_CHUNK, MAX_CHUNK as IMPORT_MAX_CHUNK, import_stream
+from price_stream import broker
+from catalog_cache import catalog_cache, etag_matches
+from search_index import MAX_LIMIT as SEARCH_MAX_LIMIT, search_index
+from routers.users import get_current_user
+import price_history
+import serialization
 
 router = APIRouter()
 
+async def render_catalog(db: AsyncSession, media_type: str = serialization.JSON) -> bytes:
+    # Строки кодируются в байты без промежуточных объектов
+    result = await db.execute(select(Stock.id, Stock.symbol, Stock.name, Stock.last_price, Stock.currency))
+    return serialization.encode(StockSchema, result.all(), media_type, result.keys())
+
 @router.get("/api/stocks", response_model=list[StockSchema])
-def read_stocks(db: Session = Depends(get_db)):
-    stocks = db.query(Stock).all()
-    return stocks
+async def read_stocks(request: Request, db: AsyncSession = Depends(get_read_db)):
+    # Каталог отдаётся готовыми байтами из кэша; клиент с актуальным ETag получает 304
+    media_type = serialization.negotiate(request.headers.get("accept"))
+    body, etag = await catalog_cache.get(lambda: render_catalog(db, media_type), media_type)
+    headers = {"ETag": etag, "Vary": "Accept"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+@router.get("/api/stocks/search", response_model=list[StockSearchResult])
+async def search_stocks(
+    q: str,
+    limit: int = Query(10, ge=1, le=SEARCH_MAX_LIMIT)):
+    # Поиск идёт по индексу в памяти; до первой сборки запрос ждёт фоновую, не занимая цикл событий
+    if not search_index.built:
+        await search_index.ready()
+    elif search_index.stale():
+        # Устаревший индекс отвечает, пока новый собирается в фоне
+        search_index.refresh()
+    return search_index.search(q, limit)
 
 @router.get("/api/stocks/{stock_id}", response_model=StockSchema)
-def read_stock(stock_id: UUID, db: Session = Depends(get_db)):
-    stock = db.query(Stock).filter(Stock.id == stock_id).first()
+async def read_stock(stock_id: UUID, db: AsyncSession = Depends(get_read_db)):
+    result = await db.execute(select(Stock).where(Stock.id == stock_id))
+    stock = result.scalars().first()
     return stock
 
+@router.get("/api/stocks/{stock_id}/candles", response_model=list[CandleSchema])
+async def read_candles(
+    stock_id: UUID,
+    interval: str = "1m",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(500, ge=1, le=price_history.MAX_CANDLES),
+    db: AsyncSession = Depends(get_read_db)):
+    try:
+        seconds = price_history.parse_interval(interval)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    result = await db.execute(select(Stock.id).where(Stock.id == stock_id))
+    if result.scalar() is None:
+        raise HTTPException(status_code=404, detail="Stock not found")
+    # Свечи собираются из свёрток 1m/1h/1d или из сырых тиков для мелких интервалов
+    return await db.run_sync(
+        lambda session: price_history.candles(session.connection(), stock_id, seconds, start, end, limit)
+    )
+
 @router.post("/api/stocks", response_model=StockSchema)
-def create_stock(
+async def create_stock(
     stock: StockCreateSchema,
-    db: Session = Depends(get_db)):
-    db_stock = db.query(Stock).filter(Stock.symbol == stock.symbol).first()
+    db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(Stock).where(Stock.symbol == stock.symbol))
+    db_stock = result.scalars().first()
     if db_stock:
         raise HTTPException(status_code=400, detail="Stock with this symbol already exists")
 
@@ -36,7 +90,41 @@ def create_stock(
     )
 
     db.add(new_stock)
-    db.commit()
-    db.refresh(new_stock)
+    await db.commit()
+    catalog_cache.bump()
+    search_index.add(new_stock.id, new_stock.symbol, new_stock.name, new_stock.currency)
+    broker.publish([{"symbol": new_stock.symbol, "price": new_stock.last_price, "ts": new_stock.last_updated}])
+
+    return new_stock
+
+@router.post("/api/stocks/ticks", response_model=dict)
+async def ingest_ticks(
+    request: Request,
+    format: Optional[str] = None,
+    window: float = DEFAULT_WINDOW,
+    current_user: UserModel = Depends(get_current_user),  # Тики двигают оценку чужих портфелей
+    db: AsyncSession = Depends(get_async_db)):
+    # Тело читается потоком: NDJSON по умолчанию, CSV по format=csv или Content-Type
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Format must be ndjson or csv")
+    try:
+        return await ingest_stream(db, request.stream(), fmt, window)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Malformed tick: {exc}")
 
-    return new_stock
\ No newline at end of file
+@router.post("/api/stocks/import", response_model=StockImportReport)
+async def import_stocks(
+    request: Request,
+    format: Optional[str] = None,
+    chunk: int = Query(IMPORT_CHUNK, ge=1, le=IMPORT_MAX_CHUNK),
+    current_user: UserModel = Depends(get_current_user),  # Импорт переписывает цены существующих акций
+    db: AsyncSession = Depends(get_async_db)):
+    # Листинг читается потоком и пишется пачками upsert по символу; плохие строки попадают в отчёт
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Format must be ndjson or csv")
+    try:
+        return await import_stream(db, request.stream(), fmt, chunk)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
@@ -0,0 +1,75 @@
+from fastapi import APIRouter, HTTPException, Request, WebSocket
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+import os
+from price_stream import broker, parse_symbols
+
+router = APIRouter()
+
+# Клиент, не принявший данные за это время, отключается
+SEND_TIMEOUT = float(os.getenv("STREAM_SEND_TIMEOUT", "10"))
+SSE_HEARTBEAT = float(os.getenv("STREAM_SSE_HEARTBEAT", "15"))
+
+
+async def _pump(websocket: WebSocket, subscription):
+    while True:
+        updates = await subscription.get()
+        await asyncio.wait_for(websocket.send_text(json.dumps(updates)), SEND_TIMEOUT)
+
+
+async def _wait_disconnect(websocket: WebSocket):
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+@router.websocket("/api/stream/prices")
+async def stream_prices_ws(websocket: WebSocket, symbols: str = ""):
+    try:
+        wanted = parse_symbols(symbols)
+    except ValueError as exc:
+        await websocket.close(code=1008, reason=str(exc))
+        return
+    await websocket.accept()
+
+    subscription = broker.subscribe(wanted)
+    pump = asyncio.create_task(_pump(websocket, subscription))
+    receiver = asyncio.create_task(_wait_disconnect(websocket))
+    try:
+        done, pending = await asyncio.wait({pump, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if pump in done and isinstance(pump.exception(), asyncio.TimeoutError):
+            # Медленный потребитель: освобождаем ресурсы, клиент переподключится
+            await websocket.close(code=1013, reason="Slow consumer")
+    finally:
+        broker.unsubscribe(subscription)
+
+
+@router.get("/api/stream/prices/sse")
+async def stream_prices_sse(request: Request, symbols: str = ""):
+    try:
+        wanted = parse_symbols(symbols)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    async def events():
+        subscription = broker.subscribe(wanted)
+        try:
+            while not await request.is_disconnected():
+                try:
+                    updates = await asyncio.wait_for(subscription.get(), SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"data: {json.dumps(updates)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
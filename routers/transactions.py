@@ -1,20 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, get_read_db
 from models import Transaction, Stock, User as UserModel
 from schemas import TransactionCreate, Transaction as TransactionSchema, TransactionHistory
-from schemas import TransactionCreate, TransactionSchema
+from schemas import TransactionCreate, TransactionSchema, BatchOrderRequest, BatchOrderResponse
 from models import Portfolio, PortfolioPosition, Stock
 import uuid
 from uuid import uuid4
 from datetime import datetime
+from typing import Optional
+from pagination import decode_cursor, encode_cursor
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+import serialization
+import transaction_export
 from routers.users import get_current_user
+from trading import execute_batch, execute_buy, execute_sell
+from schemas import OrderStatus
+from order_queue import ENABLED as ORDER_QUEUE_ENABLED, order_queue
+from market import market
 
 
 router = APIRouter()
 
 @router.post("/api/transaction", response_model=TransactionSchema)
-def view_transaction(transaction: TransactionCreate, db: Session = Depends(get_db)):
+async def view_transaction(transaction: TransactionCreate, db: AsyncSession = Depends(get_async_db)):
     db_transaction = Transaction(
         id=uuid.uuid4(),
         user_id=uuid.uuid4(),  
@@ -25,21 +36,22 @@ def view_transaction(transaction: TransactionCreate, db: Session = Depends(get_d
         created_at=datetime.utcnow()
     )
     db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
+    await db.commit()
+    market.record(db_transaction.stock_id, db_transaction.amount, db_transaction.price, db_transaction.id)
     return db_transaction
 
 
 @router.post("/api/transactions", response_model=dict)
-def create_transaction(
+async def create_transaction(
     transaction: TransactionCreate,
     current_user: UserModel = Depends(get_current_user),  # Проверяем авторизацию
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     print(current_user.id)
     print(current_user.email)
     # Проверяем, существует ли акция
-    stock = db.query(Stock).filter(Stock.id == transaction.stock_id).first()
+    result = await db.execute(select(Stock).where(Stock.id == transaction.stock_id))
+    stock = result.scalars().first()
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
 
@@ -60,21 +72,17 @@ def create_transaction(
 
     # Добавляем транзакцию в базу данных
     db.add(new_transaction)
-    db.commit()
-    db.refresh(new_transaction)
+    await db.commit()
+    market.record(new_transaction.stock_id, new_transaction.amount, new_transaction.price, new_transaction.id)
 
     return {
         "id": str(new_transaction.id),
         "created_at": new_transaction.created_at
     }
 
-@router.get("/api/transactions/history", response_model=list[TransactionHistory])
-def get_transaction_history(
-    current_user: UserModel = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    # Объединяем таблицы transactions и stocks
-    transactions = db.query(
+def history_query(user_id, limit, cursor=None, symbol=None, type=None, date_from=None, date_to=None):
+    """Страница истории, новые сделки первыми: ORDER BY created_at DESC, id DESC."""
+    query = select(
         Transaction.id,
         Stock.name.label("stock_name"),
         Stock.symbol.label("stock_symbol"),
@@ -84,135 +92,129 @@ def get_transaction_history(
         Transaction.type,
         Transaction.created_at
     ).join(Stock, Transaction.stock_id == Stock.id) \
-     .filter(Transaction.user_id == current_user.id) \
-     .all()
+     .where(Transaction.user_id == user_id)
+
+    if symbol:
+        query = query.where(Transaction.stock_id == select(Stock.id).where(Stock.symbol == symbol).scalar_subquery())
+    if type:
+        query = query.where(Transaction.type == type)
+    if date_from:
+        query = query.where(Transaction.created_at >= date_from)
+    if date_to:
+        query = query.where(Transaction.created_at < date_to)
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        # Первое условие задаёт диапазон по индексу, второе отсекает уже выданные строки
+        query = query.where(
+            Transaction.created_at <= created_at,
+            or_(Transaction.created_at < created_at, Transaction.id < last_id),
+        )
 
-    if not transactions:
-        raise HTTPException(status_code=404, detail="No transactions found for this user")
+    return query.order_by(Transaction.created_at.desc(), Transaction.id.desc()).limit(limit + 1)
 
-    return transactions
 
+@router.get("/api/transactions/history", response_model=list[TransactionHistory])
+async def get_transaction_history(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    symbol: Optional[str] = None,
+    type: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    current_user: UserModel = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    # Объединяем таблицы transactions и stocks, читаем на одну строку больше лимита
+    result = await db.execute(history_query(current_user.id, limit, cursor, symbol, type, date_from, date_to))
+    transactions = result.all()
 
+    if not transactions and cursor is None:
+        raise HTTPException(status_code=404, detail="No transactions found for this user")
 
+    # Курсор следующей страницы отдаётся в заголовке, чтобы не менять схему ответа
+    headers = {}
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        last = transactions[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
 
-@router.post("/api/transactions/buy", response_model=TransactionSchema)
-def buy_stock(
-    transaction_data: TransactionCreate,  # Тело запроса
-    current_user: UserModel = Depends(get_current_user),  # Проверка авторизации
-    db: Session = Depends(get_db)
-):
-    # Проверяем, существует ли акция
-    stock = db.query(Stock).filter(Stock.id == transaction_data.stock_id).first()
-    if not stock:
-        raise HTTPException(status_code=404, detail="Stock not found")
+    # Строки сразу в байты ответа, минуя модели Pydantic
+    return serialization.respond(request, TransactionHistory, transactions, result.keys(), headers)
 
-    # Проверяем, что количество акций положительное
-    if transaction_data.amount <= 0:
-        raise HTTPException(status_code=400, detail="Amount must be greater than 0")
 
-    # Получаем портфель пользователя
-    portfolio = db.query(Portfolio).filter(Portfolio.user_id == current_user.id).first()
-    if not portfolio:
-        raise HTTPException(status_code=404, detail="Portfolio not found for this user")
 
-    # Создаем новую транзакцию
-    new_transaction = Transaction(
-        id=uuid4(),
-        user_id=current_user.id,
-        stock_id=transaction_data.stock_id,
-        amount=transaction_data.amount,
-        price=transaction_data.price,
-        type="BUY",
-        created_at=datetime.utcnow()
-    )
 
-    # Обновляем позицию в портфеле
-    position = db.query(PortfolioPosition).filter(
-        PortfolioPosition.portfolio_id == portfolio.id,
-        PortfolioPosition.stock_id == transaction_data.stock_id
-    ).first()
-
-    if position:
-        # Если позиция уже существует, обновляем её
-        position.amount += transaction_data.amount
-        position.average_price = (
-            (position.average_price * (position.amount - transaction_data.amount)) +
-            (transaction_data.price * transaction_data.amount)
-        ) / position.amount
-    else:
-        # Если позиции нет, создаем новую
-        new_position = PortfolioPosition(
-            id=uuid4(),
-            portfolio_id=portfolio.id,
-            stock_id=transaction_data.stock_id,
-            amount=transaction_data.amount,
-            average_price=transaction_data.price
-        )
-        db.add(new_position)
+@router.get("/api/transactions/export")
+async def export_transaction_history(
+    format: str = "ndjson",
+    current_user: UserModel = Depends(get_current_user)
+):
+    if format not in transaction_export.FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be ndjson or csv")
+
+    # Строки идут из серверного курсора прямо в ответ, без материализации списка
+    query = transaction_export.export_query(current_user.id)
+    return StreamingResponse(
+        transaction_export.stream_export(query, format),
+        media_type=transaction_export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="transactions.{format}"'},
+    )
 
-    # Добавляем транзакцию в базу данных
-    db.add(new_transaction)
-    db.commit()
-    db.refresh(new_transaction)
 
-    return new_transaction
+async def enqueue_order(user_id, transaction_data, type_):
+    # Заявка записана в журнал очереди; исполнит её воркер, статус — /api/orders/{id}
+    order = await order_queue.submit(user_id, transaction_data, type_)
+    return JSONResponse(status_code=202, content=jsonable_encoder(OrderStatus(**order, status="PENDING")))
 
 
-@router.post("/api/transactions/sell", response_model=TransactionSchema)
-def sell_stock(
+@router.post("/api/transactions/buy", response_model=TransactionSchema, responses={202: {"model": OrderStatus}})
+async def buy_stock(
     transaction_data: TransactionCreate,  # Тело запроса
     current_user: UserModel = Depends(get_current_user),  # Проверка авторизации
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Проверяем, существует ли акция
-    stock = db.query(Stock).filter(Stock.id == transaction_data.stock_id).first()
-    if not stock:
-        raise HTTPException(status_code=404, detail="Stock not found")
+    if ORDER_QUEUE_ENABLED:
+        return await enqueue_order(current_user.id, transaction_data, "BUY")
 
-    # Проверяем, что количество акций положительное
-    if transaction_data.amount <= 0:
-        raise HTTPException(status_code=400, detail="Amount must be greater than 0")
+    # Позиция обновляется атомарно вместе с записью транзакции
+    new_transaction = await execute_buy(db, current_user.id, transaction_data)
+    await db.commit()
+    market.record(new_transaction.stock_id, new_transaction.amount, new_transaction.price, new_transaction.id)
 
-    # Получаем портфель пользователя
-    portfolio = db.query(Portfolio).filter(Portfolio.user_id == current_user.id).first()
-    if not portfolio:
-        raise HTTPException(status_code=404, detail="Portfolio not found for this user")
+    return new_transaction
 
-    # Проверяем, есть ли достаточное количество акций для продажи
-    position = db.query(PortfolioPosition).filter(
-        PortfolioPosition.portfolio_id == portfolio.id,
-        PortfolioPosition.stock_id == transaction_data.stock_id
-    ).first()
 
-    if not position or position.amount < transaction_data.amount:
-        raise HTTPException(status_code=400, detail="Not enough stocks to sell")
+@router.post("/api/transactions/sell", response_model=TransactionSchema, responses={202: {"model": OrderStatus}})
+async def sell_stock(
+    transaction_data: TransactionCreate,  # Тело запроса
+    current_user: UserModel = Depends(get_current_user),  # Проверка авторизации
+    db: AsyncSession = Depends(get_async_db)
+):
+    if ORDER_QUEUE_ENABLED:
+        return await enqueue_order(current_user.id, transaction_data, "SELL")
 
-    # Создаем новую транзакцию
-    new_transaction = Transaction(
-        id=uuid4(),
-        user_id=current_user.id,
-        stock_id=transaction_data.stock_id,
-        amount=transaction_data.amount,
-        price=transaction_data.price,
-        type="SELL",
-        created_at=datetime.utcnow()
-    )
+    # Проверка остатка и списание выполняются одним UPDATE
+    new_transaction = await execute_sell(db, current_user.id, transaction_data)
+    await db.commit()
+    market.record(new_transaction.stock_id, new_transaction.amount, new_transaction.price, new_transaction.id)
 
-    # Обновляем позицию в портфеле
-    position.amount -= transaction_data.amount
-    if position.amount == 0:
-        # Если количество акций стало 0, удаляем позицию
-        db.delete(position)
-    else:
-        # Иначе обновляем позицию
-        position.average_price = (
-            (position.average_price * (position.amount + transaction_data.amount)) -
-            (transaction_data.price * transaction_data.amount)
-        ) / position.amount
+    return new_transaction
 
-    # Добавляем транзакцию в базу данных
-    db.add(new_transaction)
-    db.commit()
-    db.refresh(new_transaction)
 
-    return new_transaction
\ No newline at end of file
+@router.post("/api/transactions/batch", response_model=BatchOrderResponse)
+async def batch_orders(
+    batch: BatchOrderRequest,
+    current_user: UserModel = Depends(get_current_user),  # Проверка авторизации
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Все заявки проводятся по порядку и фиксируются одним commit
+    results = await execute_batch(db, current_user.id, batch.orders, atomic=batch.atomic)
+    filled = 0
+    for result in results:
+        if result["status"] == "FILLED":
+            filled += 1
+            transaction = result["transaction"]
+            market.record(transaction["stock_id"], transaction["amount"], transaction["price"], transaction["id"])
+
+    return {"filled": filled, "rejected": len(results) - filled, "results": results}
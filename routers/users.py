@@ -1,39 +1,81 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_read_db
 from models import User as UserModel
 from schemas import User 
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
 from datetime import datetime
 from uuid import UUID
+from typing import NamedTuple
+from cache import TTLCache
+from tokens import EMBED_USER, InvalidToken, decode_token, token_cache
+import os
 
 router = APIRouter()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", )
 
-SECRET_KEY = "secret_key"
-ALGORITHM = "HS256"
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+class UserSnapshot(NamedTuple):
+    """Лёгкая копия пользователя, которую безопасно держать в кэше между запросами."""
+    id: UUID
+    email: str
+    created_at: datetime
+
+
+# Инвалидация ниже видит только ORM-flush в этом процессе: bulk update()/delete()
+# и записи других воркеров она пропускает, и такие изменения доходят до
+# get_current_user не позже чем через USER_CACHE_TTL секунд
+user_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+)
+
+
+@event.listens_for(UserModel, "after_update")
+@event.listens_for(UserModel, "after_delete")
+def _invalidate_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
         user_id = UUID(user_id)
-    except JWTError:
+    except (InvalidToken, ValueError):
         raise credentials_exception
-    user = db.query(UserModel).filter(UserModel.id == user_id).first()
-    if user is None:
+    # Снимок пользователя встроен в токен (JWT_EMBED_USER=1) — база не нужна.
+    # Цена режима — отзыв: удалённый пользователь остаётся аутентифицированным
+    # до истечения токена. Решает настройка, а не наличие claims, так что после
+    # выключения режима старые токены снова проверяются по кэшу и базе
+    if EMBED_USER and "email" in payload:
+        created_at = payload.get("created_at")
+        return UserSnapshot(user_id, payload["email"], datetime.fromisoformat(created_at) if created_at else None)
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    result = await db.execute(
+        select(UserModel.id, UserModel.email, UserModel.created_at).where(UserModel.id == user_id)
+    )
+    row = result.first()
+    if row is None:
         raise credentials_exception
+    user = UserSnapshot(*row)
+    user_cache.set(user_id, user)
     return user
 
 @router.get("/api/users/me", response_model=User) 
-def read_users_me(current_user: UserModel = Depends(get_current_user)):
-    return current_user
\ No newline at end of file
+async def read_users_me(current_user: UserModel = Depends(get_current_user)):
+    return current_user
+
+@router.get("/api/users/cache/stats", response_model=dict)
+async def read_user_cache_stats(current_user: UserModel = Depends(get_current_user)):
+    return {**user_cache.stats(), "tokens": token_cache.stats()}
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
 from uuid import UUID
+from typing import Optional
 
 class UserBase(BaseModel):
     email: EmailStr
@@ -32,6 +33,15 @@ class StockCreate(BaseModel):
     currency: str
     last_price: float
 
+class Candle(BaseModel):
+    time: datetime  # начало свечи, UTC
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    ticks: int
+
 class TransactionCreate(BaseModel):
     stock_id: UUID
     amount: int
@@ -93,6 +103,70 @@ class PortfolioPositionResponse(BaseModel):
 
 class PortfolioValue(BaseModel):
     total_value: float
+    cost_basis: float = 0.0
+    currency: Optional[str] = None
+
+class ValuationPosition(BaseModel):
+    stock_id: UUID
+    symbol: str
+    currency: str  # валюта котировки акции
+    amount: int
+    rate: float  # множитель пересчёта в целевую валюту
+    market_value: float
+    cost_basis: float
+
+class PortfolioValuationReport(BaseModel):
+    currency: str
+    total_value: float
+    cost_basis: float
+    unrealized_pnl: float
+    positions: list[ValuationPosition]
+
+class Currency(BaseModel):
+    id: UUID
+    symbol: str
+    name: Optional[str]
+    exchange_rate: float
+    last_updated: Optional[datetime]
+
+    class Config:
+        orm_mode = True
+
+class CurrencyRate(BaseModel):
+    symbol: str
+    exchange_rate: float = Field(gt=0)
+    name: Optional[str] = None
+
+class CurrencyRatesUpdate(BaseModel):
+    rates: list[CurrencyRate]
+
+
+class AnalyticsPosition(BaseModel):
+    stock_id: UUID
+    symbol: Optional[str]
+    amount: int
+    cost_basis: float
+    market_value: float
+    weight: float
+    realized_pnl: float
+    unrealized_pnl: float
+
+class AnalyticsPoint(BaseModel):
+    date: str
+    market_value: float
+    realized_pnl: float
+    time_weighted_return: float
+
+class PortfolioAnalytics(BaseModel):
+    method: str  # fifo или average
+    transactions: int
+    market_value: float
+    cost_basis: float
+    realized_pnl: float
+    unrealized_pnl: float
+    time_weighted_return: float
+    positions: list[AnalyticsPosition]
+    series: list[AnalyticsPoint]
 
 
 class PortfolioPositionCreate(BaseModel):
@@ -127,4 +201,80 @@ class TransactionSchema(BaseModel):
     created_at: datetime
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+
+class BatchOrderRequest(BaseModel):
+    orders: list[TransactionCreate]
+    atomic: bool = False  # True: при любой ошибке не исполняется ни одна заявка
+
+class BatchOrderResult(BaseModel):
+    index: int
+    status: str  # FILLED или REJECTED
+    transaction: Optional[TransactionSchema] = None
+    error: Optional[str] = None
+
+class BatchOrderResponse(BaseModel):
+    filled: int
+    rejected: int
+    results: list[BatchOrderResult]
+
+class StockSearchResult(BaseModel):
+    id: UUID
+    symbol: str
+    name: Optional[str] = None
+    currency: Optional[str] = None
+    rank: int  # 0 — точный символ, 1 — префикс символа, 2 — начало названия, 3 — префикс слова, 4 — подстрока
+
+class StockImportError(BaseModel):
+    row: int  # номер строки данных, с 1 (без заголовка CSV)
+    error: str
+
+class StockImportReport(BaseModel):
+    rows: int
+    inserted: int
+    updated: int
+    rejected: int
+    errors: list[StockImportError]  # первые stock_import.MAX_ERRORS отклонённых строк
+    elapsed_s: float
+    rows_per_sec: float
+
+class OrderStatus(BaseModel):
+    id: UUID
+    stock_id: UUID
+    amount: int
+    price: float
+    type: str
+    status: str  # PENDING, FILLED или REJECTED
+    error: Optional[str] = None
+    created_at: datetime
+    processed_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+class MostTradedStock(BaseModel):
+    stock_id: UUID
+    symbol: Optional[str] = None
+    trades: int
+    volume: int
+    notional: float
+
+class OpenInterest(BaseModel):
+    stock_id: UUID
+    symbol: Optional[str] = None
+    open_interest: int
+    holders: int
+
+class OpenInterestReport(BaseModel):
+    as_of: Optional[datetime] = None  # время снимка, None — снимок ещё не строился
+    stocks: list[OpenInterest]
+
+class TopHolder(BaseModel):
+    rank: int
+    user_id: UUID
+    amount: int
+
+class StockHolders(OpenInterest):
+    as_of: Optional[datetime] = None
+    top_holders: list[TopHolder]
@@ -0,0 +1,361 @@
+"""Поиск акций по символу и названию: индекс префиксов и триграмм в памяти.
+
+Для автодополнения в памяти процесса держатся:
+    - символы по длине — префикс ищется bisect'ом;
+    - словарь слов названий и списки акций по слову — по префиксу слова;
+    - триграммы символов и названий -> списки акций для поиска подстроки
+      (пересечение начинается с самого редкого списка).
+
+Выдача ранжируется по уровням: точное совпадение символа, префикс символа,
+начало названия, префикс слова названия, подстрока. Внутри уровня короче
+символ — выше. Индекс строится в фоне при старте (первые поиски ждут эту
+сборку, а не строят индекс сами),
+create_stock добавляет акции по одной, импорт каталога — пачками, а на
+случай записи из других воркеров индекс перестраивается в фоне не реже
+SEARCH_INDEX_REFRESH_SECONDS; до конца сборки поиск идёт по прежнему.
+Новый индекс собирается без блокировки и подменяет старый одной
+заменой ссылок; акции, добавленные во время сборки, доносятся в него
+перед подменой.
+"""
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import heapq
+import os
+import threading
+import time
+
+from sqlalchemy import select
+
+from database import AsyncReadSessionLocal
+from models import Stock
+
+REFRESH_SECONDS = float(os.getenv("SEARCH_INDEX_REFRESH_SECONDS", "300"))
+MAX_LIMIT = 50
+
+QUERY = select(Stock.id, Stock.symbol, Stock.name, Stock.currency)
+
+# Уровни ранжирования
+EXACT, SYMBOL_PREFIX, NAME_PREFIX, WORD_PREFIX, SUBSTRING = range(5)
+
+
+def normalize(text) -> str:
+    return " ".join((text or "").casefold().split())
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """Индекс акций; все списки хранят ключи порядка (длина символа, символ, id) по возрастанию.
+
+    Ключ порядка совпадает с ранжированием внутри уровня, поэтому каждый
+    уровень читается по спискам от лучших к худшим и обрывается, как только
+    набрано limit акций: время поиска не зависит от числа совпадений.
+    """
+
+    def __init__(self, refresh_seconds: float = REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.builds = 0
+        self._loaded_at = None
+        self._lock = threading.RLock()
+        self._task = None
+        self._rebuilding = 0  # сколько сборок читают строки или строят индекс
+        self._replay = []  # изменения за время сборки: (метод, аргументы)
+        self._reset()
+
+    def _reset(self):
+        self._entries = {}  # ключ порядка -> акция
+        self._by_id = {}  # stock_id -> ключ порядка
+        self._symbols = {}  # длина символа -> [ключ порядка]
+        self._vocab = []  # слова названий по алфавиту
+        self._words = {}  # слово -> [ключ порядка] акций, где оно есть в названии
+        self._leads = {}  # слово -> [ключ порядка] акций, чьё название с него начинается
+        self._grams = {}  # триграмма символа или названия -> [ключ порядка]
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    @property
+    def built(self) -> bool:
+        return self._loaded_at is not None
+
+    def stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_seconds
+
+    def build(self, connection):
+        """Перестраивает индекс по таблице stocks; connection синхронный."""
+        with self._rebuild():
+            self._load(connection.execute(QUERY).all())
+
+    def load(self, rows):
+        """Перестраивает индекс по строкам (id, symbol, name, currency)."""
+        with self._rebuild():
+            self._load(rows)
+
+    @contextlib.contextmanager
+    def _rebuild(self):
+        # С начала чтения строк add/remove записываются: строки могли их не застать
+        with self._lock:
+            self._rebuilding += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._rebuilding -= 1
+                if not self._rebuilding:
+                    self._replay = []
+
+    def _record(self, method, *args):
+        if self._rebuilding:
+            self._replay.append((method, args))
+
+    def _load(self, rows):
+        # Новый индекс строится без блокировки: поиск тем временем идёт по старому
+        fresh = SearchIndex(self.refresh_seconds)
+        fresh._loaded_at = time.monotonic()
+        # Вставка в порядке ключей держит все списки отсортированными без insort
+        for order, entry in sorted(self._entry(*row) for row in rows):
+            fresh._insert(order, entry, append=True)
+        fresh._vocab = sorted(fresh._words)
+        with self._lock:
+            for method, args in self._replay:
+                getattr(fresh, method)(*args)
+            self._entries, self._by_id, self._symbols = fresh._entries, fresh._by_id, fresh._symbols
+            self._vocab, self._words, self._leads, self._grams = fresh._vocab, fresh._words, fresh._leads, fresh._grams
+            self._loaded_at = time.monotonic()
+            self.builds += 1
+
+    def start(self):
+        """Строит индекс в фоне, не задерживая старт воркера; поиск до конца сборки ждёт её."""
+        if self._task is None:
+            self.refresh()
+
+    async def ready(self):
+        """Дожидается первой сборки: уже идущей фоновой, а если её нет — запускает её."""
+        if self.built:
+            return
+        self.refresh()
+        # shield: отменённый запрос не должен отменять сборку, которую ждут и другие
+        await asyncio.shield(self._task)
+
+    def refresh(self):
+        """Перестраивает индекс в фоне, если сборка ещё не идёт; поиск пока отвечает по текущему."""
+        if self._task is None or self._task.done():
+            # Пустой контекст: иначе задача унаследует счётчики SQL запроса, который её запустил
+            self._task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._warm())
+
+    async def _warm(self):
+        with self._rebuild():
+            async with AsyncReadSessionLocal() as db:
+                rows = (await db.execute(QUERY)).all()
+            # Сборка в потоке: цикл событий продолжает отвечать на запросы
+            await asyncio.to_thread(self._load, rows)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def add(self, stock_id, symbol, name, currency=None):
+        """Добавляет акцию или обновляет её символ и название."""
+        with self._lock:
+            self._record("add", stock_id, symbol, name, currency)
+            if self._loaded_at is None:
+                # Индекс ещё не строился: акция попадёт в него при сборке
+                return
+            self._remove(stock_id)
+            order, entry = self._entry(stock_id, symbol, name, currency)
+            for word in entry["words"]:
+                if word not in self._words:
+                    bisect.insort(self._vocab, word)
+            self._insert(order, entry, append=False)
+
+    def add_many(self, stocks):
+        """Добавляет или обновляет пачку акций [(stock_id, symbol, name, currency)].
+
+        Меняются только списки, в которых акция появилась или пропала; новые
+        ключи дописываются в конец, и каждый затронутый список сортируется
+        один раз на пачку (timsort сливает два отсортированных отрезка).
+        """
+        stocks = list(stocks)
+        with self._lock:
+            self._record("add_many", stocks)
+            if self._loaded_at is None:
+                return
+            dicts = {id(lists): lists for lists in (self._symbols, self._words, self._leads, self._grams)}
+            removed, added = {}, {}  # (словарь, ключ списка) -> ключи порядка
+            for stock in {stock[0]: stock for stock in stocks}.values():
+                order, entry = self._entry(*stock)
+                previous = self._by_id.get(stock[0])
+                if previous == order and self._entries[order]["title"] == entry["title"]:
+                    # Символ и название те же: списки не меняются, только поля выдачи
+                    self._entries[order] = entry
+                    continue
+                old = set()
+                if previous is not None:
+                    old = {(id(lists), index) for index, lists in self._postings(previous, self._entries.pop(previous))}
+                new = {(id(lists), index) for index, lists in self._postings(order, entry)}
+                self._entries[order] = entry
+                self._by_id[stock[0]] = order
+                # Ключ порядка не изменился — списки, где акция уже есть, не трогаем
+                for key in (old - new if previous == order else old):
+                    removed.setdefault(key, set()).add(previous)
+                for key in (new - old if previous == order else new):
+                    added.setdefault(key, []).append(order)
+
+            gone, fresh = set(), []  # слова, чьи списки опустели или появились
+            for (lists_id, index), orders in removed.items():
+                lists = dicts[lists_id]
+                postings = [order for order in lists[index] if order not in orders]
+                if postings:
+                    lists[index] = postings
+                else:
+                    del lists[index]
+                    if lists is self._words:
+                        gone.add(index)
+            for (lists_id, index), orders in added.items():
+                lists = dicts[lists_id]
+                if lists is self._words and index not in lists:
+                    fresh.append(index)
+                postings = lists.setdefault(index, [])
+                postings.extend(orders)
+                postings.sort()
+            # Слово, чей список опустел и наполнился в той же пачке, в словаре уже есть
+            fresh = [word for word in fresh if word not in gone]
+            gone = {word for word in gone if word not in self._words}
+            if gone:
+                self._vocab = [word for word in self._vocab if word not in gone]
+            if fresh:
+                self._vocab.extend(fresh)
+                self._vocab.sort()
+
+    def remove(self, stock_id):
+        with self._lock:
+            self._record("remove", stock_id)
+            self._remove(stock_id)
+
+    def _remove(self, stock_id):
+        with self._lock:
+            order = self._by_id.pop(stock_id, None)
+            if order is None:
+                return
+            entry = self._entries.pop(order)
+            for index, lists in self._postings(order, entry):
+                postings = lists[index]
+                position = bisect.bisect_left(postings, order)
+                if position < len(postings) and postings[position] == order:
+                    del postings[position]
+                if not postings:
+                    del lists[index]
+            for word in entry["words"]:
+                if word not in self._words:
+                    del self._vocab[bisect.bisect_left(self._vocab, word)]
+
+    @staticmethod
+    def _entry(stock_id, symbol, name, currency):
+        key, title = normalize(symbol), normalize(name)
+        entry = {
+            "result": {"id": stock_id, "symbol": symbol, "name": name, "currency": currency},
+            "key": key, "title": title, "words": sorted(set(title.split())),
+        }
+        return (len(key), key, str(stock_id)), entry
+
+    def _postings(self, order, entry):
+        """Пары (ключ, словарь списков), в которые входит акция."""
+        yield order[0], self._symbols
+        for word in entry["words"]:
+            yield word, self._words
+        if entry["title"]:
+            yield entry["title"].split()[0], self._leads
+        for gram in trigrams(entry["key"]) | trigrams(entry["title"]):
+            yield gram, self._grams
+
+    def _insert(self, order, entry, append):
+        self._entries[order] = entry
+        self._by_id[entry["result"]["id"]] = order
+        for index, lists in self._postings(order, entry):
+            postings = lists.setdefault(index, [])
+            if append:
+                postings.append(order)
+            else:
+                bisect.insort(postings, order)
+
+    def _vocab_prefixed(self, prefix):
+        index = bisect.bisect_left(self._vocab, prefix)
+        while index < len(self._vocab) and self._vocab[index].startswith(prefix):
+            yield self._vocab[index]
+            index += 1
+
+    def _merged(self, lists, prefix):
+        """Ключи акций со словом на prefix, по возрастанию (с повторами)."""
+        return heapq.merge(*(lists[word] for word in self._vocab_prefixed(prefix) if word in lists))
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """Лучшие limit акций для запроса; пустой запрос — пустая выдача."""
+        q = normalize(query)
+        if not q or limit <= 0:
+            return []
+        found = {}  # ключ порядка -> уровень, в порядке выдачи
+
+        def take(orders, tier, match=None):
+            for order in orders:
+                if len(found) >= limit:
+                    return
+                if order not in found and (match is None or match(entries[order])):
+                    found[order] = tier
+
+        with self._lock:
+            # Акции и списки берутся под одной блокировкой: _load подменяет их вместе
+            entries = self._entries
+            # Символы короче запроса совпасть не могут; длина запроса — точное совпадение
+            for length in sorted(n for n in self._symbols if n >= len(q)):
+                postings = self._symbols[length]
+                index = bisect.bisect_left(postings, (length, q))
+                matches = []
+                while index < len(postings) and postings[index][1].startswith(q) and len(matches) < limit:
+                    matches.append(postings[index])
+                    index += 1
+                take(matches, EXACT if length == len(q) else SYMBOL_PREFIX)
+            parts = q.split()
+            # В запросе из нескольких слов первое слово названия должно совпасть целиком
+            leads = self._merged(self._leads, q) if len(parts) == 1 else self._leads.get(parts[0], [])
+            take(leads, NAME_PREFIX, lambda entry: entry["title"].startswith(q))
+            # Ведущим берём слово запроса с самыми короткими списками, остальные проверяем по акции
+            expanded = [set(self._vocab_prefixed(part)) for part in parts]
+            lead = min(expanded, key=lambda words: sum(len(self._words[word]) for word in words))
+            take(
+                heapq.merge(*(self._words[word] for word in lead)), WORD_PREFIX,
+                lambda entry: not any(words.isdisjoint(entry["words"]) for words in expanded),
+            )
+            if len(q) >= 3:
+                take(self._containing(q), SUBSTRING, lambda entry: q in entry["key"] or q in entry["title"])
+            return [dict(entries[order]["result"], rank=tier) for order, tier in found.items()]
+
+    def _containing(self, q):
+        """Ключи акций, у которых есть все триграммы q, по возрастанию."""
+        postings = sorted((self._grams.get(gram, []) for gram in trigrams(q)), key=len)
+        if not postings[0]:
+            return
+        smallest, others = postings[0], postings[1:]
+        for order in smallest:
+            for other in others:
+                index = bisect.bisect_left(other, order)
+                if index == len(other) or other[index] != order:
+                    break
+            else:
+                yield order
+
+    def stats(self) -> dict:
+        return {
+            "stocks": len(self._by_id),
+            "words": len(self._vocab),
+            "trigrams": len(self._grams),
+            "builds": self.builds,
+        }
+
+
+search_index = SearchIndex()
@@ -0,0 +1,400 @@
+"""Массовый импорт каталога акций: upsert по символу пачками.
+
+Листинг биржи (NDJSON или CSV с колонками symbol[,name][,currency][,last_price])
+читается потоком, строки проверяются и копятся пачками по STOCK_IMPORT_CHUNK.
+Пачка записывается одним IN-запросом за текущими строками, вставкой новых
+символов INSERT ... ON CONFLICT DO NOTHING RETURNING (по ней и считаются
+вставленные) и одним INSERT ... ON CONFLICT (symbol) DO UPDATE на
+остальные (executemany). Пустые поля не затирают существующие значения;
+новый символ без названия, валюты или цены отклоняется. Повтор символа
+в пачке сливается с предыдущей строкой, как при построчной загрузке. Изменение цены
+существующей акции проходит через valuation.apply_price_changes и
+попадает в историю цен (price_history.record), как и поток котировок. Каждая пачка фиксируется своим commit: при обрыве
+загрузки уже записанные пачки остаются.
+
+Тот же путь используют POST /api/stocks/import и командная строка:
+
+    python stock_import.py listings.csv
+    python stock_import.py --generate 100000 > listings.ndjson
+"""
+import argparse
+import codecs
+import csv
+import io
+import json
+import math
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from sqlalchemy import func, select
+
+from catalog_cache import catalog_cache
+from database import dialect_insert
+from fx import normalize as normalize_currency
+from models import Stock
+import price_history
+from price_stream import broker
+from search_index import search_index
+from valuation import apply_price_changes
+
+stocks = Stock.__table__
+
+CHUNK = int(os.getenv("STOCK_IMPORT_CHUNK", "1000"))
+# Верхняя граница пачки для эндпоинта: IN-список символов и память на запрос
+MAX_CHUNK = 5000
+COLUMNS = ("symbol", "name", "currency", "last_price")
+# Сколько отклонённых строк перечислять в отчёте; счётчик rejected учитывает все
+MAX_ERRORS = 100
+# Без этих полей новую акцию не записать: каталог (schemas.Stock) отдаёт их всегда
+REQUIRED_NEW = ("name", "currency", "last_price")
+
+
+def csv_columns(header_line) -> dict:
+    names = [name.strip().lower() for name in next(csv.reader([header_line]))]
+    if "symbol" not in names:
+        raise ValueError("CSV header must contain a symbol column")
+    return {name: names.index(name) for name in COLUMNS if name in names}
+
+
+def iter_rows(lines, fmt="ndjson", columns=None):
+    """Разбирает строки в пары (сырая строка-словарь, ошибка разбора).
+
+    Для CSV без columns первая строка считается заголовком.
+    """
+    if fmt == "csv":
+        lines = iter(lines)
+        if columns is None:
+            header = next(lines, None)
+            if header is None:
+                return
+            columns = csv_columns(header)
+        for row in csv.reader(lines):
+            if row:
+                yield {name: row[index] if index < len(row) else None for name, index in columns.items()}, None
+        return
+    for line in lines:
+        if line.strip():
+            try:
+                raw = json.loads(line)
+            except ValueError as exc:
+                yield None, f"Malformed JSON: {exc}"
+                continue
+            if not isinstance(raw, dict):
+                yield None, "Row must be a JSON object"
+                continue
+            yield raw, None
+
+
+def _text(value):
+    text = str(value).strip() if value is not None else ""
+    return text or None
+
+
+def validate(raw) -> dict:
+    """Проверяет строку листинга; ValueError с причиной, если она не годится."""
+    symbol = _text(raw.get("symbol"))
+    if symbol is None:
+        raise ValueError("Symbol is required")
+    price = raw.get("last_price")
+    if price is not None and price != "":
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid last_price: {price!r}")
+        if not math.isfinite(price) or price < 0:
+            raise ValueError(f"Invalid last_price: {price!r}")
+    else:
+        price = None
+    currency = _text(raw.get("currency"))
+    return {
+        "symbol": symbol,
+        "name": _text(raw.get("name")),
+        "currency": normalize_currency(currency) if currency else None,
+        "last_price": price,
+    }
+
+
+def upsert_stocks(connection, rows) -> tuple:
+    """Записывает пачку проверенных строк; возвращает (итоговые акции, отклонённые строки).
+
+    Каждая акция — словарь полей Stock с флагами inserted и price_changed.
+    Пустое поле значит «оставить прежнее» только для существующей акции:
+    строка нового символа без полей REQUIRED_NEW не записывается.
+    connection синхронный; из AsyncSession функцию вызывают через run_sync.
+    """
+    if not rows:
+        return [], []
+    symbols = [row["symbol"] for row in rows]
+    existing = _current(connection, symbols)
+    incomplete = [
+        row for row in rows
+        if row["symbol"] not in existing and any(row[column] is None for column in REQUIRED_NEW)
+    ]
+    if incomplete:
+        skipped = {row["symbol"] for row in incomplete}
+        rows = [row for row in rows if row["symbol"] not in skipped]
+        if not rows:
+            return [], incomplete
+    now = datetime.utcnow()
+    values = [
+        {"id": uuid4(), **row, "last_updated": now if row["last_price"] is not None else None}
+        for row in rows
+    ]
+    insert_ = dialect_insert(connection)
+
+    # Новые символы вставляются с DO NOTHING: вставленными считаются только строки
+    # из RETURNING. Символ, который параллельный запрос записал после SELECT,
+    # перечитывается и дальше обновляется как существующий
+    fresh = [row for row in values if row["symbol"] not in existing]
+    inserted = set()
+    if fresh:
+        stmt = insert_(stocks).on_conflict_do_nothing(index_elements=[stocks.c.symbol]).returning(stocks.c.symbol)
+        inserted = set(connection.execute(stmt, fresh).scalars())
+        raced = [row["symbol"] for row in fresh if row["symbol"] not in inserted]
+        if raced:
+            existing.update(_current(connection, raced))
+
+    updates = [row for row in values if row["symbol"] not in inserted]
+    if updates:
+        # Один закэшированный оператор на executemany: компиляция VALUES на тысячу строк
+        # стоит дороже самой записи; Postgres-драйвер сам склеивает строки в многострочный INSERT
+        stmt = insert_(stocks)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[stocks.c.symbol],
+            set_={
+                column: func.coalesce(stmt.excluded[column], stocks.c[column])
+                for column in ("name", "currency", "last_price", "last_updated")
+            },
+        )
+        connection.execute(stmt, updates)
+
+    applied, changes = [], []
+    for row in values:
+        if row["symbol"] in inserted:
+            applied.append({**row, "inserted": True, "price_changed": row["last_price"] is not None})
+            continue
+        current = existing[row["symbol"]]
+        stock = {
+            "id": current.id,
+            "symbol": row["symbol"],
+            "name": row["name"] if row["name"] is not None else current.name,
+            "currency": row["currency"] if row["currency"] is not None else current.currency,
+            "last_price": row["last_price"] if row["last_price"] is not None else current.last_price,
+            "last_updated": row["last_updated"],
+            "inserted": False,
+            "price_changed": row["last_price"] is not None and row["last_price"] != current.last_price,
+        }
+        applied.append(stock)
+        if stock["price_changed"]:
+            changes.append({"stock_id": current.id, "delta": row["last_price"] - (current.last_price or 0.0)})
+    # Рыночная стоимость портфелей и свечи следуют за ценой, как при загрузке котировок
+    apply_price_changes(connection, changes)
+    if price_history.ENABLED:
+        moved = [stock for stock in applied if stock["price_changed"]]
+        price_history.record(
+            connection,
+            {stock["symbol"]: stock["id"] for stock in moved},
+            [(stock["symbol"], stock["last_price"], now, 0.0) for stock in moved],
+        )
+    return applied, incomplete
+
+
+def _current(connection, symbols) -> dict:
+    return {
+        row.symbol: row
+        for row in connection.execute(
+            select(stocks.c.id, stocks.c.symbol, stocks.c.name, stocks.c.currency, stocks.c.last_price)
+            .where(stocks.c.symbol.in_(symbols))
+        )
+    }
+
+
+class Importer:
+    """Копит проверенные строки пачки и считает итог загрузки."""
+
+    def __init__(self, chunk_size: int = CHUNK):
+        self.chunk_size = chunk_size
+        self.pending = {}  # symbol -> строка пачки
+        self.rows = self.inserted = self.updated = self.rejected = 0
+        self.errors = []
+        self.indexed = []  # записанные акции для индекса поиска
+        self.sources = {}  # symbol -> (номер последней строки, сколько строк слито) для пачки
+
+    def add(self, raw, error=None):
+        self.rows += 1
+        if error is None:
+            try:
+                row = validate(raw)
+            except ValueError as exc:
+                error = str(exc)
+        if error is not None:
+            self._reject(self.rows, error)
+            return
+        previous = self.pending.get(row["symbol"])
+        if previous is not None:
+            # Повтор символа в пачке: поздняя строка дополняет раннюю, как при построчной загрузке
+            self.updated += 1
+            row = {**previous, **{key: value for key, value in row.items() if value is not None}}
+        self.pending[row["symbol"]] = row
+        self.sources[row["symbol"]] = (self.rows, self.sources.get(row["symbol"], (0, 0))[1] + 1)
+
+    def _reject(self, number, error, count=1):
+        self.rejected += count
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"row": number, "error": error})
+
+    def due(self) -> bool:
+        return len(self.pending) >= self.chunk_size
+
+    def drain(self) -> list:
+        rows, self.pending = list(self.pending.values()), {}
+        return rows
+
+    def applied(self, stocks_, incomplete=()):
+        """Учитывает записанную пачку и обновляет кэши, которые держат каталог."""
+        for row in incomplete:
+            number, count = self.sources[row["symbol"]]
+            # Повторы символа уже посчитаны обновлениями — все его строки отклонены
+            self.updated -= count - 1
+            missing = ", ".join(column for column in REQUIRED_NEW if row[column] is None)
+            self._reject(number, f"New symbol {row['symbol']} requires {missing}", count)
+        self.sources = {}
+        for stock in stocks_:
+            if stock["inserted"]:
+                self.inserted += 1
+            else:
+                self.updated += 1
+        self.indexed.extend((stock["id"], stock["symbol"], stock["name"], stock["currency"]) for stock in stocks_)
+        if stocks_:
+            catalog_cache.bump()
+        return [
+            {"symbol": stock["symbol"], "price": stock["last_price"], "ts": stock["last_updated"]}
+            for stock in stocks_ if stock["price_changed"]
+        ]
+
+    def close(self):
+        """Обновляет индекс поиска всеми записанными акциями разом: один проход по спискам на импорт."""
+        indexed, self.indexed = self.indexed, []
+        search_index.add_many(indexed)
+
+    def report(self, elapsed) -> dict:
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "elapsed_s": round(elapsed, 3),
+            "rows_per_sec": round(self.rows / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+async def import_stream(db, chunks, fmt="ndjson", chunk_size=CHUNK) -> dict:
+    """Импортирует листинг из асинхронного потока байтов (тело HTTP-запроса)."""
+    started = time.perf_counter()
+    importer = Importer(chunk_size)
+
+    async def flush():
+        rows = importer.drain()
+        applied, incomplete = await db.run_sync(lambda session: upsert_stocks(session.connection(), rows))
+        await db.commit()
+        broker.publish(importer.applied(applied, incomplete))
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    columns = None
+    try:
+        async for chunk in chunks:
+            buffer += decoder.decode(chunk)
+            lines = buffer.split("\n")
+            buffer = lines.pop()
+            if fmt == "csv" and columns is None and lines:
+                columns = csv_columns(lines.pop(0))
+            for raw, error in iter_rows(lines, fmt, columns):
+                importer.add(raw, error)
+                if importer.due():
+                    await flush()
+        buffer += decoder.decode(b"", final=True)
+        if buffer.strip():
+            if fmt == "csv" and columns is None:
+                columns = csv_columns(buffer)
+            else:
+                for raw, error in iter_rows([buffer], fmt, columns):
+                    importer.add(raw, error)
+        if importer.pending:
+            await flush()
+    finally:
+        # Записанные пачки попадают в индекс и при обрыве загрузки
+        importer.close()
+
+    return importer.report(time.perf_counter() - started)
+
+
+def import_lines(engine, lines, fmt="ndjson", chunk_size=CHUNK) -> dict:
+    """Синхронный импорт из итерируемого набора строк (CLI, бенчмарки)."""
+    started = time.perf_counter()
+    importer = Importer(chunk_size)
+
+    def flush():
+        rows = importer.drain()
+        with engine.begin() as connection:
+            applied, incomplete = upsert_stocks(connection, rows)
+        importer.applied(applied, incomplete)
+
+    try:
+        for raw, error in iter_rows(lines, fmt):
+            importer.add(raw, error)
+            if importer.due():
+                flush()
+        if importer.pending:
+            flush()
+    finally:
+        importer.close()
+    return importer.report(time.perf_counter() - started)
+
+
+def generate_listing(count, seed=None, prefix=""):
+    """Синтетический листинг: уникальные символы из 3–6 букв с ценами."""
+    rng = random.Random(seed)
+    symbols = set()
+    while len(symbols) < count:
+        symbols.add(prefix + "".join(rng.choices(string.ascii_uppercase, k=rng.randint(3, 6))))
+    for symbol in sorted(symbols):
+        yield json.dumps({
+            "symbol": symbol,
+            "name": f"{symbol.title()} Holdings",
+            "currency": rng.choice(("USD", "EUR", "RUB")),
+            "last_price": round(rng.uniform(1, 500), 2),
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk stock catalog import")
+    parser.add_argument("path", nargs="?", help="файл листинга, '-' для stdin")
+    parser.add_argument("--format", choices=["ndjson", "csv"])
+    parser.add_argument("--chunk", type=int, default=CHUNK)
+    parser.add_argument("--generate", type=int, metavar="N", help="вывести листинг из N акций в stdout")
+    args = parser.parse_args()
+
+    if args.generate:
+        for line in generate_listing(args.generate):
+            sys.stdout.write(line + "\n")
+        return
+    if not args.path:
+        parser.error("path or --generate is required")
+
+    from database import engine
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    stream = sys.stdin if args.path == "-" else io.open(args.path, newline="")
+    with stream:
+        print(json.dumps(import_lines(engine, stream, fmt, args.chunk)))
+
+
+if __name__ == "__main__":
+    main()
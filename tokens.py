@@ -0,0 +1,162 @@
+"""Выпуск и проверка JWT с ротацией ключей по kid.
+
+Ключи задаются окружением:
+    JWT_KEYS        — "kid:secret,kid:secret"; без неё используется один ключ
+                      "default" из JWT_SECRET_KEY (по умолчанию прежний "secret_key");
+    JWT_ACTIVE_KID  — каким ключом подписывать новые токены (первый из JWT_KEYS);
+    JWT_ALGORITHM   — HS256 / HS384 / HS512 (HS256).
+Для ротации новый ключ добавляется в JWT_KEYS и делается активным, а
+старый удаляется после истечения выданных им токенов. Токены без kid
+(выпущенные до ротации) проверяются активным ключом.
+
+Проверка подписи не проходит через jose.jwt.decode: для каждого ключа
+заранее вычислено состояние HMAC, и на запрос остаётся copy() + update().
+Проверенные токены кэшируются по sha256 до своего exp, так что повторные
+запросы с тем же токеном не проверяют подпись вовсе.
+
+С JWT_EMBED_USER=1 в токен кладётся снимок пользователя (email, created_at),
+и get_current_user обходится без обращения к базе и кэшу пользователей.
+Отзыва в этом режиме нет: удалённый пользователь проходит проверку, пока
+не истечёт его токен.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from cache import TTLCache
+
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "500"))
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+EMBED_USER = os.getenv("JWT_EMBED_USER", "0") == "1"
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "50000"))
+# Верхняя граница жизни записи: после удаления ключа токены им подписанные
+# перестают приниматься не позже чем через это время
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+_DIGESTS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _parse_keys(setting):
+    keys = {}
+    for item in setting.split(","):
+        kid, sep, secret = item.strip().partition(":")
+        if not sep or not kid or not secret:
+            raise ValueError(f"JWT_KEYS: expected kid:secret, got {item!r}")
+        keys[kid] = secret
+    return keys
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+class Keyring:
+    def __init__(self, keys: dict, active_kid: str = None, algorithm: str = ALGORITHM):
+        if algorithm not in _DIGESTS:
+            raise ValueError(f"Unsupported JWT algorithm {algorithm}")
+        if not keys:
+            raise ValueError("Keyring is empty")
+        self.algorithm = algorithm
+        self.active_kid = active_kid or next(iter(keys))
+        if self.active_kid not in keys:
+            raise ValueError(f"Active kid {self.active_kid!r} is not in the keyring")
+        self._secrets = dict(keys)
+        # Состояние HMAC после обработки ключа; на каждую проверку — только copy()
+        self._macs = {
+            kid: hmac.new(secret.encode(), digestmod=_DIGESTS[algorithm])
+            for kid, secret in keys.items()
+        }
+
+    @property
+    def kids(self):
+        return list(self._secrets)
+
+    def active_secret(self) -> str:
+        return self._secrets[self.active_kid]
+
+    def verify(self, token: str) -> dict:
+        """Проверяет подпись и exp; возвращает claims или бросает InvalidToken."""
+        try:
+            signing_input, _, signature = token.rpartition(".")
+            header_segment, _, payload_segment = signing_input.partition(".")
+            header = json.loads(_b64decode(header_segment))
+            if header.get("alg") != self.algorithm:
+                raise InvalidToken("Unexpected algorithm")
+            mac = self._macs.get(header.get("kid", self.active_kid))
+            if mac is None:
+                raise InvalidToken("Unknown key id")
+            mac = mac.copy()
+            mac.update(signing_input.encode("ascii"))
+            if not hmac.compare_digest(mac.digest(), _b64decode(signature)):
+                raise InvalidToken("Signature verification failed")
+            claims = json.loads(_b64decode(payload_segment))
+        except (ValueError, TypeError, AttributeError, binascii.Error, UnicodeError):
+            raise InvalidToken("Malformed token")
+        if not isinstance(claims, dict):
+            raise InvalidToken("Malformed token")
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)) or exp <= time.time():
+            raise InvalidToken("Token expired")
+        return claims
+
+
+def _keyring_from_env():
+    setting = os.getenv("JWT_KEYS")
+    keys = _parse_keys(setting) if setting else {"default": os.getenv("JWT_SECRET_KEY", "secret_key")}
+    return Keyring(keys, os.getenv("JWT_ACTIVE_KID"))
+
+
+keyring = _keyring_from_env()
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+
+def set_keyring(new_keyring: Keyring):
+    """Замена ключей на лету: проверенные старыми ключами токены забываются."""
+    global keyring
+    keyring = new_keyring
+    token_cache.clear()
+
+
+def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
+    from jose import jwt
+
+    to_encode = data.copy()
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    to_encode.update({"exp": expire})
+    return jwt.encode(
+        to_encode,
+        keyring.active_secret(),
+        algorithm=keyring.algorithm,
+        headers={"kid": keyring.active_kid},
+    )
+
+
+def user_claims(user) -> dict:
+    """Claims для токена пользователя; снимок добавляется только при JWT_EMBED_USER=1."""
+    claims = {"sub": str(user.id)}
+    if EMBED_USER:
+        claims["email"] = user.email
+        claims["created_at"] = user.created_at.isoformat() if user.created_at else None
+    return claims
+
+
+def decode_token(token: str) -> dict:
+    key = hashlib.sha256(token.encode()).digest()
+    claims = token_cache.get(key)
+    if claims is not None:
+        # TTL записи идёт по monotonic, а exp — по системным часам
+        if claims["exp"] > time.time():
+            return claims
+        token_cache.invalidate(key)
+    claims = keyring.verify(token)
+    token_cache.set(key, claims, ttl=min(TOKEN_CACHE_TTL, claims["exp"] - time.time()))
+    return claims
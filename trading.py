@@ -0,0 +1,279 @@
+"""Исполнение сделок покупки и продажи.
+
+Позиция меняется одним атомарным оператором: покупка — INSERT ... ON CONFLICT
+DO UPDATE, продажа — UPDATE с условием amount >= :amount. Блокировку строки
+берёт сама СУБД (row lock в Postgres, write lock в SQLite), поэтому отдельный
+SELECT ... FOR UPDATE не нужен и параллельные продажи не уводят позицию в минус.
+Функции не делают commit — это решает вызывающий код.
+
+Пакетное исполнение (execute_batch) читает акции и позиции одним IN-запросом,
+проводит заявки по порядку в памяти и записывает итог с проверкой, что строки
+позиций не изменились с момента чтения (compare-and-set). При гонке пакет
+повторяется целиком.
+"""
+import os
+from datetime import datetime
+from uuid import uuid4
+
+from fastapi import HTTPException
+from sqlalchemy import case, delete, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+
+from database import dialect_insert
+from models import Portfolio, PortfolioPosition, Stock, Transaction
+from valuation import apply_delta, last_price
+
+positions = PortfolioPosition.__table__
+transactions = Transaction.__table__
+
+MAX_BATCH_ORDERS = int(os.getenv("MAX_BATCH_ORDERS", "1000"))
+BATCH_RETRIES = 3
+
+
+class BatchConflict(Exception):
+    pass
+
+
+def _insert(db):
+    return dialect_insert(db.get_bind())
+
+
+def _portfolio_id(user_id):
+    return select(Portfolio.id).where(Portfolio.user_id == user_id).limit(1).scalar_subquery()
+
+
+async def _raise_missing(db, user_id, stock_id):
+    # Одним запросом выясняем, чего не хватило для сделки
+    result = await db.execute(select(
+        select(Stock.id).where(Stock.id == stock_id).scalar_subquery(),
+        _portfolio_id(user_id),
+    ))
+    stock_exists, portfolio_id = result.one()
+    if stock_exists is None:
+        raise HTTPException(status_code=404, detail="Stock not found")
+    if portfolio_id is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found for this user")
+
+
+def _check_amount(amount):
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be greater than 0")
+
+
+def _new_transaction(user_id, data, type_):
+    return Transaction(
+        id=uuid4(),
+        user_id=user_id,
+        stock_id=data.stock_id,
+        amount=data.amount,
+        price=data.price,
+        type=type_,
+        created_at=datetime.utcnow()
+    )
+
+
+async def execute_buy(db, user_id, data) -> Transaction:
+    _check_amount(data.amount)
+
+    # INSERT ... SELECT: строка появится только если есть и портфель, и акция
+    source = select(
+        literal(uuid4(), positions.c.id.type),
+        Portfolio.id,
+        literal(data.stock_id, positions.c.stock_id.type),
+        literal(data.amount, positions.c.amount.type),
+        literal(data.price, positions.c.average_price.type),
+    ).where(
+        Portfolio.id == _portfolio_id(user_id),
+        select(Stock.id).where(Stock.id == data.stock_id).exists(),
+    )
+    stmt = _insert(db)(positions).from_select(
+        ["id", "portfolio_id", "stock_id", "amount", "average_price"], source
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[positions.c.portfolio_id, positions.c.stock_id],
+        set_={
+            "amount": positions.c.amount + stmt.excluded.amount,
+            "average_price": (
+                positions.c.average_price * positions.c.amount
+                + stmt.excluded.average_price * stmt.excluded.amount
+            ) / (positions.c.amount + stmt.excluded.amount),
+        },
+    )
+    result = await db.execute(stmt.returning(positions.c.portfolio_id))
+    portfolio_id = result.scalar()
+    if portfolio_id is None:
+        await _raise_missing(db, user_id, data.stock_id)
+
+    # Себестоимость растёт на price * amount, рыночная стоимость — по last_price
+    await apply_delta(
+        db, portfolio_id,
+        data.price * data.amount,
+        data.amount * last_price(data.stock_id),
+    )
+
+    transaction = _new_transaction(user_id, data, "BUY")
+    db.add(transaction)
+    await db.flush()
+    return transaction
+
+
+async def execute_sell(db, user_id, data) -> Transaction:
+    _check_amount(data.amount)
+
+    owned = (
+        (positions.c.portfolio_id == _portfolio_id(user_id))
+        & (positions.c.stock_id == data.stock_id)
+    )
+    remaining = positions.c.amount - data.amount
+    result = await db.execute(
+        update(positions)
+        .where(owned, positions.c.amount >= data.amount)
+        .values(
+            amount=remaining,
+            average_price=case(
+                (remaining > 0,
+                 (positions.c.average_price * positions.c.amount - data.price * data.amount) / remaining),
+                else_=positions.c.average_price,
+            ),
+        )
+        .returning(positions.c.portfolio_id, positions.c.amount, positions.c.average_price)
+    )
+    row = result.first()
+    if row is None:
+        await _raise_missing(db, user_id, data.stock_id)
+        raise HTTPException(status_code=400, detail="Not enough stocks to sell")
+
+    # При закрытии позиции average_price не меняется, списываем её себестоимость целиком
+    cost_delta = -row.average_price * data.amount if row.amount == 0 else -data.price * data.amount
+    await apply_delta(db, row.portfolio_id, cost_delta, -data.amount * last_price(data.stock_id))
+
+    # Если количество акций стало 0, удаляем позицию
+    await db.execute(delete(positions).where(owned, positions.c.amount == 0))
+
+    transaction = _new_transaction(user_id, data, "SELL")
+    db.add(transaction)
+    await db.flush()
+    return transaction
+
+
+def _apply_order(position, order):
+    """Проводит заявку по позиции [amount, average_price] в памяти."""
+    amount, average_price = position
+    if order.type == "BUY":
+        new_amount = amount + order.amount
+        position[1] = (average_price * amount + order.price * order.amount) / new_amount
+    else:
+        if amount < order.amount:
+            raise HTTPException(status_code=400, detail="Not enough stocks to sell")
+        new_amount = amount - order.amount
+        if new_amount > 0:
+            position[1] = (average_price * amount - order.price * order.amount) / new_amount
+    position[0] = new_amount
+
+
+async def _write_position(db, portfolio_id, stock_id, loaded, position):
+    if loaded is None:
+        if position[0] > 0:
+            await db.execute(insert(positions).values(
+                id=uuid4(), portfolio_id=portfolio_id, stock_id=stock_id,
+                amount=position[0], average_price=position[1],
+            ))
+        return
+    position_id, amount, average_price = loaded
+    unchanged = (
+        (positions.c.id == position_id)
+        & (positions.c.amount == amount)
+        & (positions.c.average_price == average_price)
+    )
+    if position[0] == 0:
+        result = await db.execute(delete(positions).where(unchanged))
+    else:
+        result = await db.execute(
+            update(positions).where(unchanged).values(amount=position[0], average_price=position[1])
+        )
+    if result.rowcount == 0:
+        raise BatchConflict()
+
+
+async def _execute_batch_once(db, user_id, orders, atomic, ids=None):
+    result = await db.execute(select(Portfolio.id).where(Portfolio.user_id == user_id).limit(1))
+    portfolio_id = result.scalar()
+    if portfolio_id is None:
+        raise HTTPException(status_code=404, detail="Portfolio not found for this user")
+
+    stock_ids = {order.stock_id for order in orders}
+    result = await db.execute(select(Stock.id, Stock.last_price).where(Stock.id.in_(stock_ids)))
+    known_stocks = dict(result.all())
+    result = await db.execute(
+        select(positions.c.stock_id, positions.c.id, positions.c.amount, positions.c.average_price)
+        .where(positions.c.portfolio_id == portfolio_id, positions.c.stock_id.in_(list(known_stocks)))
+    )
+    loaded = {row.stock_id: (row.id, row.amount, row.average_price) for row in result}
+    state = {stock_id: [row[1], row[2]] for stock_id, row in loaded.items()}
+
+    results, new_transactions = [], []
+    for index, order in enumerate(orders):
+        try:
+            if order.type not in ("BUY", "SELL"):
+                raise HTTPException(status_code=400, detail="Transaction type must be BUY or SELL")
+            _check_amount(order.amount)
+            if order.stock_id not in known_stocks:
+                raise HTTPException(status_code=404, detail="Stock not found")
+            position = state.setdefault(order.stock_id, [0, 0.0])
+            _apply_order(position, order)
+        except HTTPException as exc:
+            results.append({"index": index, "status": "REJECTED", "error": exc.detail})
+            continue
+        transaction = {
+            # Очередь заявок передаёт свои id, чтобы повторное применение было идемпотентным
+            "id": ids[index] if ids else uuid4(),
+            "user_id": user_id,
+            "stock_id": order.stock_id,
+            "amount": order.amount,
+            "price": order.price,
+            "type": order.type,
+            "created_at": datetime.utcnow(),
+        }
+        new_transactions.append(transaction)
+        results.append({"index": index, "status": "FILLED", "transaction": transaction})
+
+    rejected = sum(1 for r in results if r["status"] == "REJECTED")
+    if atomic and rejected:
+        for r in results:
+            if r["status"] == "FILLED":
+                r.update(status="REJECTED", transaction=None, error="Batch aborted")
+        return results
+
+    cost_delta = market_delta = 0.0
+    for stock_id, position in state.items():
+        old_amount, old_price = loaded.get(stock_id, (None, 0, 0.0))[1:]
+        if position != [old_amount, old_price]:
+            await _write_position(db, portfolio_id, stock_id, loaded.get(stock_id), position)
+            cost_delta += position[0] * position[1] - old_amount * old_price
+            # Акция без котировки оценивается нулём, как старая цена в price_feed и stock_import
+            market_delta += (position[0] - old_amount) * (known_stocks[stock_id] or 0.0)
+    if new_transactions:
+        await apply_delta(db, portfolio_id, cost_delta, market_delta)
+        await db.execute(insert(transactions), new_transactions)
+    return results
+
+
+async def execute_batch(db, user_id, orders, atomic=False) -> list[dict]:
+    """Исполняет пакет заявок и фиксирует его одним commit."""
+    if len(orders) > MAX_BATCH_ORDERS:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {MAX_BATCH_ORDERS} orders")
+
+    for _ in range(BATCH_RETRIES):
+        try:
+            results = await _execute_batch_once(db, user_id, orders, atomic)
+            await db.commit()
+            return results
+        except (BatchConflict, IntegrityError):
+            # Позиции изменились параллельно — перечитываем и повторяем
+            await db.rollback()
+    raise HTTPException(status_code=409, detail="Positions changed concurrently, retry the batch")
+
+
+async def apply_orders(db, user_id, orders, ids) -> list[dict]:
+    """Проводит заявки одного пользователя без commit: для очереди заявок (order_queue.py)."""
+    return await _execute_batch_once(db, user_id, orders, atomic=False, ids=ids)
@@ -0,0 +1,117 @@
+"""Потоковая выгрузка истории транзакций в NDJSON или CSV.
+
+Строки читаются серверным курсором порциями (yield_per / stream_results)
+и сразу кодируются в текст, поэтому память не растёт с числом строк.
+Эндпоинт GET /api/transactions/export выгружает историю текущего
+пользователя; полная выгрузка по всем пользователям — только из CLI:
+
+    python transaction_export.py --format csv --output all.csv
+    python transaction_export.py --user <uuid> > user.ndjson
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from uuid import UUID
+
+from sqlalchemy import select
+
+from models import Stock, Transaction
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+COLUMNS = ("id", "user_id", "stock_symbol", "stock_name", "amount", "price", "type", "created_at")
+CHUNK_SIZE = 5000
+
+
+def export_query(user_id=None):
+    query = select(
+        Transaction.id,
+        Transaction.user_id,
+        Stock.symbol.label("stock_symbol"),
+        Stock.name.label("stock_name"),
+        Transaction.amount,
+        Transaction.price,
+        Transaction.type,
+        Transaction.created_at,
+    ).join(Stock, Transaction.stock_id == Stock.id)
+    if user_id is not None:
+        query = query.where(Transaction.user_id == user_id)
+    return query.order_by(Transaction.created_at, Transaction.id)
+
+
+def _values(row):
+    return (
+        str(row.id),
+        str(row.user_id),
+        row.stock_symbol,
+        row.stock_name,
+        row.amount,
+        row.price,
+        row.type,
+        row.created_at.isoformat() if row.created_at else None,
+    )
+
+
+def header(fmt) -> str:
+    if fmt == "csv":
+        return ",".join(COLUMNS) + "\r\n"
+    return ""
+
+
+def encode_rows(rows, fmt) -> str:
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(_values(row) for row in rows)
+        return buffer.getvalue()
+    return "".join(json.dumps(dict(zip(COLUMNS, _values(row)))) + "\n" for row in rows)
+
+
+async def stream_export(query, fmt, chunk_size=CHUNK_SIZE):
+    """Асинхронный генератор текстовых кусков для StreamingResponse.
+
+    Открывает собственную сессию чтения: генератор живёт дольше зависимости get_read_db.
+    """
+    from database import AsyncReadSessionLocal
+
+    yield header(fmt)
+    async with AsyncReadSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=chunk_size))
+        async for rows in result.partitions(chunk_size):
+            yield encode_rows(rows, fmt)
+
+
+def export_to(connection, out, query, fmt, chunk_size=CHUNK_SIZE) -> int:
+    """Синхронная выгрузка в файловый объект; возвращает число строк."""
+    out.write(header(fmt))
+    count = 0
+    result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+    for rows in result.partitions(chunk_size):
+        out.write(encode_rows(rows, fmt))
+        count += len(rows)
+    return count
+
+
+def main():
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Stream transaction history export")
+    parser.add_argument("--user", type=UUID, help="только транзакции этого пользователя")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="ndjson")
+    parser.add_argument("--output", help="файл вывода, по умолчанию stdout")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    with engine.connect() as connection:
+        count = export_to(connection, out, export_query(args.user), args.format, args.chunk_size)
+    if args.output:
+        out.close()
+    print(f"Exported {count} transactions", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
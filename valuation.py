@@ -0,0 +1,137 @@
+"""Материализованная стоимость портфелей.
+
+Таблица portfolio_valuations хранит для каждого портфеля
+    cost_basis   = SUM(amount * average_price)
+    market_value = SUM(amount * stocks.last_price)
+и обновляется приращениями: сделки вызывают apply_delta, изменения цен —
+apply_price_changes. Чтение стоимости не сканирует позиции.
+
+Пересборка и проверка согласованности:
+
+    python valuation.py rebuild
+    python valuation.py check
+"""
+import argparse
+import sys
+from datetime import datetime
+
+from sqlalchemy import bindparam, delete, func, insert, literal, select, update
+
+from database import dialect_insert
+from models import PortfolioPosition, PortfolioValuation, Stock
+
+valuations = PortfolioValuation.__table__
+positions = PortfolioPosition.__table__
+
+TOLERANCE = 1e-6
+
+
+def last_price(stock_id):
+    # Без котировки — ноль: NULL в дельте обнулил бы market_value всего портфеля
+    return func.coalesce(select(Stock.last_price).where(Stock.id == stock_id).scalar_subquery(), 0.0)
+
+
+async def apply_delta(db, portfolio_id, cost_delta, market_delta):
+    """Прибавляет приращения к агрегату портфеля (значения или SQL-выражения)."""
+    insert_ = dialect_insert(db.get_bind())
+    stmt = insert_(valuations).values(
+        portfolio_id=portfolio_id,
+        cost_basis=cost_delta,
+        market_value=market_delta,
+        updated_at=datetime.utcnow(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[valuations.c.portfolio_id],
+        set_={
+            "cost_basis": valuations.c.cost_basis + stmt.excluded.cost_basis,
+            "market_value": valuations.c.market_value + stmt.excluded.market_value,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+    await db.execute(stmt)
+
+
+def price_change_statement():
+    """UPDATE для executemany с параметрами stock_id и delta (новая цена минус старая)."""
+    held = (
+        select(positions.c.amount)
+        .where(
+            positions.c.portfolio_id == valuations.c.portfolio_id,
+            positions.c.stock_id == bindparam("stock_id"),
+        )
+        .scalar_subquery()
+    )
+    holders = select(positions.c.portfolio_id).where(positions.c.stock_id == bindparam("stock_id"))
+    return (
+        update(valuations)
+        .where(valuations.c.portfolio_id.in_(holders))
+        .values(market_value=valuations.c.market_value + bindparam("delta") * held)
+    )
+
+
+def apply_price_changes(connection, changes):
+    """changes: список словарей {"stock_id": ..., "delta": ...}; connection синхронный."""
+    changes = [change for change in changes if change["delta"]]
+    if changes:
+        connection.execute(price_change_statement(), changes)
+
+
+def _computed():
+    return (
+        select(
+            positions.c.portfolio_id,
+            func.sum(positions.c.amount * positions.c.average_price).label("cost_basis"),
+            func.sum(positions.c.amount * Stock.last_price).label("market_value"),
+        )
+        .join(Stock, positions.c.stock_id == Stock.id)
+        .group_by(positions.c.portfolio_id)
+    )
+
+
+def rebuild(connection):
+    computed = _computed().subquery()
+    connection.execute(delete(valuations))
+    connection.execute(
+        insert(valuations).from_select(
+            ["portfolio_id", "cost_basis", "market_value", "updated_at"],
+            select(computed, literal(datetime.utcnow(), valuations.c.updated_at.type)),
+        )
+    )
+
+
+def check(connection) -> list:
+    """Возвращает расхождения между агрегатом и пересчётом по позициям."""
+    computed = {row.portfolio_id: row for row in connection.execute(_computed())}
+    stored = {row.portfolio_id: row for row in connection.execute(select(valuations))}
+    mismatches = []
+    for portfolio_id in computed.keys() | stored.keys():
+        expected, actual = computed.get(portfolio_id), stored.get(portfolio_id)
+        for field in ("cost_basis", "market_value"):
+            want = getattr(expected, field) if expected else 0.0
+            have = getattr(actual, field) if actual else 0.0
+            if abs(want - have) > TOLERANCE * max(1.0, abs(want)):
+                mismatches.append({"portfolio_id": portfolio_id, "field": field, "expected": want, "actual": have})
+    return mismatches
+
+
+def main():
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Materialized portfolio valuations")
+    parser.add_argument("command", choices=["rebuild", "check"])
+    args = parser.parse_args()
+
+    with engine.begin() as connection:
+        if args.command == "rebuild":
+            rebuild(connection)
+            print("Rebuilt portfolio valuations")
+            return
+        mismatches = check(connection)
+    for mismatch in mismatches:
+        print(mismatch)
+    print(f"{len(mismatches)} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()